@@ -0,0 +1,349 @@
+"""
+Benchmark of the customer spreadsheet import steps: the old steps, which each re-parsed
+every row with iterrows, against the steps reading the sheet normalized once. The
+old steps take minutes on 100k rows, mostly parsing each row's date.
+
+    python -m benchmarks.customer_sheet --rows 100000
+"""
+import argparse
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from src.data_import import new_customer_data
+from src.data_import.new_customer_data import (
+    CustomerImportSession, process_customer_details, process_order_mappings, process_feedback, process_memory_entries,
+)
+from src.models import Customer, Feedback
+from src.utils import standardize_phone_number, convert_rating, is_valid_email, format_receipt_id, format_receipt_ids
+
+
+class Query:
+    def __init__(self, database, table_name):
+        self.database = database
+        self.table_name = table_name.removesuffix("_testing")
+        self.rows = None
+        self.fields = None
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def update(self, fields):
+        self.fields = fields
+        return self
+
+    def eq(self, column, value):
+        self.key = value
+        return self
+
+    def execute(self):
+        if self.fields is not None:
+            self.database.updates[self.table_name][self.key] = self.fields
+            return SimpleNamespace(data=[])
+        self.database.inserts[self.table_name].extend(dict(row) for row in self.rows)
+        if self.table_name == "customers":
+            for row in self.rows:
+                row["customer_id"] = f"new-{len(self.database.customers)}"
+                self.database.customers[row["phone_number"]] = {
+                    "name": None, "email": None, "address": None, "company_name": None, "is_VIP": False, **row,
+                }
+        return SimpleNamespace(data=self.rows)
+
+
+class Database:
+    """In-memory customers, orders and feedback standing in for Supabase, recording the writes."""
+
+    def __init__(self, customers, orders, feedback):
+        self.customers = {customer["phone_number"]: dict(customer) for customer in customers}
+        self.orders = {order["receipt_id"]: order for order in orders}
+        self.feedback = {fb["customer_id"]: fb for fb in feedback}
+        self.inserts = {"customers": [], "feedback": [], "memory": []}
+        self.updates = {"customers": {}, "orders": {}, "feedback": {}}
+
+    def table(self, table_name):
+        return Query(self, table_name)
+
+    def get_existing_customers(self, phone_numbers, use_test_tables, columns="*", stats=None):
+        return {phone: dict(self.customers[phone]) for phone in phone_numbers if phone in self.customers}
+
+    def get_existing_orders(self, receipt_ids, use_test_tables, columns="*"):
+        return {receipt_id: self.orders[receipt_id] for receipt_id in receipt_ids if receipt_id in self.orders}
+
+    def get_existing_feedback(self, customer_ids, use_test_tables):
+        return {customer_id: self.feedback[customer_id] for customer_id in customer_ids if customer_id in self.feedback}
+
+    def merge_customer_fields(self, patches, use_test_tables):
+        self.updates["customers"].update(patches)
+        phones = {customer["customer_id"]: phone for phone, customer in self.customers.items()}
+        return [{**self.customers[phones[customer_id]], **fields} for customer_id, fields in patches.items()]
+
+    def link_orders_to_customers(self, links, use_test_tables):
+        self.updates["orders"].update({receipt_id: {"customer_id": customer_id} for receipt_id, customer_id in links.items()})
+        return list(links)
+
+
+def legacy_process_customer_details(dataframe, db):
+    """The customer details step the normalized sheet replaced, without its logging."""
+    customers_to_update = {}
+    customers_to_insert = {}
+
+    phone_numbers_to_process = dataframe['Contact Number'].dropna().apply(standardize_phone_number).dropna().unique().tolist()
+    existing_customers_numbers = db.get_existing_customers(phone_numbers_to_process, True)
+
+    for _, row in dataframe.iterrows():
+        phone_number = standardize_phone_number(row.get("Contact Number"))
+        if pd.isna(phone_number) or not phone_number:
+            continue
+
+        customer = Customer(
+            phone_number=phone_number,
+            name=f"{row['First Name']} {row['Last Name']}" if not pd.isna(row['First Name']) or not pd.isna(row['Last Name']) else None,
+            email=row['Email'] if is_valid_email(row['Email']) else None,
+            address=row['Address'] if not pd.isna(row['Address']) else None,
+            company_name=row['Company Name'] if not pd.isna(row['Company Name']) else None,
+            is_VIP='vip' in str(row['Returning']).lower() or row['VIP Status'] == 'Yes',
+        )
+
+        existing_customer = existing_customers_numbers.get(customer.phone_number)
+        if existing_customer:
+            customer.customer_id = existing_customer['customer_id']
+            update_data = {}
+            for field in ['name', 'email', 'address', 'company_name']:
+                new_value = getattr(customer, field)
+                if not existing_customer[field] and new_value is not None:
+                    update_data[field] = new_value
+            if customer.is_VIP and not existing_customer["is_VIP"]:
+                update_data["is_VIP"] = True
+            if update_data:
+                customers_to_update.setdefault(customer.customer_id, {}).update(update_data)
+        elif phone_number in customers_to_insert:
+            existing_insert = customers_to_insert[phone_number]
+            for field in ['name', 'email', 'address', 'company_name']:
+                value = getattr(customer, field)
+                if value and (field not in existing_insert or not existing_insert[field]):
+                    existing_insert[field] = value
+            if customer.is_VIP:
+                existing_insert["is_VIP"] = True
+        else:
+            customers_to_insert[phone_number] = customer.model_dump(exclude_unset=True, exclude_none=True)
+
+    for customer_id, updates in customers_to_update.items():
+        db.table("customers_testing").update(updates).eq("customer_id", customer_id).execute()
+    if customers_to_insert:
+        db.table("customers_testing").insert(list(customers_to_insert.values())).execute()
+
+
+def legacy_process_order_mappings(dataframe, db):
+    """The order mappings step the normalized sheet replaced, without its logging."""
+    phone_numbers_to_process = dataframe['Contact Number'].dropna().apply(standardize_phone_number).dropna().unique().tolist()
+
+    formatted_receipt_ids = []
+    for _, row in dataframe.iterrows():
+        receipt_number = row.get("Receipt No.")
+        date_str = row.get("Date")
+        if pd.notna(receipt_number) and pd.notna(date_str):
+            formatted_receipt_ids.append(format_receipt_id(str(receipt_number), date_str))
+    formatted_receipt_ids = list(set(formatted_receipt_ids))
+
+    existing_customers = db.get_existing_customers(phone_numbers_to_process, True)
+    existing_orders = db.get_existing_orders(formatted_receipt_ids, True)
+
+    for _, row in dataframe.iterrows():
+        phone_number = standardize_phone_number(row.get("Contact Number"))
+        receipt_number = row.get("Receipt No.")
+        date_like = row.get("Date")
+
+        if pd.notna(phone_number) and pd.notna(receipt_number) and pd.notna(date_like):
+            formatted_receipt_id = format_receipt_id(str(receipt_number), date_like)
+            existing_customer = existing_customers.get(phone_number)
+            order = existing_orders.get(formatted_receipt_id)
+            if existing_customer and order and not order.get('customer_id'):
+                db.table("orders_testing").update({"customer_id": existing_customer['customer_id']}) \
+                    .eq("receipt_id", formatted_receipt_id).execute()
+
+
+def legacy_normalize_feedback_source(source):
+    if pd.isna(source):
+        return None
+    source = source.strip()
+    if source == "Passing by":
+        return "Passing by"
+    elif source == "Friends and Family" or source == "Family and Friends":
+        return "Friends and Family"
+    elif source in {"Facebook", "Instagram", "Ads", "Social Media"}:
+        return "Social Media"
+    return None
+
+
+def legacy_process_feedback(dataframe, db):
+    """The feedback step the normalized sheet replaced, without its logging."""
+    feedbacks_to_insert = []
+    feedbacks_to_update = []
+
+    phone_numbers_to_process = dataframe['Contact Number'].dropna().apply(standardize_phone_number).dropna().unique().tolist()
+    existing_customers_numbers = db.get_existing_customers(phone_numbers_to_process, True)
+    customer_ids = [cust['customer_id'] for cust in existing_customers_numbers.values()]
+    existing_feedback = db.get_existing_feedback(customer_ids, True)
+
+    for _, row in dataframe.iterrows():
+        phone_number = standardize_phone_number(row.get("Contact Number"))
+        if pd.isna(phone_number) or not phone_number:
+            continue
+
+        customer_id = existing_customers_numbers[phone_number]['customer_id']
+        feedback_date = pd.to_datetime(row.get('Date')).isoformat() if not pd.isna(row['Date']) else None
+
+        feedback_data = Feedback(
+            customer_id=customer_id,
+            food_review=convert_rating(row.get('Food Review')),
+            service=convert_rating(row.get('Service')),
+            cleanliness=convert_rating(row.get('Cleanliness')),
+            atmosphere=convert_rating(row.get('Atmosphere')),
+            value=convert_rating(row.get('Value')),
+            where_did_they_hear_about_us=legacy_normalize_feedback_source(row.get('Where did they hear from us?')),
+            overall_experience=convert_rating(row.get('Overall Experience')),
+            feedback_date=feedback_date if feedback_date else datetime.now().isoformat(),
+        )
+
+        if any([feedback_data.food_review, feedback_data.service, feedback_data.cleanliness,
+                feedback_data.atmosphere, feedback_data.value, feedback_data.overall_experience]):
+            existing_fb = existing_feedback.get(feedback_data.customer_id)
+            if existing_fb:
+                feedbacks_to_update.append({"feedback_id": existing_fb['feedback_id'], **feedback_data.model_dump(exclude_none=True)})
+            else:
+                feedbacks_to_insert.append(feedback_data.model_dump(exclude_none=True))
+
+    if feedbacks_to_insert:
+        db.table("feedback_testing").insert(feedbacks_to_insert).execute()
+    for feedback in feedbacks_to_update:
+        feedback_id = feedback.pop("feedback_id")
+        db.table("feedback_testing").update(feedback).eq("feedback_id", feedback_id).execute()
+
+
+def legacy_process_memory_entries(dataframe, db):
+    """The memory entries step the normalized sheet replaced, without its logging."""
+    memory_entries = []
+
+    phone_numbers_to_process = dataframe['Contact Number'].dropna().apply(standardize_phone_number).dropna().unique().tolist()
+    existing_customers_numbers = db.get_existing_customers(phone_numbers_to_process, True)
+
+    for _, row in dataframe.iterrows():
+        phone_number = standardize_phone_number(row.get("Contact Number"))
+        remarks = row.get("Remarks")
+        if pd.isna(phone_number) or not phone_number or pd.isna(remarks) or not remarks.strip():
+            continue
+
+        customer = existing_customers_numbers.get(phone_number)
+        if customer:
+            memory_entries.append({
+                "customer_id": customer['customer_id'],
+                "content": remarks.strip(),
+                "source": "spreadsheet",
+                "created_at": datetime.now().isoformat()
+            })
+
+    if memory_entries:
+        db.table("memory_testing").insert(memory_entries).execute()
+
+
+def synthetic_sheet(rows: int, seed: int = 0):
+    """
+    A customer details sheet of `rows` visits by about rows / 2 customers, and the
+    database it is imported into: half of the customers, orders and feedback exist.
+    Every visit has a date, as feedback without one is dated when it is imported.
+    """
+    rng = np.random.default_rng(seed)
+    customers = rng.integers(0, max(rows // 2, 1), rows)
+    ratings = np.array(["Poor", "Fair", "Good", "Great", " great ", "Excellent", None], dtype=object)
+    sources = np.array(["Passing by", "Family and Friends", " Facebook", "Ads", "Newspaper", None], dtype=object)
+
+    def pick(values, probabilities=None):
+        return np.array(values, dtype=object)[rng.choice(len(values), rows, p=probabilities)]
+
+    sheet = pd.DataFrame({
+        "Contact Number": [f"01{700000000 + customer}" if customer % 40 else None for customer in customers],
+        "First Name": [f"First{customer}" for customer in customers],
+        "Last Name": [f"Last{customer}" for customer in customers],
+        "Email": np.where(rng.random(rows) < 0.5, [f"customer{customer}@example.com" for customer in customers],
+                          pick(["-", None])),
+        "Address": np.where(rng.random(rows) < 0.3, [f"House {customer}, Road 7" for customer in customers], None),
+        "Company Name": np.where(rng.random(rows) < 0.1, [f"Company {customer % 97}" for customer in customers], None),
+        "Returning": pick(["Yes", "VIP", "No", None], [0.3, 0.05, 0.6, 0.05]),
+        "VIP Status": pick(["Yes", "No"], [0.05, 0.95]),
+        "Receipt No.": [f"R{index:07d}" for index in range(rows)],
+        "Date": pick([f"2024-03-{day:02d}" for day in range(1, 29)]),
+        "Remarks": pick(["Loved the pizza", "  Asked for extra cheese ", "   ", None], [0.2, 0.1, 0.1, 0.6]),
+        **{column: ratings[rng.integers(0, len(ratings), rows)]
+           for column in ["Food Review", "Service", "Cleanliness", "Atmosphere", "Value", "Overall Experience"]},
+        "Where did they hear from us?": sources[rng.integers(0, len(sources), rows)],
+    }, dtype=object)
+
+    existing = np.unique(customers[customers % 2 == 0])
+    database = {
+        "customers": [{
+            "customer_id": f"c{customer}", "phone_number": f"+8801{700000000 + customer}",
+            "name": f"Customer {customer}" if customer % 4 else None, "email": None,
+            "address": "Dhaka" if customer % 3 else None, "company_name": None, "is_VIP": customer % 10 == 0,
+        } for customer in existing],
+        "orders": [{"receipt_id": receipt_id, "customer_id": "c0" if index % 7 == 0 else None}
+                   for index, receipt_id in enumerate(format_receipt_ids(sheet["Receipt No."], sheet["Date"]))
+                   if index % 2 == 0],
+        "feedback": [{"feedback_id": f"f{customer}", "customer_id": f"c{customer}"} for customer in existing[::3]],
+    }
+    return sheet, database
+
+
+def writes(db: Database):
+    """The writes an import made, with the memory entries' creation time left out."""
+    inserts = dict(db.inserts, memory=[{**entry, "created_at": None} for entry in db.inserts["memory"]])
+    return inserts, db.updates
+
+
+STEPS = [
+    ("Customer details", legacy_process_customer_details, process_customer_details),
+    ("Order mappings", legacy_process_order_mappings, process_order_mappings),
+    ("Feedback", legacy_process_feedback, process_feedback),
+    ("Memory entries", legacy_process_memory_entries, process_memory_entries),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    sheet, database = synthetic_sheet(args.rows)
+
+    legacy_db = Database(**database)
+    legacy_timings = {}
+    for label, legacy_step, _ in STEPS:
+        start = time.perf_counter()
+        legacy_step(sheet, legacy_db)
+        legacy_timings[label] = time.perf_counter() - start
+
+    db = Database(**database)
+    with mock.patch.multiple(
+        new_customer_data, get_supabase=lambda: db, get_existing_customers=db.get_existing_customers,
+        get_existing_orders=db.get_existing_orders, get_existing_feedback=db.get_existing_feedback,
+        merge_customer_fields=db.merge_customer_fields, link_orders_to_customers=db.link_orders_to_customers,
+    ):
+        session = CustomerImportSession(sheet)
+        for label, _, step in STEPS:
+            session.run_step(label, step, sheet)
+
+    assert writes(db) == writes(legacy_db)
+    stages = ", ".join(f"{label} {legacy_timings[label]:.2f}s -> {session.timings[label]:.2f}s"
+                       for label, _, _ in STEPS)
+    legacy_seconds = sum(legacy_timings.values())
+    seconds = sum(session.timings.values())
+    print(f"{args.rows:,} rows: normalize sheet {session.timings['Normalize sheet']:.2f}s, {stages}; "
+          f"total {legacy_seconds:.2f}s -> {seconds:.2f}s ({legacy_seconds / seconds:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
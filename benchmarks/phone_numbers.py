@@ -0,0 +1,57 @@
+"""
+Micro-benchmark of phone number normalization: the scalar standardize_phone_number
+applied per element against the column-wise standardize_phone_numbers.
+
+    python -m benchmarks.phone_numbers --count 1000000
+"""
+import argparse
+import logging
+import random
+import time
+
+import pandas as pd
+
+from src.utils import standardize_phone_number, standardize_phone_numbers
+
+
+def synthetic_phone_numbers(count: int, seed: int = 0) -> pd.Series:
+    """Numbers in the formats found in the exports, with some invalid and missing ones."""
+    rng = random.Random(seed)
+    formats = ["0{}", "+880 {}", "880{}", "{}", "0{}-", "(0{})"]
+    values = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.02:
+            values.append(None)
+        elif roll < 0.05:
+            values.append(str(rng.randint(0, 99999)))
+        else:
+            values.append(rng.choice(formats).format(f"1{rng.randint(300000000, 999999999)}"))
+    return pd.Series(values, dtype=object)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    phone_numbers = synthetic_phone_numbers(args.count)
+    logging.disable(logging.WARNING)
+
+    start = time.perf_counter()
+    expected = phone_numbers.apply(standardize_phone_number)
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = standardize_phone_numbers(phone_numbers)
+    vectorized_seconds = time.perf_counter() - start
+
+    # apply turns the scalar version's None into NaN
+    expected = expected.astype(object).where(expected.notna(), None)
+    assert result.tolist() == expected.tolist(), "column-wise result differs from the scalar one"
+    print(f"{args.count:,} numbers: apply(standardize_phone_number) {scalar_seconds:.2f}s, "
+          f"standardize_phone_numbers {vectorized_seconds:.2f}s ({scalar_seconds / vectorized_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
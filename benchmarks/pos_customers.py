@@ -0,0 +1,96 @@
+"""
+Benchmark of extracting the customers of a POS export: the old per-row loop with a
+list membership check against standardize_phone_numbers plus extract_customers.
+
+    python -m benchmarks.pos_customers --receipts 200000 --legacy-max 20000
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data_import.servquick_pos_data import extract_customers
+from src.models import Customer
+from src.utils import standardize_phone_number, standardize_phone_numbers
+
+
+def legacy_extract_customers(receipts: pd.DataFrame):
+    """The customer loop extract_customers replaced; keeps the first receipt's fields."""
+    customers = []
+    for _, row in receipts.iterrows():
+        phone_number = standardize_phone_number(row.get("Customer mobile"))
+        if pd.isna(phone_number) or not phone_number:
+            continue
+
+        if phone_number in [cust.phone_number for cust in customers]:
+            continue
+
+        email = row.get("Customer email")
+        address = row.get("Customer address")
+
+        customers.append(Customer(
+            name=row.get("Customer name"),
+            phone_number=phone_number,
+            email=email if not pd.isna(email) else None,
+            address=address if not pd.isna(address) else None
+        ))
+    return customers
+
+
+def synthetic_receipts(count: int, seed: int = 0) -> pd.DataFrame:
+    """`count` receipts from about count / 3 customers, whose email and address are only on some receipts."""
+    rng = np.random.default_rng(seed)
+    customers = rng.integers(0, max(count // 3, 1), count)
+    has_email = rng.random(count) < 0.3
+    has_address = rng.random(count) < 0.3
+    # object columns keep the missing details as None, as the old loop expects
+    return pd.DataFrame({
+        "Receipt no": [f"R{index:07d}" for index in range(count)],
+        "Customer mobile": [f"01{700000000 + customer}" if customer % 50 else None for customer in customers],
+        "Customer name": [f"Customer {customer}" for customer in customers],
+        "Customer email": [f"customer{customer}@example.com" if email else None
+                           for customer, email in zip(customers, has_email)],
+        "Customer address": [f"House {customer}, Road 7" if address else None
+                             for customer, address in zip(customers, has_address)],
+    }, dtype=object)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--receipts", type=int, default=200_000)
+    parser.add_argument("--legacy-max", type=int, default=20_000,
+                        help="run the quadratic old loop on at most this many receipts")
+    args = parser.parse_args(argv)
+
+    receipts = synthetic_receipts(args.receipts)
+    logging.disable(logging.WARNING)
+
+    def timed_extract(receipts):
+        start = time.perf_counter()
+        receipts = receipts.assign(__Phone_number__=standardize_phone_numbers(receipts["Customer mobile"]))
+        customers = extract_customers(receipts)
+        return customers, time.perf_counter() - start
+
+    customers, seconds = timed_extract(receipts)
+
+    legacy_receipts = receipts.iloc[:args.legacy_max]
+    start = time.perf_counter()
+    expected = legacy_extract_customers(legacy_receipts)
+    legacy_seconds = time.perf_counter() - start
+    legacy_customers, legacy_slice_seconds = timed_extract(legacy_receipts)
+
+    # Same customers in the same order; the new stage fills fields from later receipts
+    assert [customer.phone_number for customer in legacy_customers] == [customer.phone_number for customer in expected]
+    filled = sum(
+        (new.email, new.address) != (old.email, old.address) for new, old in zip(legacy_customers, expected)
+    )
+    print(f"{len(legacy_receipts):,} receipts: old loop {legacy_seconds:.2f}s, extract_customers "
+          f"{legacy_slice_seconds:.2f}s ({legacy_seconds / legacy_slice_seconds:.0f}x); {len(expected):,} customers, "
+          f"{filled:,} of them with details only found on later receipts")
+    print(f"{len(receipts):,} receipts: extract_customers {seconds:.2f}s ({len(customers):,} customers)")
+
+
+if __name__ == "__main__":
+    main()
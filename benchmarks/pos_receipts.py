@@ -0,0 +1,102 @@
+"""
+Benchmark of collapsing POS line items into receipts: the old groupby().apply with
+two merges against build_receipts.
+
+    python -m benchmarks.pos_receipts --sizes 10000 100000 1000000 --legacy-max 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data_import.servquick_pos_data import build_receipts, clean_pos_data
+from src.models import OrderItem
+
+
+def legacy_build_receipts(data: pd.DataFrame) -> pd.DataFrame:
+    """The receipt aggregation build_receipts replaced."""
+    grouped = data.groupby("Receipt no").apply(lambda group: {
+        "order_items": group.apply(lambda row: OrderItem(
+            item_name=row["Item name"],
+            quantity=row["Item quantity"],
+            amount=row["Item amount"]
+        ), axis=1).tolist(),
+        "order_items_text": "; ".join(
+            f'{row["Item name"]} (x{row["Item quantity"]})' for _, row in group.iterrows()
+        )
+    }).reset_index(name="grouped_data")
+
+    receipt_totals = (
+        data.groupby("Receipt no", as_index=False)
+            .agg(items_total=("Item amount", "sum"),
+                 tax_total=("__Tax_line_total__", "sum"),
+                 service_charge_total=("__Service_charge_line_total__", "sum"))
+    )
+    receipt_totals["total_with_tax_service"] = (
+        receipt_totals["items_total"] +
+        receipt_totals["tax_total"] +
+        receipt_totals["service_charge_total"]
+    )
+
+    final_data = data.drop_duplicates("Receipt no")
+    final_data = pd.merge(final_data, grouped, on="Receipt no", how="left")
+    return pd.merge(final_data, receipt_totals, on="Receipt no", how="left")
+
+
+def synthetic_line_items(count: int, seed: int = 0) -> pd.DataFrame:
+    """A ServQuick export of `count` line items, about three per receipt."""
+    rng = np.random.default_rng(seed)
+    receipts = np.sort(rng.integers(0, max(count // 3, 1), count))
+    menu = np.array(["Margherita", "Pepperoni", "Garlic bread", "Coke", "Brownie", "Pasta Alfredo"])
+    return pd.DataFrame({
+        "Receipt no": [f"R{receipt:07d}" for receipt in receipts],
+        "Sale date": "01/03/2024",
+        "Item name": menu[rng.integers(0, len(menu), count)],
+        "Item quantity": rng.integers(1, 4, count),
+        "Item amount": rng.integers(100, 2000, count).astype(str),
+        "Tax amount": rng.integers(0, 150, count).astype(str),
+        "Customer mobile": [f"01{number}" for number in rng.integers(300000000, 999999999, count)],
+        "Customer name": "Customer",
+        "Customer email": None,
+        "Customer address": None,
+    })
+
+
+def assert_same_receipts(result: pd.DataFrame, expected: pd.DataFrame):
+    assert result["Receipt no"].tolist() == expected["Receipt no"].tolist()
+    assert result["order_items_text"].tolist() == expected["grouped_data"].str["order_items_text"].tolist()
+    assert result["order_items"].tolist() == expected["grouped_data"].str["order_items"].tolist()
+    for column in ["items_total", "tax_total", "service_charge_total", "total_with_tax_service"]:
+        np.testing.assert_allclose(result[column].to_numpy(), expected[column].to_numpy())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-max", type=int, default=100_000,
+                        help="skip the old aggregation above this many line items, it takes minutes")
+    args = parser.parse_args(argv)
+
+    for size in args.sizes:
+        data = clean_pos_data(synthetic_line_items(size))
+
+        start = time.perf_counter()
+        result = build_receipts(data)
+        seconds = time.perf_counter() - start
+
+        if size > args.legacy_max:
+            print(f"{size:,} line items ({len(result):,} receipts): build_receipts {seconds:.2f}s, old aggregation skipped")
+            continue
+
+        start = time.perf_counter()
+        expected = legacy_build_receipts(data)
+        legacy_seconds = time.perf_counter() - start
+
+        assert_same_receipts(result, expected)
+        print(f"{size:,} line items ({len(result):,} receipts): old aggregation {legacy_seconds:.2f}s, "
+              f"build_receipts {seconds:.2f}s ({legacy_seconds / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark of reading an export with banner rows above the header: the old reader,
+which re-parsed the whole file once per skipped row, against get_spreadsheet_data.
+
+    python -m benchmarks.spreadsheet_header --rows 300000 --banner-rows 5
+"""
+import argparse
+import csv
+import io
+import random
+import time
+import warnings
+from unittest import mock
+
+import pandas as pd
+
+from src.utils import get_spreadsheet_data
+
+
+def legacy_get_spreadsheet_data(data: bytes):
+    """The reader get_spreadsheet_data replaced, for CSV data."""
+    skip = 0
+    while True:
+        df = pd.read_csv(io.BytesIO(data), skiprows=skip)
+        if "Customer name" in df.columns or "Contact Number" in df.columns:
+            return df
+        skip += 1
+
+
+def synthetic_export(rows: int, banner_rows: int, seed: int = 0) -> bytes:
+    """A customer details CSV with `banner_rows` report title rows above the header."""
+    rng = random.Random(seed)
+    text = io.StringIO()
+    writer = csv.writer(text)
+    header = ["Contact Number", "First Name", "Last Name", "Email", "Address"]
+    # Spreadsheet programs pad the banner rows to the width of the table
+    for index in range(banner_rows):
+        writer.writerow([f"Customer report, line {index + 1}"] + [""] * (len(header) - 1))
+    writer.writerow(header)
+    for index in range(rows):
+        writer.writerow([f"01{rng.randint(300000000, 999999999)}", f"First{index}", f"Last{index}",
+                         f"customer{index}@example.com", f"House {rng.randint(1, 200)}, Road {rng.randint(1, 40)}"])
+    return text.getvalue().encode()
+
+
+def timed_parses(read, data: bytes):
+    """Run `read(data)` and return its result, the seconds taken and the number of full parses."""
+    real_read_csv = pd.read_csv
+    with mock.patch.object(pd, "read_csv", side_effect=real_read_csv) as read_csv:
+        start = time.perf_counter()
+        df = read(data)
+        seconds = time.perf_counter() - start
+    return df, seconds, read_csv.call_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--banner-rows", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    data = synthetic_export(args.rows, args.banner_rows)
+    # The old reader's attempts at the banner rows mix text and numbers in one column
+    warnings.simplefilter("ignore", pd.errors.DtypeWarning)
+    expected, legacy_seconds, legacy_parses = timed_parses(legacy_get_spreadsheet_data, data)
+    result, seconds, parses = timed_parses(get_spreadsheet_data, data)
+
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"{args.rows:,} rows below {args.banner_rows} banner rows ({len(data) / 1e6:.1f} MB): "
+          f"old reader {legacy_seconds:.2f}s in {legacy_parses} parses, "
+          f"get_spreadsheet_data {seconds:.2f}s in {parses} parse ({legacy_seconds / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -187,3 +187,91 @@ UPDATE orders
 SET receipt_id = receipt_id_test
 WHERE receipt_id_test IS NOT NULL
   AND receipt_id_test <> '';
+
+-----------------------------------------------------------------------------------------------------------------
+-- Bulk "fill missing fields" merge for customers
+-- Applies many {customer_id, partial fields} patches in one statement. A field is only
+-- filled when it is currently NULL or empty, and is_VIP can only be switched to true.
+CREATE OR REPLACE FUNCTION fill_customer_fields(target_table text, patches jsonb)
+RETURNS SETOF jsonb AS $$
+BEGIN
+  IF target_table NOT IN ('customers', 'customers_testing') THEN
+    RAISE EXCEPTION 'fill_customer_fields: unsupported table %', target_table;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'UPDATE %I AS c
+     SET name = COALESCE(NULLIF(c.name, ''''), p.name),
+         email = COALESCE(NULLIF(c.email, ''''), p.email),
+         address = COALESCE(NULLIF(c.address, ''''), p.address),
+         company_name = COALESCE(NULLIF(c.company_name, ''''), p.company_name),
+         "is_VIP" = COALESCE(c."is_VIP", FALSE) OR COALESCE(p."is_VIP", FALSE)
+     FROM jsonb_to_recordset($1) AS p(
+       customer_id uuid, name text, email text, address text, company_name text, "is_VIP" boolean
+     )
+     WHERE c.customer_id = p.customer_id
+     RETURNING to_jsonb(c.*)',
+    target_table
+  ) USING patches;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------------------------------------
+-- Bulk order -> customer linking
+-- Sets customer_id on many orders in one statement from a jsonb array of
+-- {receipt_id, customer_id}; orders that are already linked are left untouched.
+CREATE OR REPLACE FUNCTION link_orders_to_customers(target_table text, links jsonb)
+RETURNS SETOF text AS $$
+BEGIN
+  IF target_table NOT IN ('orders', 'orders_testing') THEN
+    RAISE EXCEPTION 'link_orders_to_customers: unsupported table %', target_table;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'UPDATE %I AS o
+     SET customer_id = l.customer_id
+     FROM jsonb_to_recordset($1) AS l(receipt_id text, customer_id uuid)
+     WHERE o.receipt_id = l.receipt_id
+       AND o.customer_id IS NULL
+     RETURNING o.receipt_id',
+    target_table
+  ) USING links;
+END;
+$$ LANGUAGE plpgsql;
+
+-----------------------------------------------------------------------------------------------------------------
+-- Index the IVR recording file names
+-- process_audio_files looks up the uploaded file names to skip recordings that
+-- were already imported; without an index each lookup scans the whole table.
+CREATE INDEX IF NOT EXISTS ivr_transcripts_recording_idx ON ivr_transcripts (recording);
+CREATE INDEX IF NOT EXISTS ivr_transcripts_testing_recording_idx ON ivr_transcripts_testing (recording);
+
+-----------------------------------------------------------------------------------------------------------------
+-- Unique customer phone numbers
+-- create_customers (db.py) upserts new customers ON CONFLICT (phone_number), which
+-- needs a unique constraint. Duplicate phone numbers have to be merged before it
+-- can be added.
+ALTER TABLE customers
+ADD CONSTRAINT unique_phone_number UNIQUE (phone_number);
+
+ALTER TABLE customers_testing
+ADD CONSTRAINT unique_phone_number_testing UNIQUE (phone_number);
+
+-----------------------------------------------------------------------------------------------------------------
+-- Add created_at and modified_at columns to customers_testing table
+-- The local customer index (src/data_import/customer_index.py) syncs both customers
+-- tables incrementally on modified_at, so the test table needs the column and the
+-- trigger too.
+ALTER TABLE customers_testing
+ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+ADD COLUMN IF NOT EXISTS modified_at TIMESTAMP WITH TIME ZONE DEFAULT now();
+
+UPDATE customers_testing
+SET created_at = COALESCE(created_at, now()),
+    modified_at = COALESCE(modified_at, now())
+WHERE created_at IS NULL OR modified_at IS NULL;
+
+CREATE TRIGGER set_modified_at_testing
+BEFORE UPDATE ON customers_testing
+FOR EACH ROW
+EXECUTE FUNCTION update_modified_at();
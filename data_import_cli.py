@@ -0,0 +1,192 @@
+"""
+Headless runner for the import pipelines, e.g. for cron:
+
+    python data_import_cli.py pos exports/2024-03/ --workers 4 --prod
+    python data_import_cli.py customers "sheets/*.csv"
+    python data_import_cli.py ivr recordings/
+    python data_import_cli.py cards scans/*.jpg
+    python data_import_cli.py verify
+
+Writes to the test tables unless --prod is given. Progress is logged to stderr and a
+JSON summary is printed to stdout. Exit code 0 when everything succeeded, 1 when any
+file or run failed or reported failed batches, files or cards, 2 on usage errors
+(including patterns that match no files).
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+FILE_TYPES = {
+    "pos": (".csv", ".xls", ".xlsx"),
+    "customers": (".csv",),
+    "ivr": (".mp3",),
+    "cards": (".jpg", ".jpeg", ".png"),
+}
+
+
+class LocalFile:
+    """A file on disk with the name/read() interface of a Streamlit upload."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def read(self):
+        with open(self.path, "rb") as file:
+            return file.read()
+
+
+def expand_paths(patterns, extensions):
+    """Resolve directories, globs and file names to a sorted, de-duplicated list of files."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        paths.extend(path for path in matches if os.path.isfile(path) and path.lower().endswith(extensions))
+    return sorted(dict.fromkeys(paths))
+
+
+def make_logger(prefix):
+    def log(message):
+        print(f"[{prefix}] {message}", file=sys.stderr, flush=True)
+    return log
+
+
+def count_failures(result) -> int:
+    """
+    Failures reported in an importer's result: failed write batches (see
+    summarize_write_results) and `failed_*` counts such as failed recordings or cards.
+    """
+    if isinstance(result, dict):
+        return sum(
+            value if isinstance(value, int) and (key == "failed_batches" or key.startswith("failed_"))
+            else count_failures(value)
+            for key, value in result.items()
+        )
+    return 0
+
+
+def run_summary(error, result, start) -> dict:
+    failures = count_failures(result)
+    return {"ok": error is None and not failures, "seconds": round(time.perf_counter() - start, 2),
+            "error": error, "failures": failures, "result": result}
+
+
+def run_file(command, path, use_test_tables, chunk_size=None):
+    """Import one POS export or customer sheet. Runs in a worker process."""
+    logger = make_logger(os.path.basename(path))
+    start = time.perf_counter()
+    # The importers print() some errors; keep stdout for the JSON summary
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if command == "pos":
+                from src.data_import.servquick_pos_data import process_pos_data
+
+                result = process_pos_data(path, not use_test_tables, logger=logger, chunk_size=chunk_size)
+            else:
+                from src.data_import.new_customer_data import process_customer_data
+
+                result = process_customer_data(path, not use_test_tables, logger=logger)
+            error = None
+        except Exception as e:
+            logger(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+            result, error = None, f"{type(e).__name__}: {e}"
+    return {"file": path, **run_summary(error, result, start)}
+
+
+def run_batch(command, paths, use_test_tables):
+    """Import all IVR recordings or business cards in one run, as the console does."""
+    logger = make_logger(command)
+    files = [LocalFile(path) for path in paths]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if command == "ivr":
+                from src.data_import.process_ivr_audio import process_audio_files
+
+                result = process_audio_files(files, test_mode=use_test_tables, logger=logger)
+            elif command == "cards":
+                from src.data_import.openai_business_card_parsing import process_all_business_cards
+
+                result = process_all_business_cards(files, test_mode=use_test_tables, logger=logger)
+            else:
+                from src.data_import.verify_loyalty_transactions import verify_loyalty_transactions
+
+                result = verify_loyalty_transactions(logger=logger)
+            error = None
+        except Exception as e:
+            logger(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+            result, error = None, f"{type(e).__name__}: {e}"
+    return {"files": paths, **run_summary(error, result, start)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the data import pipelines without the Streamlit console.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command, help_text in [
+        ("pos", "ServQuick 'Sales Details by receipt' exports"),
+        ("customers", "customer data spreadsheets (.csv)"),
+        ("ivr", "IVR call recordings (.mp3)"),
+        ("cards", "business card scans"),
+    ]:
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument("paths", nargs="+", help="files, directories or glob patterns")
+        subparser.add_argument("--prod", action="store_true", help="write to the production tables")
+        if command in ("pos", "customers"):
+            subparser.add_argument("--workers", type=int, default=1,
+                                   help="files imported in parallel processes (default 1); only use more "
+                                        "for files that don't introduce the same new customers")
+        if command == "pos":
+            subparser.add_argument("--chunk-size", type=int, default=None,
+                                   help="stream each export in chunks of this many rows")
+
+    subparsers.add_parser("verify", help="verify loyalty program transactions against orders")
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    started = time.perf_counter()
+
+    if args.command == "verify":
+        runs = [run_batch("verify", [], use_test_tables=False)]
+    else:
+        paths = expand_paths(args.paths, FILE_TYPES[args.command])
+        if not paths:
+            parser.error(f"no {'/'.join(FILE_TYPES[args.command])} files match {' '.join(args.paths)}")
+        use_test_tables = not args.prod
+
+        if args.command in ("ivr", "cards"):
+            runs = [run_batch(args.command, paths, use_test_tables)]
+        elif args.workers > 1 and len(paths) > 1:
+            chunk_size = getattr(args, "chunk_size", None)
+            with ProcessPoolExecutor(max_workers=min(args.workers, len(paths))) as executor:
+                futures = [executor.submit(run_file, args.command, path, use_test_tables, chunk_size) for path in paths]
+                runs = [future.result() for future in futures]
+        else:
+            runs = [run_file(args.command, path, use_test_tables, getattr(args, "chunk_size", None)) for path in paths]
+
+    summary = {
+        "command": args.command,
+        "ok": all(run["ok"] for run in runs),
+        "succeeded": sum(run["ok"] for run in runs),
+        "failed": sum(not run["ok"] for run in runs),
+        "seconds": round(time.perf_counter() - started, 2),
+        "runs": runs,
+    }
+    print(json.dumps(summary, indent=2, default=str))
+    return 0 if summary["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
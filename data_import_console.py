@@ -1,13 +1,19 @@
 import streamlit as st
-from src.data_import.servquick_pos_data import process_pos_data 
-from src.data_import.new_customer_data import process_customer_data
-from src.data_import.openai_business_card_parsing import process_all_business_cards
-from src.data_import.process_ivr_audio import process_audio_files
-from src.data_import.db import reset_test_data
-from src.data_import.verify_loyalty_transactions import verify_loyalty_transactions
-import os
-from io import StringIO
 
+from src.console_log import ConsoleLog
+
+# The importers (and the clients they use) are imported in the section that runs
+# them, so the console renders without loading pandas, Supabase or the AI SDKs
+
+
+POS_CHUNK_SIZE = 50_000
+
+
+def show_full_log(log: ConsoleLog, key: str):
+    """Render the final state of the log and offer the complete log as a download."""
+    log.render()
+    if log.getvalue():
+        st.download_button("Download full log", log.getvalue(), file_name=f"{key}_log.txt", key=f"{key} log download")
 
 
 # Set up the Streamlit app
@@ -24,41 +30,36 @@ with st.expander("Import Data"):
     uploaded_file = st.file_uploader("Choose a file", type=["xls", "csv"], key="pos_file")
 
     disable_test_pos_data = st.toggle("Disable Test Mode", key='POS data test')
+    stream_pos_data = st.toggle("Stream in chunks (large exports)", key='POS data streaming')
 
     # Button to process the file
     if st.button("Process File", key='POS data process'):
         if uploaded_file is not None:
+            log_function = ConsoleLog(st.empty())
             try:
-                # Determine the file type
-                file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-
-                # Extract the original file name (without extension)
-                original_file_name = os.path.splitext(uploaded_file.name)[0]
-
-                # Construct a temporary file path including the original file name
-                temp_file_path = os.path.join(f"temp_{original_file_name}{file_extension}")
-                with open(temp_file_path, "wb") as temp_file:
-                    temp_file.write(uploaded_file.getbuffer())
-
-                log_buffer = StringIO()
-
-                log_placeholder = st.empty()  # Placeholder for real-time logs
-
-                def log_function(message):
-                    """Append message to the log buffer and update Streamlit UI."""
-                    log_buffer.write(message + "\n")
-                    log_placeholder.text(log_buffer.getvalue())
-
-
                 with st.spinner("Processing the uploaded file..."):
-                    process_pos_data(temp_file_path, disable_test_pos_data, logger=log_function)
+                    from src.data_import.servquick_pos_data import process_pos_data
+
+                    # The upload is parsed straight from memory, no temp file needed
+                    result = process_pos_data(
+                        uploaded_file,
+                        disable_test_pos_data,
+                        logger=log_function,
+                        chunk_size=POS_CHUNK_SIZE if stream_pos_data else None
+                    )
 
-                st.success("File processed and data inserted into Supabase successfully!")
+                failed = {label: result[label]["rows_failed"] for label in ("customers", "orders") if result[label]["failed_batches"]}
+                if failed:
+                    st.warning("File processed, but some rows could not be inserted: "
+                               + ", ".join(f"{count} {label}" for label, count in failed.items())
+                               + ". See the log for details and import the file again to retry them.")
+                else:
+                    st.success("File processed and data inserted into Supabase successfully!")
 
 
             except Exception as e:
                 st.error(f"An error occurred while processing the file: {e}")
-            os.remove(temp_file_path)
+            show_full_log(log_function, "pos")
         else:
             st.warning("Please upload a file before clicking the 'Process File' button.")
 
@@ -76,37 +77,20 @@ with st.expander("Import Data"):
     # Button to process the file
     if st.button("Process File", key='customer data process'):
         if uploaded_file is not None:
+            log_function = ConsoleLog(st.empty())
             try:
-                # Determine the file type
-                file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-
-                # Extract the original file name (without extension)
-                original_file_name = os.path.splitext(uploaded_file.name)[0]
-
-                # Construct a temporary file path including the original file name
-                temp_file_path = os.path.join(f"temp_{original_file_name}{file_extension}")
-                with open(temp_file_path, "wb") as temp_file:
-                    temp_file.write(uploaded_file.getbuffer())
-
-                log_buffer = StringIO()
-
-                log_placeholder = st.empty()  # Placeholder for real-time logs
-
-                def log_function(message):
-                    """Append message to the log buffer and update Streamlit UI."""
-                    log_buffer.write(message + "\n")
-                    log_placeholder.text(log_buffer.getvalue())
-
                 
                 with st.spinner("Processing the uploaded file..."):
-                    process_customer_data(temp_file_path, disable_test_customer_data, logger=log_function)
+                    from src.data_import.new_customer_data import process_customer_data
+
+                    process_customer_data(uploaded_file, disable_test_customer_data, logger=log_function)
 
                 st.success("File processed and data inserted into Supabase successfully!")
 
             except Exception as e:
                 # Handle exceptions and display the error message
                 st.error(f"An error occurred while processing the file: {e}")
-            os.remove(temp_file_path)
+            show_full_log(log_function, "customers")
         else:
             st.warning("Please upload a file before clicking the 'Process File' button.")
 
@@ -114,20 +98,18 @@ with st.expander("Import Data"):
 st.header("Verify Loyalty Program Transactions")
 with st.expander("Run Verification"):
     if st.button("Verify Loyalty Program Transactions", key='loyalty verification button'):
-        log_buffer = StringIO()
-        log_placeholder = st.empty()
-
-        def log_function(message):
-            log_buffer.write(message + "\n")
-            log_placeholder.text(log_buffer.getvalue())
+        log_function = ConsoleLog(st.empty())
 
         with st.spinner("Verifying transactions against orders..."):
+            from src.data_import.verify_loyalty_transactions import verify_loyalty_transactions
+
             results = verify_loyalty_transactions(logger=log_function)
 
         ok = results.get('processed_without_issues', 0)
         bad = results.get('problematic', 0)
         warn = results.get('warnings_count', 0)
         st.success(f"✅ Processed without issues: {ok}   ❌ Problematic: {bad}   ⚠️ Warnings: {warn}")
+        show_full_log(log_function, "loyalty_verification")
 
 
 st.header("Business Card Import")
@@ -149,16 +131,11 @@ with st.expander("Import Data"):
     # Button to process the business cards
     if st.button("Process Business Cards", key='business card process'):
         if uploaded_files and len(uploaded_files) > 0:
+            log_function = ConsoleLog(st.empty())
             try:
-                log_buffer = StringIO()
-                log_placeholder = st.empty()  # Placeholder for real-time logs
-
-                def log_function(message):
-                    """Append message to the log buffer and update Streamlit UI."""
-                    log_buffer.write(message + "\n")
-                    log_placeholder.text(log_buffer.getvalue())
-
                 with st.spinner("Processing business card images..."):
+                    from src.data_import.openai_business_card_parsing import process_all_business_cards
+
                     process_all_business_cards(
                         uploaded_files, 
                         test_mode=not disable_test_business_card,
@@ -169,6 +146,7 @@ with st.expander("Import Data"):
 
             except Exception as e:
                 st.error(f"An error occurred while processing business cards: {e}")
+            show_full_log(log_function, "business_cards")
         else:
             st.warning("Please upload at least one business card image before processing.")
 
@@ -185,16 +163,11 @@ with st.expander("Import Data"):
     # Button to process the IVR audio files
     if st.button("Process IVR Audio Files", key='IVR audio process'):
         if uploaded_files and len(uploaded_files) > 0:
+            log_function = ConsoleLog(st.empty())
             try:
-                log_buffer = StringIO()
-                log_placeholder = st.empty()  # Placeholder for real-time logs
-
-                def log_function(message):
-                    """Append message to the log buffer and update Streamlit UI."""
-                    log_buffer.write(message + "\n")
-                    log_placeholder.text(log_buffer.getvalue())
-
                 with st.spinner("Processing IVR audio files..."):
+                    from src.data_import.process_ivr_audio import process_audio_files
+
                     process_audio_files(
                         uploaded_files, 
                         test_mode=not disable_test_ivr_audio,
@@ -205,12 +178,15 @@ with st.expander("Import Data"):
 
             except Exception as e:
                 st.error(f"An error occurred while processing IVR audio files: {e}")
+            show_full_log(log_function, "ivr")
         else:
             st.warning("Please upload at least one IVR audio file before processing.")
 
 st.header("Reset all Testing data")
 if st.button("Reset", key='test data reset'):
     with st.spinner("Deleting all test data from Supabase ..."):
+        from src.data_import.db import reset_test_data
+
         reset_test_data()
     st.success("Done !")
 
@@ -0,0 +1,43 @@
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Load environment variables
+load_dotenv(ROOT_DIR / ".env")
+
+
+def require_env(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        raise ValueError(f"{name} is missing. Check your .env file.")
+    return value
+
+
+# Clients are created on first use and shared by the whole process (Streamlit reruns
+# included). Their SDKs are imported there too, so importing an importer is cheap and
+# a missing key only breaks the importer that needs it.
+
+@lru_cache(maxsize=None)
+def get_supabase():
+    from supabase import create_client
+
+    return create_client(require_env("SUPABASE_URL"), require_env("SUPABASE_KEY"))
+
+
+@lru_cache(maxsize=None)
+def get_openai():
+    from openai import OpenAI
+
+    return OpenAI(api_key=require_env("OPENAI_API_KEY"))
+
+
+@lru_cache(maxsize=None)
+def get_promptlayer():
+    from promptlayer import PromptLayer
+
+    return PromptLayer(api_key=require_env("PROMPTLAYER_API_KEY"))
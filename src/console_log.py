@@ -0,0 +1,51 @@
+import re
+import time
+from collections import Counter, deque
+from io import StringIO
+
+
+class ConsoleLog:
+    """
+    Logger for the console that keeps the page responsive on long imports.
+
+    Every message goes to the full log (see getvalue, offered as a download), but the
+    placeholder only shows the last `max_lines` lines and is re-rendered at most every
+    `refresh_interval` seconds. Messages that differ only in their numbers (receipt
+    ids, phone numbers, counts) share a template; after `collapse_after` of them,
+    further ones are only counted and shown as a single "(×n)" summary line.
+    """
+
+    def __init__(self, placeholder, refresh_interval: float = 0.5, max_lines: int = 200, collapse_after: int = 5):
+        self.placeholder = placeholder
+        self.refresh_interval = refresh_interval
+        self.collapse_after = collapse_after
+        self.lines = deque(maxlen=max_lines)
+        self.full_log = StringIO()
+        self.template_counts = Counter()
+        self.collapsed = {}
+        self.last_render = 0.0
+
+    def __call__(self, message):
+        message = str(message)
+        self.full_log.write(message + "\n")
+
+        template = re.sub(r"\d+", "#", message.splitlines()[0] if message else message)
+        self.template_counts[template] += 1
+        if self.template_counts[template] > self.collapse_after:
+            self.collapsed[template] = message
+        else:
+            self.lines.append(message)
+
+        if time.monotonic() - self.last_render >= self.refresh_interval:
+            self.render()
+
+    def render(self):
+        summary = [
+            f"{last_message}  (×{self.template_counts[template] - self.collapse_after} more like this)"
+            for template, last_message in self.collapsed.items()
+        ]
+        self.placeholder.text("\n".join([*self.lines, *summary]))
+        self.last_render = time.monotonic()
+
+    def getvalue(self) -> str:
+        return self.full_log.getvalue()
@@ -0,0 +1,102 @@
+import shutil
+import subprocess
+
+import numpy as np
+
+
+# Speech recognition needs no more than mono 16 kHz; 32 kbit/s MP3 keeps speech intelligible
+SAMPLE_RATE = 16000
+OUTPUT_BITRATE = "32k"
+
+# Energy based voice activity: 30 ms frames count as speech when they are
+# SPEECH_ABOVE_NOISE_DB louder than the recording's noise floor (the level of its
+# NOISE_FLOOR_PERCENTILE quietest frames) and louder than MIN_SPEECH_DBFS, so quiet
+# lines aren't mistaken for silence. In a call that is nearly all speech the quietest
+# frames are speech too, so the threshold is capped at MAX_SPEECH_THRESHOLD_DBFS:
+# frames that loud always count as speech. Recordings with less than
+# MIN_SPEECH_SECONDS of speech are rejected as silent
+FRAME_SECONDS = 0.03
+NOISE_FLOOR_PERCENTILE = 2
+SPEECH_ABOVE_NOISE_DB = 6.0
+MIN_SPEECH_DBFS = -65.0
+MAX_SPEECH_THRESHOLD_DBFS = -40.0
+MIN_SPEECH_SECONDS = 1.0
+TRIM_PADDING_SECONDS = 0.3
+
+FFMPEG = shutil.which("ffmpeg")
+
+
+def _ffmpeg(args, data: bytes) -> bytes:
+    result = subprocess.run(
+        [FFMPEG, "-hide_banner", "-loglevel", "error", *args],
+        input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def decode_pcm(audio: bytes, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode any audio ffmpeg understands to mono 16-bit samples at `sample_rate`, through pipes."""
+    if not FFMPEG:
+        raise RuntimeError("ffmpeg is not installed")
+    pcm = _ffmpeg(["-i", "pipe:0", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "pipe:1"], audio)
+    return np.frombuffer(pcm, dtype="<i2")
+
+
+def frame_levels_dbfs(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """RMS level of each complete frame of 16-bit samples, in dBFS."""
+    frames = samples[:len(samples) // frame_length * frame_length].reshape(-1, frame_length).astype(np.float64)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1)) / 32768.0
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def speech_bounds(samples: np.ndarray, sample_rate: int = SAMPLE_RATE):
+    """
+    Return the (start, end) sample range holding speech, padded by TRIM_PADDING_SECONDS,
+    or None if the recording has less than MIN_SPEECH_SECONDS of speech.
+    """
+    frame_length = int(sample_rate * FRAME_SECONDS)
+    levels = frame_levels_dbfs(samples, frame_length)
+    if len(levels) == 0:
+        return None
+    noise_floor = np.percentile(levels, NOISE_FLOOR_PERCENTILE)
+    threshold = max(min(noise_floor + SPEECH_ABOVE_NOISE_DB, MAX_SPEECH_THRESHOLD_DBFS), MIN_SPEECH_DBFS)
+    speech_frames = np.flatnonzero(levels > threshold)
+    if len(speech_frames) * FRAME_SECONDS < MIN_SPEECH_SECONDS:
+        return None
+
+    padding = int(sample_rate * TRIM_PADDING_SECONDS)
+    start = max(0, speech_frames[0] * frame_length - padding)
+    end = min(len(samples), (speech_frames[-1] + 1) * frame_length + padding)
+    return start, end
+
+
+def preprocess_audio(audio: bytes) -> dict:
+    """
+    Shrink a recording before it is uploaded for transcription.
+
+    The audio is decoded to mono SAMPLE_RATE PCM with ffmpeg (through pipes, nothing is
+    written to disk), leading and trailing silence is trimmed, and the rest re-encoded
+    as OUTPUT_BITRATE MP3. Returns the audio to upload (the original when that is
+    smaller or ffmpeg is not installed), its size and the original size, and
+    `rejected` set when the recording is effectively silent.
+    """
+    result = {"audio": audio, "original_bytes": len(audio), "processed_bytes": len(audio), "rejected": False}
+    if not FFMPEG:
+        return result
+
+    samples = decode_pcm(audio)
+    bounds = speech_bounds(samples)
+    if bounds is None:
+        return {**result, "rejected": True}
+
+    start, end = bounds
+    encoded = _ffmpeg(
+        ["-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+         "-c:a", "libmp3lame", "-b:a", OUTPUT_BITRATE, "-f", "mp3", "pipe:1"],
+        samples[start:end].tobytes(),
+    )
+    if len(encoded) < len(audio):
+        result.update(audio=encoded, processed_bytes=len(encoded))
+    return result
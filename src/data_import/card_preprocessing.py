@@ -0,0 +1,145 @@
+import cv2
+import numpy as np
+
+
+# gpt-4o scales images so the short side is at most 768 px before reading them, so
+# anything larger only costs upload bytes and tokens
+MAX_SHORT_SIDE = 768
+JPEG_QUALITY = 85
+
+# The card outline is searched on a copy this small, which is faster and ignores
+# texture. A four-sided contour is only taken for the card when it covers
+# MIN_CARD_AREA of the photo, its sides have a card-like ratio and the photo outside
+# it looks like background (few edges, unlike text or a logo's surroundings);
+# otherwise the whole photo is sent, so a logo or photo on a flat scan is never
+# mistaken for the card. The background check is what rules out false crops, so the
+# area floor only skips specks: a card held at arm's length covers 15-20% of a photo
+DETECT_SHORT_SIDE = 512
+MIN_CARD_AREA = 0.1
+CARD_ASPECT_RANGE = (1.2, 2.2)
+MAX_BACKGROUND_EDGE_DENSITY = 0.01
+
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def image_mime_type(image_bytes: bytes) -> str:
+    """The MIME type of an uploaded image from its magic bytes, image/jpeg if unknown."""
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def order_corners(points: np.ndarray) -> np.ndarray:
+    """Order four points as top-left, top-right, bottom-right, bottom-left."""
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)], points[np.argmin(diffs)], points[np.argmax(sums)], points[np.argmax(diffs)]
+    ], dtype=np.float32)
+
+
+def is_card_outline(corners: np.ndarray, edges: np.ndarray) -> bool:
+    """Whether a quad found on `edges` passes the MIN_CARD_AREA, CARD_ASPECT_RANGE and background checks."""
+    top_left, top_right, bottom_right, bottom_left = corners
+    width = max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))
+    height = max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))
+    if min(width, height) == 0:
+        return False
+    aspect = max(width, height) / min(width, height)
+    if not CARD_ASPECT_RANGE[0] <= aspect <= CARD_ASPECT_RANGE[1]:
+        return False
+
+    # Grow the quad a little so the card's own border doesn't count as margin edges
+    center = corners.mean(axis=0)
+    outline = np.round(center + (corners - center) * 1.03).astype(np.int32)
+    inside = np.zeros(edges.shape, np.uint8)
+    cv2.fillConvexPoly(inside, outline, 1)
+    margin = inside == 0
+    if margin.sum() == 0:
+        return False
+    return np.count_nonzero(edges[margin]) / margin.sum() <= MAX_BACKGROUND_EDGE_DENSITY
+
+
+def find_card_corners(image: np.ndarray):
+    """
+    Corners of the card when it lies on a background, or None.
+
+    Four-sided contours are tried from the largest down to MIN_CARD_AREA; the first
+    one that passes is_card_outline is taken.
+    """
+    small = downscale(image, DETECT_SHORT_SIDE)
+    scale = image.shape[0] / small.shape[0]
+    gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    edges = cv2.Canny(gray, 50, 150)
+    contours, _ = cv2.findContours(cv2.dilate(edges, np.ones((3, 3), np.uint8)), cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = MIN_CARD_AREA * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4:
+            corners = order_corners(approx.reshape(4, 2).astype(np.float32))
+            if is_card_outline(corners, edges):
+                return corners * scale
+    return None
+
+
+def warp_card(image: np.ndarray, corners: np.ndarray) -> np.ndarray:
+    """Crop the card to a straight rectangle, undoing rotation and perspective."""
+    top_left, top_right, bottom_right, bottom_left = corners
+    width = int(max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left)))
+    height = int(max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right)))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    return cv2.warpPerspective(image, cv2.getPerspectiveTransform(corners, target), (width, height))
+
+
+def downscale(image: np.ndarray, max_short_side: int = MAX_SHORT_SIDE) -> np.ndarray:
+    scale = max_short_side / min(image.shape[:2])
+    if scale >= 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def unprocessed_card_image(image_bytes: bytes) -> dict:
+    """The result of preprocess_card_image for an image sent as it is."""
+    return {"image": image_bytes, "mime_type": image_mime_type(image_bytes), "original_bytes": len(image_bytes),
+            "processed_bytes": len(image_bytes), "cropped": False}
+
+
+def preprocess_card_image(image_bytes: bytes) -> dict:
+    """
+    Shrink a business card photo before it is sent to the vision model.
+
+    The photo is cropped and deskewed to the card when it lies on a background (see
+    find_card_corners) and kept whole otherwise, then scaled down to MAX_SHORT_SIDE
+    and re-encoded as JPEG. Returns the image to send (the original when that is
+    smaller or can't be decoded), its MIME type, its size and the original size, and
+    whether the card was cropped.
+    """
+    result = unprocessed_card_image(image_bytes)
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return result
+
+    try:
+        corners = find_card_corners(image)
+        if corners is not None:
+            image = warp_card(image, corners)
+        ok, encoded = cv2.imencode(".jpg", downscale(image), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    except cv2.error:
+        return result
+    if ok and (len(encoded) < len(image_bytes) or corners is not None):
+        result.update(image=encoded.tobytes(), mime_type="image/jpeg", processed_bytes=len(encoded),
+                      cropped=corners is not None)
+    return result
@@ -0,0 +1,172 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+SYNC_PAGE_SIZE = 1000
+# How often the ids of all customers are compared with the index to drop deleted ones
+RECONCILE_SECONDS = 3600
+
+
+class CustomerIndex:
+    """
+    Local SQLite copy of the customers tables, keyed by phone number.
+
+    Each table is synced incrementally: only rows with `modified_at` at or after the
+    last synced timestamp are requested (the `set_modified_at` trigger in
+    customers_db/migrations.sql keeps that column current). Rows are stored whole, so
+    any column projection can be answered locally. Deleted customers (e.g. duplicates
+    merged away) leave no modified row behind, so at most every `reconcile_seconds`
+    the sync first lists the ids of all customers and drops the indexed ones that are
+    gone; clear() the table to drop them at once, as reset_test_data does.
+    """
+
+    def __init__(self, path: str, reconcile_seconds: float = RECONCILE_SECONDS):
+        self.path = Path(path)
+        self.reconcile_seconds = reconcile_seconds
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS customers (
+                    table_name TEXT NOT NULL,
+                    phone_number TEXT NOT NULL,
+                    row TEXT NOT NULL,
+                    PRIMARY KEY (table_name, phone_number)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    table_name TEXT PRIMARY KEY,
+                    last_sync TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reconcile_state (
+                    table_name TEXT PRIMARY KEY,
+                    reconciled_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def last_sync(self, table_name: str) -> str | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT last_sync FROM sync_state WHERE table_name = ?", (table_name,)).fetchone()
+        return row[0] if row else None
+
+    def _mark_reconciled(self, table_name: str, reconciled_at: float):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO reconcile_state (table_name, reconciled_at) VALUES (?, ?)",
+                         (table_name, reconciled_at))
+
+    def reconcile_due(self, table_name: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT reconciled_at FROM reconcile_state WHERE table_name = ?", (table_name,)).fetchone()
+        return row is None or time.time() - row[0] >= self.reconcile_seconds
+
+    def reconcile(self, client, table_name: str, page_size: int = SYNC_PAGE_SIZE, stats: dict = None) -> int:
+        """
+        Drop the indexed customers of `table_name` whose customer_id no longer exists. Returns the number
+        dropped; the pages requested are added to `stats["requests"]` when `stats` is given.
+
+        A customer missed by the paging (e.g. when rows are deleted meanwhile) is only dropped from the
+        index, and fetched again by the next lookup.
+        """
+        started = time.time()
+        customer_ids = set()
+        while True:
+            rows = (client.table(table_name).select("customer_id").order("customer_id")
+                    .range(len(customer_ids), len(customer_ids) + page_size - 1).execute().data or [])
+            if stats is not None:
+                stats["requests"] = stats.get("requests", 0) + 1
+            customer_ids.update(row["customer_id"] for row in rows)
+            if len(rows) < page_size:
+                break
+
+        with self._connect() as conn:
+            stale = [
+                (table_name, phone_number)
+                for phone_number, row in conn.execute("SELECT phone_number, row FROM customers WHERE table_name = ?", (table_name,))
+                if json.loads(row).get("customer_id") not in customer_ids
+            ]
+            conn.executemany("DELETE FROM customers WHERE table_name = ? AND phone_number = ?", stale)
+        self._mark_reconciled(table_name, started)
+        return len(stale)
+
+    def sync(self, client, table_name: str, page_size: int = SYNC_PAGE_SIZE, stats: dict = None) -> int:
+        """
+        Pull the rows of `table_name` modified since the last sync, after dropping deleted customers when a
+        reconcile is due. Returns the number of rows received; the pages requested are added to
+        `stats["requests"]` when `stats` is given.
+
+        The last timestamp is requested again (`gte`) so rows sharing it with the previous
+        sync's newest row, e.g. from one bulk update, are never missed.
+        """
+        with self.lock:
+            last_sync = self.last_sync(table_name)
+            if last_sync is None:
+                # A first sync pulls every row, nothing can be stale
+                self._mark_reconciled(table_name, time.time())
+            elif self.reconcile_due(table_name):
+                self.reconcile(client, table_name, page_size, stats)
+            received = 0
+            newest = last_sync
+            while True:
+                query = client.table(table_name).select("*")
+                if last_sync:
+                    query = query.gte("modified_at", last_sync)
+                rows = query.order("modified_at").order("customer_id").range(received, received + page_size - 1).execute().data or []
+                if stats is not None:
+                    stats["requests"] = stats.get("requests", 0) + 1
+                self.store(table_name, rows)
+                received += len(rows)
+                newest = max([newest or "", *(row["modified_at"] for row in rows if row.get("modified_at"))]) or None
+                if len(rows) < page_size:
+                    break
+
+            if newest:
+                with self._connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO sync_state (table_name, last_sync) VALUES (?, ?)", (table_name, newest))
+            return received
+
+    def store(self, table_name: str, rows: List[dict]):
+        records = [(table_name, row["phone_number"], json.dumps(row, default=str)) for row in rows if row.get("phone_number")]
+        if records:
+            with self._connect() as conn:
+                conn.executemany("INSERT OR REPLACE INTO customers (table_name, phone_number, row) VALUES (?, ?, ?)", records)
+
+    def lookup(self, table_name: str, phone_numbers: List[str]) -> Tuple[Dict[str, dict], List[str]]:
+        """
+        Return the indexed customers for `phone_numbers` by phone number, and the phone numbers not in the index.
+        """
+        phone_numbers = list(dict.fromkeys(phone for phone in phone_numbers if phone is not None))
+        found = {}
+        with self._connect() as conn:
+            # Stay under SQLite's limit on bound parameters
+            for i in range(0, len(phone_numbers), 500):
+                chunk = phone_numbers[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                for phone_number, row in conn.execute(
+                    f"SELECT phone_number, row FROM customers WHERE table_name = ? AND phone_number IN ({placeholders})",
+                    (table_name, *chunk),
+                ):
+                    found[phone_number] = json.loads(row)
+        return found, [phone for phone in phone_numbers if phone not in found]
+
+    def clear(self, table_name: str):
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM customers WHERE table_name = ?", (table_name,))
+            conn.execute("DELETE FROM sync_state WHERE table_name = ?", (table_name,))
+            conn.execute("DELETE FROM reconcile_state WHERE table_name = ?", (table_name,))
@@ -1,21 +1,17 @@
 import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Dict
 
+from src.clients import get_supabase
 from src.models import Order
+from src.data_import.customer_index import CustomerIndex
 
-# Load environment variables
-load_dotenv(".env")
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Supabase credentials are missing. Check your .env file.")
-
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Optional local index of the customers tables, see customer_index.py
+CUSTOMER_INDEX_PATH = os.getenv("CUSTOMER_INDEX_PATH")
 
 PROD_TABLES = {
     "customers": "customers",
@@ -40,6 +36,34 @@ TEST_TABLES = {
 
 BATCH_SIZE = 1000
 
+# Keys per `.in_()` filter and concurrent requests for the chunked lookups
+LOOKUP_CHUNK_SIZE = 100
+LOOKUP_MAX_WORKERS = 8
+
+# Batched writes: rows per batch are capped both by count and by JSON payload size,
+# with at most WRITE_MAX_WORKERS batches in flight and transient failures retried
+WRITE_MAX_BATCH_BYTES = 1_000_000
+WRITE_MAX_WORKERS = 4
+WRITE_MAX_RETRIES = 4
+WRITE_RETRY_BASE_DELAY = 0.5
+
+# HTTP statuses and Postgres error codes worth retrying: rate limits, gateway errors,
+# statement timeouts, serialization failures, deadlocks and connection limits
+TRANSIENT_ERROR_CODES = {"408", "429", "500", "502", "503", "504", "57014", "40001", "40P01", "53300"}
+# The subset of those where the request certainly wasn't applied, the only ones safe
+# to retry for plain inserts (a gateway error or read timeout may follow a commit)
+NOT_APPLIED_ERROR_CODES = {"408", "429", "57014", "40001", "40P01", "53300"}
+
+# Customer columns the importers read when merging new data into existing customers
+CUSTOMER_FIELDS = "customer_id, phone_number, name, email, address, company_name, is_VIP"
+
+@lru_cache(maxsize=None)
+def get_customer_index():
+    if not CUSTOMER_INDEX_PATH:
+        return None
+    return CustomerIndex(CUSTOMER_INDEX_PATH)
+
+
 def get_table(name: str, testing: bool):
     if testing:
         return TEST_TABLES.get(name)
@@ -48,58 +72,316 @@ def get_table(name: str, testing: bool):
 
 
 def reset_test_data():
-    supabase.table('memory_testing').delete().neq("customer_id", "00000000-0000-0000-0000-000000000000").execute()
-    supabase.table('feedback_testing').delete().neq("customer_id", "00000000-0000-0000-0000-000000000000").execute()
-    supabase.table('orders_testing').delete().neq("receipt_id", "").execute()
-    supabase.table('customers_testing').delete().neq("customer_id", "00000000-0000-0000-0000-000000000000").execute()
+    get_supabase().table('memory_testing').delete().neq("customer_id", "00000000-0000-0000-0000-000000000000").execute()
+    get_supabase().table('feedback_testing').delete().neq("customer_id", "00000000-0000-0000-0000-000000000000").execute()
+    get_supabase().table('orders_testing').delete().neq("receipt_id", "").execute()
+    get_supabase().table('customers_testing').delete().neq("customer_id", "00000000-0000-0000-0000-000000000000").execute()
+    customer_index = get_customer_index()
+    if customer_index:
+        customer_index.clear('customers_testing')
+
+
+def fetch_rows_in(table_name: str, column: str, values: List, columns: str = "*",
+                  chunk_size: int = LOOKUP_CHUNK_SIZE, max_workers: int = LOOKUP_MAX_WORKERS,
+                  skip_failed_chunks: bool = False, stats: dict = None) -> List[dict]:
+    """
+    Fetch the rows of `table_name` whose `column` is in `values`.
+
+    The values are de-duplicated and split into chunks of `chunk_size` to stay under
+    URL length limits, and the chunks are requested concurrently on at most
+    `max_workers` threads. Only `columns` (comma separated) are selected; `column`
+    is always included. A failing chunk raises, unless `skip_failed_chunks` is set,
+    in which case it is reported and left out of the result. The number of requests
+    made is added to `stats["requests"]` when `stats` is given.
+    """
+    values = list(dict.fromkeys(value for value in values if value is not None))
+    if not values:
+        return []
+
+    if columns != "*" and column not in [name.strip() for name in columns.split(",")]:
+        columns = f"{column}, {columns}"
+
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if stats is not None:
+        stats["requests"] = stats.get("requests", 0) + len(chunks)
+
+    def fetch_chunk(chunk):
+        return get_supabase().table(table_name).select(columns).in_(column, chunk).execute().data or []
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        futures = [executor.submit(fetch_chunk, chunk) for chunk in chunks]
+        for start, chunk, future in zip(range(0, len(values), chunk_size), chunks, futures):
+            try:
+                rows.extend(future.result())
+            except Exception as e:
+                print(f"Error fetching {table_name} batch {start}-{start + len(chunk)}: {e}")
+                if not skip_failed_chunks:
+                    raise
+    return rows
+
+
+def get_existing_customers(phone_numbers: List[str], use_test_tables: bool, columns: str = "*",
+                           stats: dict = None) -> Dict[str, dict]:
+    """
+    Return the customers with the given phone numbers, keyed by phone number.
+
+    With a local customer index configured (CUSTOMER_INDEX_PATH), the index is synced
+    first and answers the lookup; only the phone numbers it doesn't know are fetched
+    from Supabase. If the index can't be opened or synced, everything is fetched from
+    Supabase. With `stats` given, the requests made (sync pages included) are added
+    to `stats["requests"]` and the customers the index answered to `stats["from_index"]`.
+    """
+    table_name = get_table("customers", use_test_tables)
+    if not CUSTOMER_INDEX_PATH:
+        rows = fetch_rows_in(table_name, "phone_number", phone_numbers, columns, stats=stats)
+        return {cust['phone_number']: cust for cust in rows}
+
+    try:
+        customer_index = get_customer_index()
+        customer_index.sync(get_supabase(), table_name, stats=stats)
+        customers, missing = customer_index.lookup(table_name, phone_numbers)
+        index_synced = True
+    except Exception as e:
+        print(f"Customer index unavailable, fetching from {table_name}: {e}")
+        customers, missing, index_synced = {}, phone_numbers, False
+
+    if stats is not None:
+        stats["from_index"] = stats.get("from_index", 0) + len(customers)
+    rows = fetch_rows_in(table_name, "phone_number", missing, "*", stats=stats)
+    if rows and index_synced:
+        customer_index.store(table_name, rows)
+    customers.update({cust['phone_number']: cust for cust in rows})
+
+    if columns != "*":
+        names = {"phone_number", *(name.strip() for name in columns.split(","))}
+        customers = {phone: {key: value for key, value in cust.items() if key in names} for phone, cust in customers.items()}
+    return customers
+
+
+def get_existing_feedback(customer_ids: List[str], use_test_tables: bool, batch_size: int = LOOKUP_CHUNK_SIZE) -> Dict[str, dict]:
+    rows = fetch_rows_in(get_table("feedback", use_test_tables), "customer_id", customer_ids,
+                         "feedback_id, customer_id", chunk_size=batch_size)
+    return {fb["customer_id"]: fb for fb in rows}
+
+
+def get_existing_orders(receipt_numbers: List[str], use_test_tables: bool, columns: str = "*") -> Dict[str, dict]:
+    rows = fetch_rows_in(get_table("orders", use_test_tables), "receipt_id", receipt_numbers, columns)
+    return {order['receipt_id']: order for order in rows}
+
+
+def get_existing_receipts_ids(receipt_numbers: List[str], use_test_tables: bool, batch_size: int = LOOKUP_CHUNK_SIZE):
+    rows = fetch_rows_in(get_table("orders", use_test_tables), "receipt_id", receipt_numbers,
+                         "receipt_id", chunk_size=batch_size, skip_failed_chunks=True)
+    return {order["receipt_id"] for order in rows}
+
+
+def is_transient_error(error: Exception, idempotent: bool = True) -> bool:
+    """
+    Whether a failed request is worth retrying. With `idempotent` false, only errors
+    where the request certainly wasn't applied count, so a retry can't duplicate rows.
+    """
+    import httpx
+    from postgrest.exceptions import APIError
+
+    codes = TRANSIENT_ERROR_CODES if idempotent else NOT_APPLIED_ERROR_CODES
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return idempotent
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code) in codes
+    if isinstance(error, APIError):
+        return str(error.code) in codes
+    return False
+
+
+def split_batches(rows: List[dict], max_rows: int = BATCH_SIZE, max_bytes: int = WRITE_MAX_BATCH_BYTES) -> List[List[dict]]:
+    """
+    Split rows into batches of at most `max_rows` rows and about `max_bytes` of JSON each.
+
+    A single row larger than `max_bytes` gets a batch of its own.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for row in rows:
+        row_bytes = len(json.dumps(row, default=str))
+        if batch and (len(batch) >= max_rows or batch_bytes + row_bytes > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(row)
+        batch_bytes += row_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def write_batches(table_name: str, rows: List[dict], on_conflict: str = None,
+                  max_rows: int = BATCH_SIZE, max_bytes: int = WRITE_MAX_BATCH_BYTES,
+                  max_workers: int = WRITE_MAX_WORKERS, max_retries: int = WRITE_MAX_RETRIES) -> List[dict]:
+    """
+    Insert `rows` into `table_name` in size-capped batches, `max_workers` batches at a time.
+
+    Transient failures (see is_transient_error) are retried with exponential backoff up to
+    `max_retries` times. With `on_conflict` set, batches are upserted ignoring rows whose
+    `on_conflict` key already exists, so retrying a batch whose first attempt did land
+    is harmless. Plain inserts are only retried when the failed attempt certainly
+    wasn't applied. Failed batches don't stop the others; the result has one dict per batch
+    with its `start` offset, `rows`, `attempts`, `ok`, `error` and returned `data`.
+    """
+    batches = split_batches(rows, max_rows, max_bytes)
+    if not batches:
+        return []
+
+    def write_batch(batch):
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                query = get_supabase().table(table_name)
+                if on_conflict:
+                    query = query.upsert(batch, on_conflict=on_conflict, ignore_duplicates=True)
+                else:
+                    query = query.insert(batch)
+                return attempts, query.execute().data or [], None
+            except Exception as e:
+                if attempts > max_retries or not is_transient_error(e, idempotent=on_conflict is not None):
+                    return attempts, [], e
+                delay = WRITE_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+                time.sleep(delay + random.uniform(0, delay))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        futures = [executor.submit(write_batch, batch) for batch in batches]
+        start = 0
+        for batch, future in zip(batches, futures):
+            attempts, data, error = future.result()
+            if error is not None:
+                print(f"Error writing {table_name} batch {start}-{start + len(batch)} after {attempts} attempts: {error}")
+            results.append({
+                "start": start,
+                "rows": len(batch),
+                "attempts": attempts,
+                "ok": error is None,
+                "error": str(error) if error is not None else None,
+                "data": data,
+            })
+            start += len(batch)
+    return results
+
+
+def summarize_write_results(results: List[dict]) -> Dict[str, int]:
+    return {
+        "batches": len(results),
+        "failed_batches": sum(not result["ok"] for result in results),
+        "rows_written": sum(result["rows"] for result in results if result["ok"]),
+        "rows_failed": sum(result["rows"] for result in results if not result["ok"]),
+        "retries": sum(result["attempts"] - 1 for result in results),
+    }
+
+
+class BatchWriter:
+    """
+    Buffer rows for one table and insert them with write_batches in bulk.
+
+    The buffer is flushed once it holds `max_rows` rows or its oldest row has waited
+    `max_seconds`, and when the writer is closed (or its `with` block ends). Results
+    of every flush are kept in `results`, and the rows of failed batches in
+    `failed_rows`.
+    """
+
+    def __init__(self, table_name: str, max_rows: int = BATCH_SIZE, max_seconds: float = 5.0):
+        self.table_name = table_name
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.rows = []
+        self.first_row_at = None
+        self.results = []
+        self.failed_rows = []
+
+    def add(self, row: dict):
+        if not self.rows:
+            self.first_row_at = time.monotonic()
+        self.rows.append(row)
+        if len(self.rows) >= self.max_rows or time.monotonic() - self.first_row_at >= self.max_seconds:
+            self.flush()
+
+    def flush(self):
+        rows, self.rows = self.rows, []
+        results = write_batches(self.table_name, rows, max_rows=self.max_rows)
+        for result in results:
+            if not result["ok"]:
+                self.failed_rows.extend(rows[result["start"]:result["start"] + result["rows"]])
+        self.results.extend(results)
+
+    def close(self):
+        if self.rows:
+            self.flush()
 
+    def __enter__(self):
+        return self
 
-def get_existing_customers(phone_numbers: List[str], use_test_tables: bool) -> Dict[str, dict]:
-    existing_customers_data = supabase.table(get_table("customers", use_test_tables)).select("*").in_("phone_number", phone_numbers).execute()
-    return {cust['phone_number']: cust for cust in existing_customers_data.data}
+    def __exit__(self, *exc_info):
+        self.close()
 
-def get_existing_feedback(customer_ids: List[str], use_test_tables: bool, batch_size: int = 100) -> Dict[str, dict]:
-    existing_feedback = {}
-    table = supabase.table(get_table("feedback", use_test_tables))
 
-    for i in range(0, len(customer_ids), batch_size):
-        batch = customer_ids[i:i + batch_size]
-        try:
-            response = table.select("feedback_id", "customer_id").in_("customer_id", batch).execute()
-            if response.data:
-                for fb in response.data:
-                    existing_feedback[fb["customer_id"]] = fb
-        except Exception as e:
-            print(f"Error fetching feedback batch {i}-{i + len(batch)}: {e}")
-            raise
+def create_customers(phone_numbers: List[str], use_test_tables: bool, columns: str = CUSTOMER_FIELDS) -> Dict[str, dict]:
+    """
+    Make sure a customer exists for each phone number, creating the missing ones in bulk.
 
-    return existing_feedback
+    New customers are upserted ignoring phone numbers that already exist (e.g. created
+    concurrently by another import); those are looked up instead. Returns the customers
+    by phone number; phone numbers whose batch failed are missing from the result.
+    """
+    phone_numbers = list(dict.fromkeys(phone for phone in phone_numbers if phone))
+    results = write_batches(get_table("customers", use_test_tables),
+                            [{"phone_number": phone} for phone in phone_numbers], on_conflict="phone_number")
+    customers = {row["phone_number"]: row for result in results for row in result["data"]}
+    failed = {phone for result in results if not result["ok"] for phone in phone_numbers[result["start"]:result["start"] + result["rows"]]}
+    missing = [phone for phone in phone_numbers if phone not in customers and phone not in failed]
+    customers.update(get_existing_customers(missing, use_test_tables, columns))
+    return customers
 
 
-def get_existing_orders(receipt_numbers: List[str], use_test_tables: bool) -> Dict[str, dict]:
-    existing_orders_data = supabase.table(get_table("orders", use_test_tables)).select("*").in_("receipt_id", receipt_numbers).execute()
-    return {order['receipt_id']: order for order in existing_orders_data.data}
+def batch_insert_orders(orders: List[Order], use_test_tables) -> List[dict]:
+    rows = [order.model_dump() for order in orders]
+    return write_batches(get_table("orders", use_test_tables), rows, on_conflict="order_id")
 
 
-def get_existing_receipts_ids(receipt_numbers: List[str], use_test_tables: bool, batch_size: int = 100):
-    existing_receipts = set()
-    table = supabase.table(get_table("orders", use_test_tables))
+def merge_customer_fields(patches: Dict[str, dict], use_test_tables: bool, batch_size: int = BATCH_SIZE) -> List[dict]:
+    """
+    Apply many {customer_id: partial_fields} patches to the customers table.
 
-    for i in range(0, len(receipt_numbers), batch_size):
-        batch = receipt_numbers[i:i + batch_size]
-        try:
-            response = table.select("*").in_("receipt_id", batch).execute()
-            if response.data:
-                existing_receipts.update([item["receipt_id"] for item in response.data])
-        except Exception as e:
-            print(f"Error fetching receipts batch {i}-{i+len(batch)}: {e}")
-            continue  # Or raise if you want to stop on error
+    Patches go through the fill_customer_fields function (customers_db/migrations.sql)
+    `batch_size` customers per request: fields are only filled where the customer has
+    none yet, and is_VIP is only ever set to true. Returns the updated customer rows.
+    """
+    rows = [{"customer_id": customer_id, **fields} for customer_id, fields in patches.items() if fields]
+    updated_customers = []
+    for i in range(0, len(rows), batch_size):
+        response = get_supabase().rpc("fill_customer_fields", {
+            "target_table": get_table("customers", use_test_tables),
+            "patches": rows[i:i + batch_size],
+        }).execute()
+        updated_customers.extend(response.data or [])
+    return updated_customers
 
-    return existing_receipts
 
+def link_orders_to_customers(links: Dict[str, str], use_test_tables: bool, batch_size: int = BATCH_SIZE) -> List[str]:
+    """
+    Set customer_id on many orders at once from a {receipt_id: customer_id} mapping.
 
+    Links go through the link_orders_to_customers function (customers_db/migrations.sql)
+    `batch_size` orders per request; orders that already have a customer are left
+    untouched. Returns the receipt_ids that were linked.
+    """
+    rows = [{"receipt_id": receipt_id, "customer_id": customer_id} for receipt_id, customer_id in links.items()]
+    linked_receipt_ids = []
+    for i in range(0, len(rows), batch_size):
+        response = get_supabase().rpc("link_orders_to_customers", {
+            "target_table": get_table("orders", use_test_tables),
+            "links": rows[i:i + batch_size],
+        }).execute()
+        linked_receipt_ids.extend(response.data or [])
+    return linked_receipt_ids
 
-def batch_insert_orders(orders: List[Order], use_test_tables):
-    for i in range(0, len(orders), BATCH_SIZE):
-        batch = [order.model_dump() for order in orders[i:i + BATCH_SIZE]]
-        supabase.table(get_table("orders", use_test_tables)).insert(batch).execute()
@@ -1,206 +1,275 @@
+import math
+import time
 from datetime import datetime
+from typing import List
 import pandas as pd
 
-from src.models import Customer, Feedback
 
-
-from src.data_import.db import supabase, get_table, get_existing_customers, get_existing_feedback, get_existing_orders
-from src.utils import standardize_phone_number, convert_rating, is_valid_email, get_spreadsheet_data, validate_spreadsheet_columns, format_receipt_id
-
-
-def get_phone_numbers_to_process(dataframe):
-    return dataframe['Contact Number'].dropna().apply(standardize_phone_number).dropna().unique().tolist()
-
-
-def process_customer_details(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None):
+from src.clients import get_supabase
+from src.data_import.db import get_table, get_existing_customers, get_existing_feedback, get_existing_orders, merge_customer_fields, link_orders_to_customers, CUSTOMER_FIELDS, LOOKUP_CHUNK_SIZE
+from src.utils import standardize_phone_numbers, convert_ratings, valid_emails, parse_dates, get_spreadsheet_data, validate_spreadsheet_columns, format_receipt_ids
+
+
+CUSTOMER_DETAIL_FIELDS = ["name", "email", "address", "company_name"]
+
+RATING_COLUMNS = {
+    "food_review": "Food Review",
+    "service": "Service",
+    "cleanliness": "Cleanliness",
+    "atmosphere": "Atmosphere",
+    "value": "Value",
+    "overall_experience": "Overall Experience",
+}
+
+FEEDBACK_SOURCES = {
+    "Passing by": "Passing by",
+    "Friends and Family": "Friends and Family",
+    "Family and Friends": "Friends and Family",
+    "Facebook": "Social Media",
+    "Instagram": "Social Media",
+    "Ads": "Social Media",
+    "Social Media": "Social Media",
+}
+
+
+def get_phone_numbers_to_process(phone_numbers: pd.Series):
+    return phone_numbers.dropna().unique().tolist()
+
+
+def normalize_customer_sheet(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalize a customer spreadsheet into the typed columns used by every import step.
+
+    Returns one row per spreadsheet row with the standardized phone number, customer
+    details (None when missing), VIP flag, formatted receipt id, feedback ratings as
+    small ints, normalized feedback source, ISO feedback date and stripped remarks.
+    """
+    def column(name):
+        if name in dataframe.columns:
+            return dataframe[name]
+        return pd.Series(None, index=dataframe.index, dtype=object)
+
+    def text(name):
+        values = column(name)
+        return values.astype(object).where(values.notna(), None)
+
+    sheet = pd.DataFrame(index=dataframe.index)
+    sheet["phone_number"] = standardize_phone_numbers(column("Contact Number"))
+
+    first_names = text("First Name").fillna("").astype(str)
+    last_names = text("Last Name").fillna("").astype(str)
+    names = (first_names + " " + last_names).str.strip()
+    sheet["name"] = names.where(names != "", None)
+    emails = text("Email")
+    sheet["email"] = emails.where(valid_emails(emails), None)
+    sheet["address"] = text("Address")
+    sheet["company_name"] = text("Company Name")
+    sheet["is_VIP"] = (
+        text("Returning").astype(str).str.contains("vip", case=False, regex=False)
+        | (column("VIP Status") == "Yes")
+    )
+
+    has_receipt = column("Receipt No.").notna() & column("Date").notna()
+    receipt_ids = format_receipt_ids(column("Receipt No."), column("Date"))
+    sheet["receipt_id"] = receipt_ids.where(has_receipt, None)
+
+    for field, column_name in RATING_COLUMNS.items():
+        sheet[field] = convert_ratings(column(column_name))
+    sources = text("Where did they hear from us?").astype(str).str.strip()
+    sheet["where_did_they_hear_about_us"] = sources.map(FEEDBACK_SOURCES).astype(object).where(
+        sources.isin(list(FEEDBACK_SOURCES)), None
+    )
+    sheet["feedback_date"] = parse_dates(column("Date")).map(lambda date: date.isoformat(), na_action="ignore")
+
+    remarks = text("Remarks").astype(str).str.strip()
+    sheet["remarks"] = remarks.where(text("Remarks").notna() & (remarks != ""), None)
+    return sheet
+
+
+class CustomerImportSession:
+    """
+    State shared by the steps of one customer spreadsheet import.
+
+    Holds the sheet normalized once by normalize_customer_sheet and a snapshot of the
+    matching customers, fetched once and kept up to date with the inserts and updates
+    made by the steps, so later steps never fetch the same customers again.
+    """
+
+    def __init__(self, dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None):
+        self.use_test_tables = use_test_tables
+        self.logger = logger
+        start = time.perf_counter()
+        self.sheet = normalize_customer_sheet(dataframe)
+        self.timings = {"Normalize sheet": time.perf_counter() - start}
+        self.phone_numbers = self.sheet["phone_number"]
+        self.phone_numbers_to_process = get_phone_numbers_to_process(self.phone_numbers)
+        self.lookup_stats = {"requests": 0, "from_index": 0}
+        self.customers = get_existing_customers(self.phone_numbers_to_process, use_test_tables, CUSTOMER_FIELDS,
+                                                stats=self.lookup_stats)
+        self.fetched_customers = len(self.customers)
+
+    def update_customers(self, customer_rows: List[dict]):
+        for row in customer_rows:
+            self.customers[row["phone_number"]] = {**self.customers.get(row["phone_number"], {}), **row}
+
+    def log_lookup_stats(self, steps: int):
+        """Log the lookup requests made for the snapshot next to those a lookup in every step would make."""
+        if self.logger:
+            from_index = self.lookup_stats["from_index"]
+            requests_per_lookup = math.ceil(len(self.phone_numbers_to_process) / LOOKUP_CHUNK_SIZE)
+            self.logger(f"Customer snapshot: {self.fetched_customers} customers found with "
+                        f"{self.lookup_stats['requests']} requests"
+                        + (f" ({from_index} from the local customer index)" if from_index else "")
+                        + f", shared by {steps} steps; looking them up in each step would take "
+                        f"{steps * requests_per_lookup} requests ({steps} x {requests_per_lookup})")
+
+    def run_step(self, label: str, step, dataframe: pd.DataFrame):
+        start = time.perf_counter()
+        result = step(dataframe, self.use_test_tables, self.logger, self)
+        self.timings[label] = time.perf_counter() - start
+        return result
+
+    def log_timings(self):
+        if self.logger:
+            self.logger("Stage timings: " + ", ".join(f"{label} {seconds:.2f}s" for label, seconds in self.timings.items()))
+
+
+def process_customer_details(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None, session: CustomerImportSession = None):
+    session = session or CustomerImportSession(dataframe, use_test_tables, logger)
     customers_to_update = {}
     customers_to_insert = {}
 
-    # Collect all phone numbers for batch query
-    phone_numbers_to_process = get_phone_numbers_to_process(dataframe)
-    existing_customers_numbers = get_existing_customers(phone_numbers_to_process, use_test_tables)
-
     # We only process customer details if they have a phone number
-    for _, row in dataframe.iterrows():
-        phone_number = standardize_phone_number(row.get("Contact Number"))
-        if pd.isna(phone_number) or not phone_number:
-            continue  # Skip if no phone number
-
-        try:
-            customer_data = {
-                "phone_number": phone_number,
-                "name": f"{row['First Name']} {row['Last Name']}" if not pd.isna(row['First Name']) or not pd.isna(row['Last Name']) else None,
-                "email": row['Email'] if is_valid_email(row['Email']) else None,
-                "address": row['Address'] if not pd.isna(row['Address']) else None,
-                "company_name": row['Company Name'] if not pd.isna(row['Company Name']) else None,
-                "is_VIP": 'vip' in str(row['Returning']).lower() or row['VIP Status'] == 'Yes',
-            }
-            customer = Customer(**customer_data)
-
-        except ValueError as e:
+    sheet = session.sheet.dropna(subset=["phone_number"])
+    is_existing = sheet["phone_number"].isin(list(session.customers))
+
+    # Existing customers: the last value given for each field in the spreadsheet
+    existing_rows = sheet[is_existing].groupby("phone_number", sort=False)
+    latest_details = existing_rows[CUSTOMER_DETAIL_FIELDS].last()
+    latest_details = latest_details.astype(object).where(latest_details.notna(), None)
+    vip_flags = existing_rows["is_VIP"].any()
+
+    for phone_number, details in latest_details.to_dict("index").items():
+        existing_customer = session.customers[phone_number]
+        update_data = {}
+
+        # Only update fields if there is a value in the spreadsheet and if the existing customer doesn't already have that value
+        for field in CUSTOMER_DETAIL_FIELDS:
+            if not existing_customer.get(field) and details[field] is not None:
+                update_data[field] = details[field]
+        # Only update is_VIP if True
+        if vip_flags[phone_number] and not existing_customer.get("is_VIP"):
+            update_data["is_VIP"] = True
+
+        if update_data:
+            # Using customer_id as the key
             if logger:
-                logger(f"Skipping customer due to validation error: {e}")
-            continue
-
-        existing_customer = existing_customers_numbers.get(customer.phone_number)
+                logger(f"Updating customer {phone_number} with {update_data}")
+            customers_to_update[existing_customer["customer_id"]] = update_data
+
+    # New customers: the first value given for each field
+    # - the same customer can appear multiple times in the spreadsheet
+    new_rows = sheet[~is_existing].groupby("phone_number", sort=False)
+    first_details = new_rows[CUSTOMER_DETAIL_FIELDS].first()
+    first_details = first_details.astype(object).where(first_details.notna(), None)
+    vip_flags = new_rows["is_VIP"].any()
+
+    for phone_number, details in first_details.to_dict("index").items():
+        customers_to_insert[phone_number] = {
+            "phone_number": phone_number,
+            **{field: details[field] for field in CUSTOMER_DETAIL_FIELDS if details[field] is not None},
+            "is_VIP": bool(vip_flags[phone_number]),
+        }
 
-        if existing_customer:
-            customer.customer_id = existing_customer['customer_id']
-            update_data = {}
-
-            # Only update fields if there is a value in the spreadsheet and if the existing customer doesn't already have that value
-            for field in ['name', 'email', 'address', 'company_name']:
-                current_value = existing_customer[field]
-                new_value = getattr(customer, field)
-        
-                if not current_value and new_value is not None:
-                    update_data[field] = new_value
-            # Only update is_VIP if True
-            if customer.is_VIP and not existing_customer["is_VIP"]:
-                update_data["is_VIP"] = True
-
-            if update_data:
-                # Using customer_id as the key
-                if logger:
-                    logger(f"Updating customer {phone_number} with {update_data}")
-                if customer.customer_id in customers_to_update:
-                    customers_to_update[customer.customer_id].update(update_data)
-                else:
-                    customers_to_update[customer.customer_id] = update_data
-        else:
-            # Check if the customer is already in customers_to_insert 
-            # - this happens if the same customer appears multiple times in the spreadsheet.
-            if phone_number in customers_to_insert:
-                existing_insert = customers_to_insert[phone_number]
-                # Update missing fields
-                for field in ['name', 'email', 'address', 'company_name']:
-                    value = getattr(customer, field)
-                    if value and (field not in existing_insert or not existing_insert[field]):
-                        existing_insert[field] = value
-
-                if customer.is_VIP:
-                    existing_insert["is_VIP"] = True
-            else:
-                customers_to_insert[phone_number] = customer.model_dump(exclude_unset=True, exclude_none=True)
-    
     # Update existing customers
     if logger:
         logger(f"Updating {len(customers_to_update)} customers..")
-    for customer_id, updates in customers_to_update.items():
-        supabase.table(get_table("customers", use_test_tables)).update(updates).eq("customer_id", customer_id).execute()
+    session.update_customers(merge_customer_fields(customers_to_update, use_test_tables))
 
     # Batch inserts list of new customers
     if logger:
         logger(f"Inserting {len(customers_to_insert)} customers..")
     if customers_to_insert:
-        supabase.table(get_table("customers", use_test_tables)).insert(list(customers_to_insert.values())).execute()
+        response = get_supabase().table(get_table("customers", use_test_tables)).insert(list(customers_to_insert.values())).execute()
+        session.update_customers(response.data or [])
 
 
-def process_order_mappings(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None):
-    phone_numbers_to_process = get_phone_numbers_to_process(dataframe)
-
-    # Generate formatted receipt_ids using shared util
-    formatted_receipt_ids = []
-    for _, row in dataframe.iterrows():
-        receipt_number = row.get("Receipt No.")
-        date_str = row.get("Date")
-        if pd.notna(receipt_number) and pd.notna(date_str):
-            formatted_receipt_ids.append(format_receipt_id(str(receipt_number), date_str))
+def process_order_mappings(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None, session: CustomerImportSession = None):
+    session = session or CustomerImportSession(dataframe, use_test_tables, logger)
+    receipt_ids = session.sheet["receipt_id"]
 
     # Remove duplicates before fetching
-    formatted_receipt_ids = list(set(formatted_receipt_ids))
-
-    existing_customers = get_existing_customers(phone_numbers_to_process, use_test_tables)
-    existing_orders = get_existing_orders(formatted_receipt_ids, use_test_tables)
-
-    for _, row in dataframe.iterrows():
-        phone_number = standardize_phone_number(row.get("Contact Number"))
-        receipt_number = row.get("Receipt No.")
-        date_like = row.get("Date")
-
-        if pd.notna(phone_number) and pd.notna(receipt_number) and pd.notna(date_like):
-            formatted_receipt_id = format_receipt_id(str(receipt_number), date_like)
-
-            existing_customer = existing_customers.get(phone_number)
-            order = existing_orders.get(formatted_receipt_id)
-
-            if existing_customer and order:
-                if not order.get('customer_id'):
-                    customer_id = existing_customer['customer_id']
-                    supabase.table(get_table("orders", use_test_tables)) \
-                        .update({"customer_id": customer_id}) \
-                        .eq("receipt_id", formatted_receipt_id) \
-                        .execute()
-                    if logger:
-                        logger(f"Mapping order {formatted_receipt_id} to customer {phone_number}")
+    formatted_receipt_ids = receipt_ids.dropna().unique().tolist()
+
+    existing_customers = session.customers
+    existing_orders = get_existing_orders(formatted_receipt_ids, use_test_tables, "receipt_id, customer_id")
+
+    # Build the complete receipt -> customer mapping before writing anything
+    links = {}
+    already_linked = set()
+    orders_not_found = set()
+    customers_not_found = set()
+    for phone_number, formatted_receipt_id in zip(session.phone_numbers, receipt_ids):
+        if pd.isna(phone_number) or pd.isna(formatted_receipt_id):
+            continue
 
+        existing_customer = existing_customers.get(phone_number)
+        order = existing_orders.get(formatted_receipt_id)
 
+        if not order:
+            orders_not_found.add(formatted_receipt_id)
+        elif not existing_customer:
+            customers_not_found.add(formatted_receipt_id)
+        elif order.get('customer_id'):
+            already_linked.add(formatted_receipt_id)
+        else:
+            links[formatted_receipt_id] = existing_customer['customer_id']
 
-def normalize_feedback_source(source: str) -> str | None:
-    if pd.isna(source):
-        return None
+    linked = link_orders_to_customers(links, use_test_tables)
 
-    source = source.strip()
+    if logger:
+        logger(f"Linked {len(linked)} orders to customers, {len(already_linked)} already linked, "
+               f"{len(orders_not_found)} orders not found, {len(customers_not_found)} without a matching customer")
 
-    if source == "Passing by":
-        return "Passing by"
-    elif source == "Friends and Family" or source == "Family and Friends":
-        return "Friends and Family"
-    elif source in {"Facebook", "Instagram", "Ads"}:
-        return "Social Media"
-    elif source == "Social Media":
-        return "Social Media"
-    else:
-        return None
+    return {
+        "linked": len(linked),
+        "already_linked": len(already_linked),
+        "orders_not_found": len(orders_not_found),
+        "customers_not_found": len(customers_not_found),
+    }
 
 
-def process_feedback(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None):
+def process_feedback(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None, session: CustomerImportSession = None):
+    session = session or CustomerImportSession(dataframe, use_test_tables, logger)
     feedbacks_to_insert = []
     feedbacks_to_update = []
 
     # Collect all existing feedback
-    phone_numbers_to_process = dataframe['Contact Number'].dropna().apply(standardize_phone_number).dropna().unique().tolist()
-    existing_customers_numbers = get_existing_customers(phone_numbers_to_process, use_test_tables)
-    customer_ids = [cust['customer_id'] for cust in existing_customers_numbers.values()]
-    existing_feedback = get_existing_feedback(customer_ids, use_test_tables)
-
-    for _, row in dataframe.iterrows():
-        phone_number = standardize_phone_number(row.get("Contact Number"))
-        if pd.isna(phone_number) or not phone_number:
-            continue  # Skip if no phone number
-
-        customer_id = existing_customers_numbers[phone_number]['customer_id']
-
-        feedback_date = pd.to_datetime(row.get('Date')).isoformat() if not pd.isna(row['Date']) else None
-
-        feedback_data = Feedback(
-            customer_id=customer_id,
-            food_review=convert_rating(row.get('Food Review')),
-            service=convert_rating(row.get('Service')),
-            cleanliness=convert_rating(row.get('Cleanliness')),
-            atmosphere=convert_rating(row.get('Atmosphere')),
-            value=convert_rating(row.get('Value')),
-            where_did_they_hear_about_us=normalize_feedback_source(row.get('Where did they hear from us?')),
-            overall_experience=convert_rating(row.get('Overall Experience')),
-            feedback_date=feedback_date if feedback_date else datetime.now().isoformat(),
-        )
-        
-        # Only process feedback if not empty
-        if any([feedback_data.food_review, feedback_data.service, feedback_data.cleanliness,
-                feedback_data.atmosphere, feedback_data.value, feedback_data.overall_experience]):
-            existing_fb = existing_feedback.get(feedback_data.customer_id)
-            if existing_fb:
-                feedbacks_to_update.append({"feedback_id": existing_fb['feedback_id'], **feedback_data.model_dump(exclude_none=True)})
-                if logger:
-                    logger(f"New feedback for customer {customer_id}")
-            else:
-                feedbacks_to_insert.append(feedback_data.model_dump(exclude_none=True))
+    customer_ids_by_phone = {phone_number: customer['customer_id'] for phone_number, customer in session.customers.items()}
+    existing_feedback = get_existing_feedback(list(customer_ids_by_phone.values()), use_test_tables)
+
+    feedback = session.sheet.assign(customer_id=session.sheet["phone_number"].map(customer_ids_by_phone))
+    # Only process feedback if not empty
+    has_ratings = (feedback[list(RATING_COLUMNS)] != 0).any(axis=1)
+    feedback = feedback[feedback["customer_id"].notna() & has_ratings]
+    feedback = feedback.assign(feedback_date=feedback["feedback_date"].fillna(datetime.now().isoformat()))
+
+    feedback_columns = ["customer_id", *RATING_COLUMNS, "where_did_they_hear_about_us", "feedback_date"]
+    for feedback_data in feedback[feedback_columns].to_dict("records"):
+        feedback_data = {key: value for key, value in feedback_data.items() if value is not None}
+        existing_fb = existing_feedback.get(feedback_data["customer_id"])
+        if existing_fb:
+            feedbacks_to_update.append({"feedback_id": existing_fb['feedback_id'], **feedback_data})
+            if logger:
+                logger(f"New feedback for customer {feedback_data['customer_id']}")
+        else:
+            feedbacks_to_insert.append(feedback_data)
 
     # Batch inserts
     if feedbacks_to_insert:
         if logger:
             logger(f"Inserting {len(feedbacks_to_insert)} new feedback entries")
-        supabase.table(get_table("feedback", use_test_tables)).insert(feedbacks_to_insert).execute()
+        get_supabase().table(get_table("feedback", use_test_tables)).insert(feedbacks_to_insert).execute()
         
 
     # Batch updates
@@ -209,36 +278,32 @@ def process_feedback(dataframe: pd.DataFrame, use_test_tables: bool = True, logg
             logger(f"Updating {len(feedbacks_to_update)} feedback entries")
         for feedback in feedbacks_to_update:
             feedback_id = feedback.pop("feedback_id")
-            supabase.table(get_table("feedback", use_test_tables)).update(feedback).eq("feedback_id", feedback_id).execute()
+            get_supabase().table(get_table("feedback", use_test_tables)).update(feedback).eq("feedback_id", feedback_id).execute()
         
-def process_memory_entries(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None):
-    memory_entries = []
-
-    # Collect all phone numbers to map them to existing customers
-    phone_numbers_to_process = get_phone_numbers_to_process(dataframe)
-    existing_customers_numbers = get_existing_customers(phone_numbers_to_process, use_test_tables)
-
-    for _, row in dataframe.iterrows():
-        phone_number = standardize_phone_number(row.get("Contact Number"))
-        remarks = row.get("Remarks")
-
-        if pd.isna(phone_number) or not phone_number or pd.isna(remarks) or not remarks.strip():
-            continue  # Skip if phone number or remarks are empty
-
-        customer = existing_customers_numbers.get(phone_number)
-        if customer:
-            memory_entries.append({
-                "customer_id": customer['customer_id'],
-                "content": remarks.strip(),
-                "source": "spreadsheet",
-                "created_at": datetime.now().isoformat()
-            })
+def process_memory_entries(dataframe: pd.DataFrame, use_test_tables: bool = True, logger=None, session: CustomerImportSession = None):
+    session = session or CustomerImportSession(dataframe, use_test_tables, logger)
+
+    # Map phone numbers to existing customers, skipping rows without phone number or remarks
+    customer_ids_by_phone = {phone_number: customer['customer_id'] for phone_number, customer in session.customers.items()}
+    remarks = session.sheet.assign(customer_id=session.sheet["phone_number"].map(customer_ids_by_phone))
+    remarks = remarks[remarks["customer_id"].notna() & remarks["remarks"].notna()]
+
+    created_at = datetime.now().isoformat()
+    memory_entries = [
+        {
+            "customer_id": customer_id,
+            "content": content,
+            "source": "spreadsheet",
+            "created_at": created_at
+        }
+        for customer_id, content in zip(remarks["customer_id"], remarks["remarks"])
+    ]
 
     # Insert into 'memory' table
     if memory_entries:
         if logger:
             logger(f"Inserting {len(memory_entries)} new memory entries")
-        supabase.table(get_table("memory", use_test_tables)).insert(memory_entries).execute()
+        get_supabase().table(get_table("memory", use_test_tables)).insert(memory_entries).execute()
 
 
 def process_customer_data(file_path, disable_test_customer_data=False, logger=None):
@@ -250,17 +315,21 @@ def process_customer_data(file_path, disable_test_customer_data=False, logger=No
 
     # We must first create or update all customers
     validate_spreadsheet_columns(dataframe, "customer_details")
+    session = CustomerImportSession(dataframe, use_test_tables, logger)
+
     logger and logger("✅ Step 1: Processing customer details")
-    process_customer_details(dataframe, use_test_tables, logger)
+    session.run_step("Customer details", process_customer_details, dataframe)
 
     logger and logger("✅ Step 2: Processing order mappings")
-    process_order_mappings(dataframe, use_test_tables, logger)
+    session.run_step("Order mappings", process_order_mappings, dataframe)
 
     validate_spreadsheet_columns(dataframe, "feedback")
     logger and logger("✅ Step 3: Processing feedback")
-    process_feedback(dataframe, use_test_tables, logger)
+    session.run_step("Feedback", process_feedback, dataframe)
 
     logger and logger("✅ Step 4: Processing memory entries")
-    process_memory_entries(dataframe, use_test_tables, logger)
+    session.run_step("Memory entries", process_memory_entries, dataframe)
 
-    logger and logger("🎉 All steps completed successfully")
\ No newline at end of file
+    session.log_lookup_stats(steps=4)
+    session.log_timings()
+    logger and logger("🎉 All steps completed successfully")
@@ -1,19 +1,70 @@
 import base64
 import json
-from openai import OpenAI
-from dotenv import load_dotenv
 import os
-from src.utils import standardize_phone_number, is_valid_email
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+from src.clients import get_supabase, get_openai
+from src.utils import standardize_phone_numbers, is_valid_email
 
-from src.data_import.db import supabase, get_table, get_existing_customers
+from src.data_import.db import get_table, get_existing_customers, merge_customer_fields, CUSTOMER_FIELDS
+from src.data_import.card_preprocessing import preprocess_card_image, unprocessed_card_image, image_mime_type
 
-load_dotenv()
+# Vision requests in flight at once; halved on every rate-limit response and raised
+# again by one after CARD_RECOVER_AFTER requests in a row succeed
+CARD_MAX_WORKERS = int(os.environ.get("BUSINESS_CARD_MAX_WORKERS", "8"))
+CARD_RECOVER_AFTER = 5
+CARD_MAX_RETRIES = 5
+CARD_RETRY_BASE_DELAY = 1.0
+# Waits the API asks for in retry-after headers are honored up to this long
+CARD_MAX_RETRY_AFTER = 60.0
+# Processes cropping and shrinking card photos, see card_preprocessing.py
+CARD_PREPROCESS_WORKERS = os.cpu_count() or 1
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
 
+class AdaptiveLimiter:
+    """
+    Semaphore whose limit shrinks on rate limits and grows back on successes.
 
-def extract_and_format_business_card(image_bytes):
+    Use as `with limiter:` around a request, then call throttled() or succeeded().
+    """
+
+    def __init__(self, max_limit: int, recover_after: int = CARD_RECOVER_AFTER):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.recover_after = recover_after
+        self.active = 0
+        self.streak = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def throttled(self):
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.streak = 0
+
+    def succeeded(self):
+        with self.condition:
+            self.streak += 1
+            if self.streak >= self.recover_after and self.limit < self.max_limit:
+                self.limit += 1
+                self.streak = 0
+                self.condition.notify_all()
+
+
+def request_business_card_data(image_bytes, client=None, mime_type=None):
     prompt = """
     Extract the following details from the business card image and format them as JSON:
     - Name
@@ -25,31 +76,80 @@ def extract_and_format_business_card(image_bytes):
     If a field is missing, return an empty string ("").
     """
 
-    try:
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-        data_url = f"data:image/jpeg;base64,{base64_image}"
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an AI that extracts structured data from business cards."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": data_url}}
-                ]}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-
-        structured_data = response.choices[0].message.content
-        return json.loads(structured_data)
+    base64_image = base64.b64encode(image_bytes).decode('utf-8')
+    data_url = f"data:{mime_type or image_mime_type(image_bytes)};base64,{base64_image}"
 
+    response = (client or get_openai()).chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "You are an AI that extracts structured data from business cards."},
+            {"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": data_url}}
+            ]}
+        ],
+        temperature=0,
+        response_format={"type": "json_object"}
+    )
+
+    structured_data = response.choices[0].message.content
+    return json.loads(structured_data)
+
+
+def extract_and_format_business_card(image_bytes):
+    try:
+        return request_business_card_data(image_bytes)
     except Exception as e:
         print(f"OpenAI API Error: {e}")
         return None
 
 
+def retry_after_seconds(error):
+    """The wait an API error's retry-after-ms or retry-after header asks for, if any and sensible."""
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            seconds = float(headers[header]) / scale
+        except (KeyError, TypeError, ValueError):
+            continue  # missing, or an HTTP date
+        if 0 <= seconds <= CARD_MAX_RETRY_AFTER:
+            return seconds
+    return None
+
+
+def extract_with_backoff(image_bytes, limiter: AdaptiveLimiter, client, mime_type=None,
+                         max_retries: int = CARD_MAX_RETRIES):
+    """
+    Extract one card, holding a slot of `limiter` per attempt. Rate-limit responses
+    shrink the limit; they, connection errors, timeouts and 5xx responses are
+    retried after the wait the response asks for (retry-after headers), or with
+    exponential backoff. Other errors raise.
+    """
+    from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            with limiter:
+                data = request_business_card_data(image_bytes, client, mime_type)
+        except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+            if isinstance(e, RateLimitError):
+                limiter.throttled()
+            if attempts > max_retries:
+                raise
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                time.sleep(retry_after)
+            else:
+                delay = CARD_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+                time.sleep(delay + random.uniform(0, delay))
+        else:
+            limiter.succeeded()
+            return data
+
+
 def upsert_customer_data_batch(parsed_data_list, test_mode=True, logger=None):
     def log(msg):
         if logger:
@@ -59,22 +159,22 @@ def upsert_customer_data_batch(parsed_data_list, test_mode=True, logger=None):
 
     if not parsed_data_list:
         log("No parsed data to process.")
-        return
+        return {"inserted": 0, "updated": 0}
 
     customer_table = get_table("customers", test_mode)
 
     # Prepare phone mapping and standardize numbers
     phone_map = {}
-    for data in parsed_data_list:
-        raw_phone = data.get("Phone", "").strip()
-        phone_number = standardize_phone_number(raw_phone)
+    raw_phones = pd.Series([data.get("Phone", "").strip() for data in parsed_data_list], dtype=object)
+    for data, phone_number in zip(parsed_data_list, standardize_phone_numbers(raw_phones)):
         if phone_number:
             phone_map[phone_number] = data
 
     phone_numbers = list(phone_map.keys())
-    existing_customers = get_existing_customers(phone_numbers, test_mode)
+    existing_customers = get_existing_customers(phone_numbers, test_mode, CUSTOMER_FIELDS)
 
     records_to_insert = []
+    customers_to_update = {}
 
     for phone_number, data in phone_map.items():
         existing = existing_customers.get(phone_number)
@@ -104,21 +204,56 @@ def upsert_customer_data_batch(parsed_data_list, test_mode=True, logger=None):
 
             if updated_fields:
                 log(f"Updating {phone_number}: {updated_fields}")
-                supabase.table(customer_table).update(updated_fields).eq("customer_id", customer_id).execute()
+                customers_to_update[customer_id] = updated_fields
             else:
                 log(f"No update needed for existing customer: {phone_number}")
         else:
             records_to_insert.append(record)
 
+    if customers_to_update:
+        merge_customer_fields(customers_to_update, test_mode)
+
     if records_to_insert:
         inserted_phones = [r['phone_number'] for r in records_to_insert]
         log(f"Inserting {len(records_to_insert)} new customers: {inserted_phones}")
-        supabase.table(customer_table).insert(records_to_insert).execute()
+        get_supabase().table(customer_table).insert(records_to_insert).execute()
     else:
         log("No new customers to insert.")
+    return {"inserted": len(records_to_insert), "updated": len(customers_to_update)}
+
+
+def preprocess_card_images(images, workers: int = CARD_PREPROCESS_WORKERS, logger=print):
+    """
+    Run preprocess_card_image on every image, in order, across `workers` processes.
+
+    An image whose pre-processing fails, or whose worker process dies (which fails
+    every image that worker pool still had), is sent as it is.
+    """
+    def preprocessed(image, run):
+        try:
+            return run()
+        except Exception as e:
+            logger(f"Sending a card image unprocessed, pre-processing failed: {e!r}")
+            return unprocessed_card_image(image)
+
+    if workers <= 1 or len(images) <= 1:
+        return [preprocessed(image, lambda: preprocess_card_image(image)) for image in images]
+    with ProcessPoolExecutor(max_workers=min(workers, len(images))) as executor:
+        futures = [executor.submit(preprocess_card_image, image) for image in images]
+        return [preprocessed(image, future.result) for image, future in zip(images, futures)]
 
 
-def process_all_business_cards(uploaded_files, test_mode=True, logger=None):
+def process_all_business_cards(uploaded_files, test_mode=True, logger=None, max_workers=CARD_MAX_WORKERS):
+    """
+    Extract the details of every business card and upsert them as customers.
+
+    Photos are first cropped to the card and shrunk (see preprocess_card_images).
+    Up to `max_workers` vision requests run at once, fewer while OpenAI answers
+    with rate limits (see AdaptiveLimiter). Results are handled in upload order; a
+    card that fails is logged and left out, the others are still imported. Returns
+    the number of cards uploaded, extracted and failed, and the customers inserted
+    and updated.
+    """
     def log(msg):
         if logger:
             logger(msg)
@@ -126,16 +261,39 @@ def process_all_business_cards(uploaded_files, test_mode=True, logger=None):
             print(msg)
 
     parsed_data_list = []
+    if not uploaded_files:
+        customers = upsert_customer_data_batch(parsed_data_list, test_mode=test_mode, logger=logger)
+        return {"cards": 0, "extracted": 0, "failed_cards": 0, "customers": customers}
 
-    for uploaded_file in uploaded_files:
-        try:
-            image_bytes = uploaded_file.read()
-            data = extract_and_format_business_card(image_bytes)
-            if data:
-                parsed_data_list.append(data)
-            else:
-                log(f"Failed to extract data from {uploaded_file.name}")
-        except Exception as e:
-            log(f"Error processing {uploaded_file.name}: {e}")
+    # extract_with_backoff retries instead of the SDK, so it sees rate limits and can throttle
+    client = get_openai().with_options(max_retries=0)
+    limiter = AdaptiveLimiter(min(max_workers, len(uploaded_files)))
+
+    prepared = preprocess_card_images([uploaded_file.read() for uploaded_file in uploaded_files], logger=log)
+    original_bytes = sum(card["original_bytes"] for card in prepared)
+    processed_bytes = sum(card["processed_bytes"] for card in prepared)
+    log(f"Pre-processing sends {processed_bytes / 1e6:.1f} MB instead of {original_bytes / 1e6:.1f} MB "
+        f"({1 - processed_bytes / max(original_bytes, 1):.0%} saved), "
+        f"{sum(card['cropped'] for card in prepared)} of {len(prepared)} cards cropped")
+
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+        futures = [
+            executor.submit(extract_with_backoff, card["image"], limiter, client, card["mime_type"])
+            for card in prepared
+        ]
+        for uploaded_file, future in zip(uploaded_files, futures):
+            try:
+                data = future.result()
+                if data:
+                    parsed_data_list.append(data)
+                else:
+                    log(f"Failed to extract data from {uploaded_file.name}")
+            except Exception as e:
+                log(f"Error processing {uploaded_file.name}: {e}")
 
-    upsert_customer_data_batch(parsed_data_list, test_mode=test_mode, logger=logger)
+    if limiter.limit < limiter.max_limit:
+        log(f"Rate limited by OpenAI, finished with {limiter.limit} of {limiter.max_limit} concurrent requests")
+    log(f"Extracted {len(parsed_data_list)} of {len(uploaded_files)} business cards")
+    customers = upsert_customer_data_batch(parsed_data_list, test_mode=test_mode, logger=logger)
+    return {"cards": len(uploaded_files), "extracted": len(parsed_data_list),
+            "failed_cards": len(uploaded_files) - len(parsed_data_list), "customers": customers}
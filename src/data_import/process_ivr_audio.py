@@ -2,28 +2,38 @@ import os
 import re
 import json
 from datetime import datetime
-from promptlayer import PromptLayer
-import requests
-from supabase import create_client, Client
-from src.data_import.db import get_table, get_existing_customers
-from src.utils import standardize_phone_number
+from src.clients import get_promptlayer, ROOT_DIR
+from src.data_import.transcript_cache import TranscriptCache, content_hash
+from src.data_import.audio_preprocessing import preprocess_audio, FFMPEG
+from src.data_import.transcribers import get_transcriber
+from src.data_import.db import (
+    get_table, get_existing_customers, create_customers, merge_customer_fields, fetch_rows_in,
+    summarize_write_results, BatchWriter, CUSTOMER_FIELDS,
+)
+from src.utils import standardize_phone_numbers, open_binary_source, source_name
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import pandas as pd
 from mutagen.mp3 import MP3
 
-# Load environment variables
-from dotenv import load_dotenv
-load_dotenv()
+# Recordings transcribed and analysed at the same time; both steps wait on the network
+IVR_MAX_WORKERS = 8
+# Transcript and memory rows are buffered and inserted together, at the latest after this long
+IVR_WRITE_FLUSH_SECONDS = 30
+SHORT_AUDIO_SECONDS = 10
 
-# PromptLayer and ElevenLabs setup
-promptlayer_client = PromptLayer(api_key=os.environ["PROMPTLAYER_API_KEY"])
-ELEVENLABS_API_KEY = os.environ["ELEVENLABS_API_KEY"]
-ELEVENLABS_MODEL_ID = os.environ.get("ELEVENLABS_MODEL_ID", "scribe_v1")
-ELEVENLABS_STT_URL = "https://api.elevenlabs.io/v1/speech-to-text"
+# Transcripts and facts of recordings already seen, see transcript_cache.py; set
+# IVR_TRANSCRIPT_CACHE_PATH to an empty value to disable
+IVR_TRANSCRIPT_CACHE_PATH = os.environ.get("IVR_TRANSCRIPT_CACHE_PATH", str(ROOT_DIR / ".cache" / "ivr_transcripts.sqlite"))
+IVR_TRANSCRIPT_CACHE_MAX_MB = int(os.environ.get("IVR_TRANSCRIPT_CACHE_MAX_MB", "256"))
 
-# Supabase setup
-SUPABASE_URL = os.environ["SUPABASE_URL"]
-SUPABASE_KEY = os.environ["SUPABASE_KEY"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@lru_cache(maxsize=None)
+def get_transcript_cache():
+    if not IVR_TRANSCRIPT_CACHE_PATH:
+        return None
+    return TranscriptCache(IVR_TRANSCRIPT_CACHE_PATH, IVR_TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024)
 
 def extract_date_and_phone(filename):
     date_match = re.search(r"(\d{8})", filename)
@@ -37,29 +47,21 @@ def extract_date_and_phone(filename):
             pass
     return date, phone
 
-def get_audio_duration_seconds(file_path):
+def get_audio_duration_seconds(audio):
+    """`audio` is a path, bytes or a binary file-like object."""
     try:
-        audio = MP3(file_path)
-        return float(getattr(getattr(audio, "info", None), "length", None))
+        with open_binary_source(audio) as f:
+            return float(getattr(getattr(MP3(f), "info", None), "length", None))
     except Exception:
         return None
 
-def transcribe_audio(file_path):
-    with open(file_path, 'rb') as f:
-        files = {'file': (os.path.basename(file_path), f, 'audio/mpeg')}
-        data = {'model_id': ELEVENLABS_MODEL_ID}
-        response = requests.post(
-            ELEVENLABS_STT_URL,
-            headers={"xi-api-key": ELEVENLABS_API_KEY},
-            files=files,
-            data=data
-        )
-        response.raise_for_status()
-        return response.json().get("text", "")
+def transcribe_audio(audio, file_name=None):
+    """`audio` is a path, bytes or a binary file-like object, transcribed by the IVR_STT_BACKEND transcriber."""
+    return get_transcriber().transcribe(audio, file_name or source_name(audio, "recording.mp3"))
 
 def extract_facts(transcript):
     input_variables = {"transcript": transcript}
-    response = promptlayer_client.run(prompt_name="IVR_fact_extraction", input_variables=input_variables)
+    response = get_promptlayer().run(prompt_name="IVR_fact_extraction", input_variables=input_variables)
     return json.loads(response["raw_response"].choices[0].message.content)
 
 def none_if_empty(value):
@@ -69,24 +71,86 @@ def none_if_empty(value):
         return None
     return value
 
-def update_customer_info(customer_id, extracted, current_data, test_mode):
-    updates = {}
+def update_customer_info(customer_id, extracted, current_data, pending_updates):
+    """
+    Queue the fields extracted from a call that the customer doesn't have yet.
+
+    Updates are collected in `pending_updates` (customer_id -> fields) and applied in
+    bulk with merge_customer_fields once all files are processed. Files are handled in
+    upload order and the last call that provides a field wins, as it did when each
+    call ran its own UPDATE.
+    """
+    updates = pending_updates.setdefault(customer_id, {})
     for field in ["name", "company_name", "address", "email"]:
         if not current_data.get(field) and extracted.get(field):
             updates[field] = extracted[field]
-    if updates:
-        customer_table = get_table("customers", test_mode)
-        supabase.table(customer_table).update(updates).eq("customer_id", customer_id).execute()
 
 
-def process_audio_files(uploaded_files, test_mode=True, logger=print):
+def analyze_recording(uploaded_file, file_name):
+    """
+    Transcribe a recording and extract its facts, without touching the database.
+
+    Recordings shorter than SHORT_AUDIO_SECONDS or found silent by preprocess_audio
+    (`silent`) are not transcribed; their transcript and extracted facts are None.
+    Recordings already in the transcript cache cost no API calls; `cached` tells
+    whether the cache answered. The others are uploaded pre-processed, and
+    `original_bytes`/`uploaded_bytes` tell how much that saved.
+    """
+    audio = uploaded_file.read()
+    duration_seconds = get_audio_duration_seconds(audio)
+    if duration_seconds is not None and duration_seconds < SHORT_AUDIO_SECONDS:
+        return {"duration_seconds": duration_seconds, "transcript": None, "extracted": None, "cached": False, "silent": False}
+
+    cache = get_transcript_cache()
+    model_id = get_transcriber().model_id
+    audio_hash = content_hash(audio)
+    cached = cache.get(audio_hash, model_id) if cache else None
+    if cached and cached["extracted"] is not None:
+        return {"duration_seconds": duration_seconds, **cached, "cached": True, "silent": False}
+
+    upload = {}
+    if cached:
+        transcript = cached["transcript"]
+    else:
+        try:
+            prepared = preprocess_audio(audio)
+        except RuntimeError:
+            # Leave undecodable files to the speech-to-text service, as before
+            prepared = {"audio": audio, "original_bytes": len(audio), "processed_bytes": len(audio), "rejected": False}
+        if prepared["rejected"]:
+            return {"duration_seconds": duration_seconds, "transcript": None, "extracted": None, "cached": False, "silent": True}
+        upload = {"original_bytes": prepared["original_bytes"], "uploaded_bytes": prepared["processed_bytes"]}
+        transcript = transcribe_audio(prepared["audio"], file_name)
+    if cache and not cached:
+        cache.put(audio_hash, model_id, transcript)
+    extracted = extract_facts(transcript)
+    if cache:
+        cache.put(audio_hash, model_id, transcript, extracted)
+    return {"duration_seconds": duration_seconds, "transcript": transcript, "extracted": extracted,
+            "cached": cached is not None, "silent": False, **upload}
+
+
+def process_audio_files(uploaded_files, test_mode=True, logger=print, max_workers=IVR_MAX_WORKERS):
+    """
+    Import IVR call recordings: transcribe them, extract facts and store both.
+
+    Up to `max_workers` recordings are transcribed and analysed concurrently. Results
+    are logged on the calling thread, in upload order. Customers missing for the new
+    recordings are created in one bulk upsert up front, and transcript and memory rows
+    are inserted in batches (see BatchWriter), flushed at least every
+    IVR_WRITE_FLUSH_SECONDS.
+
+    Returns the number of recordings uploaded and processed, the failed ones and the
+    write_batches summaries of the transcripts and memories.
+    """
     all_phones = []
     file_info = []
 
-    for uploaded_file in uploaded_files:
+    file_dates_and_phones = [extract_date_and_phone(uploaded_file.name) for uploaded_file in uploaded_files]
+    phones = standardize_phone_numbers(pd.Series([raw_phone for _, raw_phone in file_dates_and_phones], dtype=object))
+
+    for uploaded_file, (date, _), phone in zip(uploaded_files, file_dates_and_phones, phones):
         file_name = uploaded_file.name
-        date, raw_phone = extract_date_and_phone(file_name)
-        phone = standardize_phone_number(raw_phone)
 
         if not (date and phone):
             logger(f"Skipping {file_name}: couldn't extract valid date or phone")
@@ -95,114 +159,138 @@ def process_audio_files(uploaded_files, test_mode=True, logger=print):
         all_phones.append(phone)
         file_info.append((uploaded_file, file_name, date, phone))
 
-    customer_map = get_existing_customers(all_phones, test_mode)
+    customer_map = get_existing_customers(all_phones, test_mode, CUSTOMER_FIELDS)
     transcript_table = get_table("ivr_transcripts", test_mode)
     memory_table = get_table("memory", test_mode)
-    existing_transcripts = supabase.table(transcript_table).select("recording").execute().data
-    processed_recordings = set(row["recording"] for row in existing_transcripts if row["recording"])
-
-
+    # Only look up the uploaded file names (indexed, see customers_db/migrations.sql)
+    existing_transcripts = fetch_rows_in(transcript_table, "recording", [file_name for _, file_name, _, _ in file_info], "recording")
+    processed_recordings = set(row["recording"] for row in existing_transcripts)
+    customer_updates = {}
+
+    cache_hits = silent_files = original_bytes = uploaded_bytes = processed_files = failed_files = 0
+    failed_customer_updates = 0
+    new_files = []
     for uploaded_file, file_name, date, phone in file_info:
         if file_name in processed_recordings:
             logger(f"⏩ Skipping already processed file: {file_name}")
-            continue
-
-        logger(f"Processing {file_name} (Date: {date}, Phone: {phone})")
+        else:
+            new_files.append((uploaded_file, file_name, date, phone))
 
-        try:
-            with open(f"temp_{file_name}", "wb") as temp_file:
-                temp_file.write(uploaded_file.read())
-                temp_path = temp_file.name
-
-            duration_seconds = get_audio_duration_seconds(temp_path)
-            if duration_seconds is not None and duration_seconds < 10:
-                logger(f"⏩ Skipping short audio ({duration_seconds:.1f}s) for {file_name}")
-
-                extracted_phone = phone  # always use filename phone
-                customer = customer_map.get(extracted_phone)
-
-                if customer:
-                    customer_id = customer["customer_id"]
-                else:
-                    customer_table = get_table("customers", test_mode)
-                    try:
-                        insert_res = supabase.table(customer_table).insert({"phone_number": extracted_phone}).execute()
-                        customer_id = insert_res.data[0]["customer_id"]
-                    except Exception:
-                        # Likely a duplicate; fetch the existing customer_id
-                        existing = supabase.table(customer_table).select("customer_id").eq("phone_number", extracted_phone).limit(1).execute()
-                        if existing.data:
-                            customer_id = existing.data[0]["customer_id"]
-                        else:
-                            raise
-                    customer = {"phone_number": extracted_phone, "customer_id": customer_id}
-                    customer_map[extracted_phone] = customer
-
-                supabase.table(transcript_table).insert({
-                    "customer_id": customer_id,
-                    "content": "",
-                    "date_recording": date,
-                    "sentiment": None,
-                    "recording": file_name,
-                    "category": "Spam: irrelevant"
-                }).execute()
+    new_phones = [phone for _, _, _, phone in new_files if phone not in customer_map]
+    if new_phones:
+        customer_map.update(create_customers(new_phones, test_mode))
 
-                try:
-                    os.remove(temp_path)
-                except Exception:
-                    pass
-                continue
+    transcript_writer = BatchWriter(transcript_table, max_seconds=IVR_WRITE_FLUSH_SECONDS)
+    memory_writer = BatchWriter(memory_table, max_seconds=IVR_WRITE_FLUSH_SECONDS)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(new_files))))
+    try:
+        futures = [executor.submit(analyze_recording, uploaded_file, file_name) for uploaded_file, file_name, _, _ in new_files]
 
-            transcript = transcribe_audio(temp_path)
-            extracted = extract_facts(transcript)
+        for (uploaded_file, file_name, date, phone), future in zip(new_files, futures):
+            logger(f"Processing {file_name} (Date: {date}, Phone: {phone})")
 
-            extracted_phone = phone  # always use filename phone
-            customer = customer_map.get(extracted_phone)
+            try:
+                analysis = future.result()
+                cache_hits += analysis["cached"]
+                silent_files += analysis["silent"]
+                original_bytes += analysis.get("original_bytes", 0)
+                uploaded_bytes += analysis.get("uploaded_bytes", 0)
 
-            if customer:
+                customer = customer_map.get(phone)  # always use filename phone
+                if not customer:
+                    raise RuntimeError(f"Customer for {phone} could not be created")
                 customer_id = customer["customer_id"]
-            else:
-                customer_table = get_table("customers", test_mode)
-                try:
-                    insert_res = supabase.table(customer_table).insert({"phone_number": extracted_phone}).execute()
-                    customer_id = insert_res.data[0]["customer_id"]
-                except Exception:
-                    # Likely a duplicate; fetch the existing customer_id
-                    existing = supabase.table(customer_table).select("customer_id").eq("phone_number", extracted_phone).limit(1).execute()
-                    if existing.data:
-                        customer_id = existing.data[0]["customer_id"]
-                    else:
-                        raise
-                customer = {"phone_number": extracted_phone, "customer_id": customer_id}
-                customer_map[extracted_phone] = customer
-
-            update_customer_info(customer_id, extracted, customer, test_mode)
-
-            supabase.table(transcript_table).insert({
-                "customer_id": customer_id,
-                "content": transcript,
-                "date_recording": date,
-                "sentiment": none_if_empty(extracted.get("sentiment")),
-                "recording": file_name,
-                "category": none_if_empty(extracted.get("category"))
-            }).execute()
-
-            memory_content = []
-            for key, value in extracted.items():
-                if key in ["name", "company_name", "address", "email", "phone_number", "sentiment"]:
+
+                if analysis["silent"]:
+                    # Not stored, so a call wrongly found silent is checked again on the next import
+                    logger(f"⏩ Skipping silent audio for {file_name}")
                     continue
-                if value:
-                    memory_content.append(f"{key}: {value}")
 
-            if memory_content:
-                supabase.table(memory_table).insert({
-                    "customer_id": customer_id,
-                    "content": ", ".join(memory_content),
-                    "source": "transcript"
-                }).execute()
+                if analysis["transcript"] is None:
+                    logger(f"⏩ Skipping short audio ({analysis['duration_seconds']:.1f}s) for {file_name}")
+
+                    transcript_writer.add({
+                        "customer_id": customer_id,
+                        "content": "",
+                        "date_recording": date,
+                        "sentiment": None,
+                        "recording": file_name,
+                        "category": "Spam: irrelevant"
+                    })
+                    continue
 
-            logger(f"✅ Processed {file_name}")
+                transcript = analysis["transcript"]
+                extracted = analysis["extracted"]
 
+                update_customer_info(customer_id, extracted, customer, customer_updates)
+
+                transcript_writer.add({
+                    "customer_id": customer_id,
+                    "content": transcript,
+                    "date_recording": date,
+                    "sentiment": none_if_empty(extracted.get("sentiment")),
+                    "recording": file_name,
+                    "category": none_if_empty(extracted.get("category"))
+                })
+
+                memory_content = []
+                for key, value in extracted.items():
+                    if key in ["name", "company_name", "address", "email", "phone_number", "sentiment"]:
+                        continue
+                    if value:
+                        memory_content.append(f"{key}: {value}")
+
+                if memory_content:
+                    memory_writer.add({
+                        "customer_id": customer_id,
+                        "content": ", ".join(memory_content),
+                        "source": "transcript"
+                    })
+
+                processed_files += 1
+                logger(f"✅ Processed {file_name}")
+
+            except Exception as e:
+                failed_files += 1
+                error_msg = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger(f"❌ Error processing {file_name}: {error_msg}")
+    finally:
+        # Also when the import is interrupted (e.g. a Streamlit rerun): don't start the
+        # recordings still queued, but store what the finished ones produced
+        executor.shutdown(cancel_futures=True)
+        transcript_writer.close()
+        memory_writer.close()
+        try:
+            merge_customer_fields(customer_updates, test_mode)
         except Exception as e:
+            failed_customer_updates = len(customer_updates)
             error_msg = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
-            logger(f"❌ Error processing {file_name}: {error_msg}")
+            logger(f"❌ Error updating customer details: {error_msg}")
+        if new_files:
+            # Stop the transcriber's worker processes (local Whisper) until the next import
+            get_transcriber().close()
+
+    write_summaries = {}
+    for label, writer in [("transcripts", transcript_writer), ("memories", memory_writer)]:
+        summary = write_summaries[label] = summarize_write_results(writer.results)
+        if summary["failed_batches"]:
+            logger(f"❌ {summary['rows_failed']} {label} could not be written")
+    failed_recordings = [row["recording"] for row in transcript_writer.failed_rows]
+    if failed_recordings:
+        logger(f"❌ Not stored, import again: {', '.join(failed_recordings)}")
+
+    if cache_hits:
+        logger(f"♻️ {cache_hits} recordings reused cached transcripts")
+    if original_bytes and not FFMPEG:
+        logger("ffmpeg not found, recordings were uploaded without pre-processing")
+    elif original_bytes or silent_files:
+        logger(f"🎚️ Pre-processing uploaded {uploaded_bytes / 1e6:.1f} MB instead of {original_bytes / 1e6:.1f} MB "
+               f"({1 - uploaded_bytes / max(original_bytes, 1):.0%} saved), {silent_files} silent recordings skipped")
+
+    return {
+        "recordings": len(uploaded_files),
+        "processed": processed_files,
+        "failed_recordings": failed_files,
+        "failed_customer_updates": failed_customer_updates,
+        **write_summaries,
+    }
@@ -1,11 +1,12 @@
+import numpy as np
 import pandas as pd
 import uuid
 
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from src.models import Customer, Order, OrderItem
 
-from src.data_import.db import supabase, get_table, BATCH_SIZE, batch_insert_orders, get_existing_receipts_ids, get_existing_customers
-from src.utils import standardize_phone_number, get_spreadsheet_data, validate_spreadsheet_columns, format_receipt_id
+from src.data_import.db import get_table, batch_insert_orders, get_existing_receipts_ids, get_existing_customers, merge_customer_fields, write_batches, summarize_write_results
+from src.utils import standardize_phone_numbers, get_spreadsheet_data, iter_spreadsheet_chunks, validate_spreadsheet_columns, format_receipt_ids, parse_dates
 
 
 order_type_mapping = {
@@ -15,16 +16,52 @@ order_type_mapping = {
 }
 
 
-def batch_insert_customers(customers: List[Customer], use_test_tables) -> Dict[str, str]:
+def log_write_results(label: str, results: List[dict], logger=None):
+    summary = summarize_write_results(results)
+    if not logger or not summary["batches"]:
+        return
+    if summary["failed_batches"]:
+        logger(f"⚠️ Inserted {summary['rows_written']} of {summary['rows_written'] + summary['rows_failed']} {label}: "
+               f"{summary['failed_batches']} of {summary['batches']} batches failed")
+        for result in results:
+            if not result["ok"]:
+                logger(f"  rows {result['start']}-{result['start'] + result['rows']}: {result['error']}")
+    else:
+        logger(f"Inserted {summary['rows_written']} {label} in {summary['batches']} batches ({summary['retries']} retries)")
+
+
+def batch_insert_customers(customers: List[Customer], use_test_tables, logger=None) -> Tuple[Dict[str, str], List[dict]]:
+    """
+    Insert the new customers and fill the empty name/email/address of existing ones.
+
+    Filling existing customers keeps a chunked import identical to a whole-file one:
+    a customer created from an earlier chunk gets the details that only later chunks
+    carry. Returns the customer ids by phone number and the write_batches results.
+    """
     customer_id_map = {}
     existing_customers = {}
 
     # Lookup existing customers
     phone_numbers = [customer.phone_number for customer in customers]
-    existing_customers = get_existing_customers(phone_numbers, use_test_tables)
+    existing_customers = get_existing_customers(phone_numbers, use_test_tables, "customer_id, name, email, address")
     for phone_number in existing_customers:
         customer_id_map[phone_number] = existing_customers[phone_number]["customer_id"]
 
+    customer_updates = {}
+    for customer in customers:
+        existing = existing_customers.get(customer.phone_number)
+        if existing:
+            missing_fields = {
+                field: getattr(customer, field) for field in ["name", "email", "address"]
+                if not existing.get(field) and getattr(customer, field)
+            }
+            if missing_fields:
+                customer_updates[existing["customer_id"]] = missing_fields
+    if customer_updates:
+        merge_customer_fields(customer_updates, use_test_tables)
+        if logger:
+            logger(f"Filled missing details of {len(customer_updates)} existing customers")
+
     # Insert new customers
     new_customers = [
         customer for customer in customers 
@@ -35,21 +72,21 @@ def batch_insert_customers(customers: List[Customer], use_test_tables) -> Dict[s
         customer.customer_id = str(uuid.uuid4())
         customer_id_map[customer.phone_number] = customer.customer_id
 
-    for i in range(0, len(new_customers), BATCH_SIZE):
-        batch = [customer.model_dump() for customer in new_customers[i:i + BATCH_SIZE]]
-        supabase.table(get_table("customers", use_test_tables)).insert(batch).execute()
+    rows = [customer.model_dump() for customer in new_customers]
+    results = write_batches(get_table("customers", use_test_tables), rows, on_conflict="customer_id")
+    log_write_results("customers", results, logger)
 
-    return customer_id_map
+    # Customers of failed batches don't exist, leave their orders unlinked
+    for result in results:
+        if not result["ok"]:
+            for row in rows[result["start"]:result["start"] + result["rows"]]:
+                del customer_id_map[row["phone_number"]]
 
+    return customer_id_map, results
 
 
-def process_pos_data(file_path, disable_test_pos_data=False, logger=None):
-
-    use_test_tables = not disable_test_pos_data
-
-    data = get_spreadsheet_data(file_path)
-    validate_spreadsheet_columns(data, "servquick_columns")
 
+def clean_pos_data(data: pd.DataFrame, logger=None) -> pd.DataFrame:
     data = data.dropna(subset=["Receipt no"])
 
     # Data Cleaning
@@ -85,38 +122,94 @@ def process_pos_data(file_path, disable_test_pos_data=False, logger=None):
     else:
         data["__Service_charge_line_total__"] = 0.0
 
-    # Group Items by Receipt Number
-    grouped = data.groupby("Receipt no").apply(lambda group: {
-        "order_items": group.apply(lambda row: OrderItem(
-            item_name=row["Item name"],
-            quantity=row["Item quantity"],
-            amount=row["Item amount"]
-        ), axis=1).tolist(),
-        "order_items_text": "; ".join(
-            f'{row["Item name"]} (x{row["Item quantity"]})' for _, row in group.iterrows()
-        )
-    }).reset_index(name="grouped_data")
+    return data
+
+
+def build_receipts(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Collapse POS line items into one row per receipt in a single grouping pass.
+
+    Each receipt keeps the columns of its first line item, in order of first
+    appearance, plus its order items, their text summary and the item/tax/service
+    charge totals.
+    """
+    codes, _ = pd.factorize(data["Receipt no"])
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes)
+    ends = np.cumsum(counts)
+    starts = ends - counts
 
     # Compute receipt-level totals including taxes and service charge
-    receipt_totals = (
-        data.groupby("Receipt no", as_index=False)
-            .agg(items_total=("Item amount", "sum"),
-                 tax_total=("__Tax_line_total__", "sum"),
-                 service_charge_total=("__Service_charge_line_total__", "sum"))
-    )
-    receipt_totals["total_with_tax_service"] = (
-        receipt_totals["items_total"] +
-        receipt_totals["tax_total"] +
-        receipt_totals["service_charge_total"]
+    totals = pd.DataFrame({
+        "items_total": data["Item amount"].to_numpy(),
+        "tax_total": data["__Tax_line_total__"].to_numpy(),
+        "service_charge_total": data["__Service_charge_line_total__"].to_numpy(),
+    }).groupby(codes).sum()
+
+    # Build the order items of all receipts at once, sorted so that each receipt is a contiguous slice
+    names = data["Item name"].to_numpy()[order].tolist()
+    quantities = data["Item quantity"].to_numpy()[order].tolist()
+    amounts = data["Item amount"].to_numpy()[order].tolist()
+    items = [
+        OrderItem(item_name=name, quantity=quantity, amount=amount)
+        for name, quantity, amount in zip(names, quantities, amounts)
+    ]
+    items_text = [f"{name} (x{quantity})" for name, quantity in zip(names, quantities)]
+
+    receipts = data.iloc[order[starts]].reset_index(drop=True)
+    receipts["order_items"] = [items[start:end] for start, end in zip(starts, ends)]
+    receipts["order_items_text"] = ["; ".join(items_text[start:end]) for start, end in zip(starts, ends)]
+    for column in totals.columns:
+        receipts[column] = totals[column].to_numpy()
+    receipts["total_with_tax_service"] = (
+        receipts["items_total"] +
+        receipts["tax_total"] +
+        receipts["service_charge_total"]
     )
+    return receipts
+
+
+def extract_customers(receipts: pd.DataFrame) -> List[Customer]:
+    """
+    Build one Customer per standardized phone number found in the receipts.
+
+    Each field takes the first non-empty value across all receipts of that phone
+    number, in receipt order.
+    """
+    customer_data = pd.DataFrame({
+        "phone_number": receipts["__Phone_number__"],
+        "name": receipts["Customer name"],
+        "email": receipts["Customer email"],
+        "address": receipts["Customer address"],
+    }).dropna(subset=["phone_number"])
+
+    for field in ["name", "email", "address"]:
+        values = customer_data[field]
+        customer_data[field] = values.where(values.astype(str).str.strip() != "")
+
+    first_values = customer_data.groupby("phone_number", sort=False).first()
+    first_values = first_values.astype(object).where(first_values.notna(), None)
+
+    return [
+        Customer(phone_number=phone_number, name=name, email=email, address=address)
+        for phone_number, name, email, address in zip(
+            first_values.index, first_values["name"], first_values["email"], first_values["address"]
+        )
+    ]
+
+
+def import_pos_frame(data: pd.DataFrame, use_test_tables: bool, logger=None) -> dict:
+    """
+    Build and insert the Customers and Orders of a cleaned POS frame.
+
+    Every receipt must be complete within `data`. Returns the number of receipts seen.
+    """
+    final_data = build_receipts(data)
 
-    final_data = data.drop_duplicates("Receipt no")
-    final_data = pd.merge(final_data, grouped, on="Receipt no", how="left")
-    final_data = pd.merge(final_data, receipt_totals, on="Receipt no", how="left")
-    
     # Logging time frame of the receipts
     if not final_data["Sale date"].isna().all():
-        final_data["Sale date"] = pd.to_datetime(final_data["Sale date"], errors='coerce')
+        # Parsed value by value like format_receipt_id, not in a format guessed from the chunk's first row
+        final_data["Sale date"] = parse_dates(final_data["Sale date"])
         
         min_date = final_data["Sale date"].min()
         max_date = final_data["Sale date"].max()
@@ -125,38 +218,19 @@ def process_pos_data(file_path, disable_test_pos_data=False, logger=None):
             logger(f"Processing receipts from {min_date.strftime('%d/%m/%Y')} to {max_date.strftime('%d/%m/%Y')}")
 
 
-    # Process all Customers
-    customers = []
-    for _, row in final_data.iterrows():
-        phone_number = standardize_phone_number(row.get("Customer mobile"))
-        if pd.isna(phone_number) or not phone_number:
-            continue  # Skip if no phone number
-
-        if phone_number in [cust.phone_number for cust in customers]:
-            continue # Skip if Customer was already processed
-
-        email = row.get("Customer email")
-        address = row.get("Customer address")
-
-        customer = Customer(
-            name=row.get("Customer name"),
-            phone_number=phone_number,
-            email=email if not pd.isna(email) else None,
-            address=address if not pd.isna(address) else None
-        )
-        customers.append(customer)
+    final_data["__Phone_number__"] = standardize_phone_numbers(final_data["Customer mobile"])
 
-    customer_id_map = batch_insert_customers(customers, use_test_tables)
+    # Process all Customers
+    customers = extract_customers(final_data)
+    customer_id_map, customer_results = batch_insert_customers(customers, use_test_tables, logger)
     if logger:
         logger(f"Processing {len(customers)} customers ...")
 
     # Process all Orders
 
     # First, fetch existing receipt IDs from the database using shared util
-    def _fmt_row_receipt(row):
-        return format_receipt_id(str(row["Receipt no"]), row["Sale date"]) if not pd.isna(row["Receipt no"]) else None
-
-    receipt_ids = final_data.apply(_fmt_row_receipt, axis=1).dropna().unique().tolist()
+    final_data["__Receipt_id__"] = format_receipt_ids(final_data["Receipt no"], final_data["Sale date"])
+    receipt_ids = final_data["__Receipt_id__"].unique().tolist()
 
     # Now fetch existing formatted receipt IDs from the database
     existing_receipt_ids = get_existing_receipts_ids(receipt_ids, use_test_tables)
@@ -176,7 +250,7 @@ def process_pos_data(file_path, disable_test_pos_data=False, logger=None):
             continue
         order_date_str = parsed_date.isoformat()
 
-        formatted_receipt_id = format_receipt_id(str(receipt_no), parsed_date)
+        formatted_receipt_id = row["__Receipt_id__"]
 
         # Skip if already in database
         if formatted_receipt_id in existing_receipt_ids:
@@ -184,21 +258,21 @@ def process_pos_data(file_path, disable_test_pos_data=False, logger=None):
                 logger(f"Skipping order with receipt ID: {formatted_receipt_id} - already in the database")
             continue
 
-        customer_id = customer_id_map.get(standardize_phone_number(row["Customer mobile"]))
+        customer_id = customer_id_map.get(row["__Phone_number__"])
 
         # When processing orders, add logic like for location name
         location_name = 'Santorini' if row.get('Register name') == 'CO-50010' else 'Lahore'
 
         total_with_tax_service = row.get("total_with_tax_service")
         if pd.isna(total_with_tax_service):
-            total_with_tax_service = sum(item.amount for item in row['grouped_data']["order_items"])  # Fallback
+            total_with_tax_service = sum(item.amount for item in row["order_items"])  # Fallback
 
         order = Order(
             order_id=str(uuid.uuid4()),
             customer_id=customer_id,
             order_date=order_date_str,
-            order_items=row['grouped_data']["order_items"],
-            order_items_text=row['grouped_data']["order_items_text"],
+            order_items=row["order_items"],
+            order_items_text=row["order_items_text"],
             total_amount=float(total_with_tax_service) if total_with_tax_service is not None else None,
             order_type=order_type_mapping.get(row["Ordertype name"]),
             receipt_id=formatted_receipt_id,
@@ -206,7 +280,80 @@ def process_pos_data(file_path, disable_test_pos_data=False, logger=None):
         )
         orders.append(order)
 
-    batch_insert_orders(orders, use_test_tables)
+    order_results = batch_insert_orders(orders, use_test_tables)
+    log_write_results("orders", order_results, logger)
+
+    return {"receipts": len(final_data), "customers": customer_results, "orders": order_results}
+
+
+def _iter_clean_pos_chunks(file_path, chunk_size, logger=None):
+    for chunk in iter_spreadsheet_chunks(file_path, chunk_size):
+        validate_spreadsheet_columns(chunk, "servquick_columns")
+        yield clean_pos_data(chunk, logger)
+
+
+def _iter_complete_receipts(chunks):
+    """
+    Re-cut a stream of POS chunks so that no receipt is split across two frames.
+
+    The rows of the last receipt in each chunk are held back and prepended to the
+    next chunk, since its remaining line items may not have been read yet.
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            carry = chunk
+            continue
+
+        last_receipt = chunk["Receipt no"].iloc[-1]
+        is_last_receipt = chunk["Receipt no"] == last_receipt
+        carry = chunk[is_last_receipt]
+        if len(carry) < len(chunk):
+            yield chunk[~is_last_receipt]
+
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def process_pos_data(file_path, disable_test_pos_data=False, logger=None, chunk_size=None):
+    """
+    Import a ServQuick "Sales Details by receipt" export.
+
+    `file_path` may also be bytes or a file-like object such as a Streamlit upload.
+
+    With `chunk_size` set, the export is read and imported `chunk_size` rows at a
+    time so memory stays flat regardless of the file size. This relies on the export
+    listing the line items of a receipt on consecutive rows, which ServQuick does.
+
+    Failed write batches don't stop the import. Returns the number of receipts and
+    the summarize_write_results of the customer and order inserts, so callers can
+    tell a partial import from a complete one.
+    """
+    use_test_tables = not disable_test_pos_data
+
+    if chunk_size:
+        chunks = _iter_complete_receipts(_iter_clean_pos_chunks(file_path, chunk_size, logger))
+    else:
+        data = get_spreadsheet_data(file_path)
+        validate_spreadsheet_columns(data, "servquick_columns")
+        chunks = [clean_pos_data(data, logger)]
+
+    receipts_count = 0
+    customer_results, order_results = [], []
+    for chunk_number, chunk in enumerate(chunks, start=1):
+        if chunk_size and logger:
+            logger(f"Chunk {chunk_number}: {len(chunk)} line items")
+        imported = import_pos_frame(chunk, use_test_tables, logger)
+        receipts_count += imported["receipts"]
+        customer_results.extend(imported["customers"])
+        order_results.extend(imported["orders"])
 
     if logger:
-        logger(f"Processing complete. {len(final_data)} receipts processed.")
+        logger(f"Processing complete. {receipts_count} receipts processed.")
+    return {
+        "receipts": receipts_count,
+        "customers": summarize_write_results(customer_results),
+        "orders": summarize_write_results(order_results),
+    }
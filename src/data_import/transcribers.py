@@ -0,0 +1,161 @@
+import multiprocessing
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from src.clients import require_env
+from src.data_import.audio_preprocessing import decode_pcm, SAMPLE_RATE
+from src.utils import open_binary_source
+
+
+# ElevenLabs setup
+ELEVENLABS_MODEL_ID = os.environ.get("ELEVENLABS_MODEL_ID", "scribe_v1")
+ELEVENLABS_STT_URL = "https://api.elevenlabs.io/v1/speech-to-text"
+
+# Local Whisper setup (pip install openai-whisper); 30s is the window Whisper is trained on
+WHISPER_MODEL = os.environ.get("IVR_WHISPER_MODEL", "base")
+WHISPER_LANGUAGE = os.environ.get("IVR_WHISPER_LANGUAGE", "bn")
+WHISPER_CHUNK_SECONDS = 30
+WHISPER_OVERLAP_SECONDS = 2
+WHISPER_MAX_OVERLAP_WORDS = 8
+
+
+class Transcriber(ABC):
+    """
+    Speech-to-text backend for IVR recordings.
+
+    `model_id` identifies the backend and model, e.g. for the transcript cache, and
+    transcribe() turns the bytes of one recording into text. Implementations must be
+    safe to call from several threads at once. close() releases what an import held
+    on to (worker processes); the transcriber can still be used afterwards.
+    """
+
+    model_id: str
+
+    @abstractmethod
+    def transcribe(self, audio: bytes, file_name: str) -> str:
+        ...
+
+    def close(self):
+        pass
+
+
+class ElevenLabsTranscriber(Transcriber):
+    def __init__(self, model_id: str = ELEVENLABS_MODEL_ID):
+        self.model_id = model_id
+
+    def transcribe(self, audio, file_name):
+        import requests
+
+        with open_binary_source(audio) as f:
+            files = {'file': (os.path.basename(file_name), f, 'audio/mpeg')}
+            data = {'model_id': self.model_id}
+            response = requests.post(
+                ELEVENLABS_STT_URL,
+                headers={"xi-api-key": require_env("ELEVENLABS_API_KEY")},
+                files=files,
+                data=data
+            )
+            response.raise_for_status()
+            return response.json().get("text", "")
+
+
+# Whisper model of a worker process, loaded once by _load_whisper_model
+_whisper_model = None
+
+
+def _load_whisper_model(model_name: str):
+    global _whisper_model
+    import whisper
+
+    _whisper_model = whisper.load_model(model_name, device="cpu")
+
+
+def _transcribe_chunk(samples: np.ndarray, language: str) -> str:
+    result = _whisper_model.transcribe(samples, language=language, fp16=False)
+    return result["text"].strip()
+
+
+def split_overlapping_chunks(samples: np.ndarray, chunk_length: int, overlap: int):
+    step = chunk_length - overlap
+    return [samples[start:start + chunk_length] for start in range(0, max(len(samples) - overlap, 1), step)]
+
+
+def merge_overlapping_texts(texts, max_overlap_words: int = WHISPER_MAX_OVERLAP_WORDS) -> str:
+    """
+    Join the transcripts of overlapping chunks, dropping the words a chunk repeats
+    from the end of the previous one.
+    """
+    words = []
+    for text in texts:
+        chunk_words = text.split()
+        for size in range(min(max_overlap_words, len(words), len(chunk_words)), 0, -1):
+            if words[-size:] == chunk_words[:size]:
+                chunk_words = chunk_words[size:]
+                break
+        words.extend(chunk_words)
+    return " ".join(words)
+
+
+class WhisperTranscriber(Transcriber):
+    """
+    Local CPU transcription with a Whisper model, as tried in notebooks/Bangla_STT.ipynb.
+
+    Calls are split into WHISPER_CHUNK_SECONDS chunks overlapping by
+    WHISPER_OVERLAP_SECONDS so no word is cut in half, and the chunks of all
+    recordings being transcribed share a pool of `workers` processes, each loading
+    the model once. The pool is started on first use and stopped by close(). Its
+    processes are spawned rather than forked, since the recordings are transcribed
+    from a thread pool and forking a process that runs threads can deadlock.
+    """
+
+    def __init__(self, model_name: str = WHISPER_MODEL, language: str = WHISPER_LANGUAGE, workers: int = None):
+        self.model_name = model_name
+        self.language = language
+        self.model_id = f"whisper-{model_name}-{language}"
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Recordings are transcribed from several threads; only one may start the pool
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_load_whisper_model, initargs=(self.model_name,)
+                )
+            return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def transcribe(self, audio, file_name):
+        if not isinstance(audio, (bytes, bytearray)):
+            with open_binary_source(audio) as f:
+                audio = f.read()
+        samples = decode_pcm(audio).astype(np.float32) / 32768.0
+        chunks = split_overlapping_chunks(
+            samples, WHISPER_CHUNK_SECONDS * SAMPLE_RATE, WHISPER_OVERLAP_SECONDS * SAMPLE_RATE
+        )
+        futures = [self.pool.submit(_transcribe_chunk, chunk, self.language) for chunk in chunks]
+        return merge_overlapping_texts(future.result() for future in futures)
+
+
+@lru_cache(maxsize=None)
+def get_transcriber(backend: str = None) -> Transcriber:
+    """The transcriber selected by IVR_STT_BACKEND: "elevenlabs" (default) or "whisper"."""
+    backend = (backend or os.environ.get("IVR_STT_BACKEND", "elevenlabs")).lower()
+    if backend == "elevenlabs":
+        return ElevenLabsTranscriber()
+    if backend == "whisper":
+        return WhisperTranscriber()
+    raise ValueError(f"Unknown IVR_STT_BACKEND: {backend}")
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def content_hash(audio: bytes) -> str:
+    return hashlib.sha256(audio).hexdigest()
+
+
+class TranscriptCache:
+    """
+    On-disk cache of IVR transcripts and extracted facts, keyed by audio content and model.
+
+    Keys are the SHA-256 of the recording and the speech-to-text model id, so renamed
+    or re-downloaded recordings hit the cache and a model change misses it. The
+    transcript is stored as soon as it exists and the facts once extracted, so a run
+    that fails in between only repeats the extraction. When the stored entries
+    exceed `max_bytes`, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    content_hash TEXT NOT NULL,
+                    model_id TEXT NOT NULL,
+                    transcript TEXT NOT NULL,
+                    extracted TEXT,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (content_hash, model_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS transcripts_last_used ON transcripts (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, audio_hash: str, model_id: str) -> dict | None:
+        """Return {"transcript", "extracted"} for a recording, extracted being None if not stored yet."""
+        with self.lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT transcript, extracted FROM transcripts WHERE content_hash = ? AND model_id = ?",
+                (audio_hash, model_id),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE transcripts SET last_used = ? WHERE content_hash = ? AND model_id = ?",
+                (time.time(), audio_hash, model_id),
+            )
+        transcript, extracted = row
+        return {"transcript": transcript, "extracted": json.loads(extracted) if extracted is not None else None}
+
+    def put(self, audio_hash: str, model_id: str, transcript: str, extracted: dict = None):
+        extracted_json = json.dumps(extracted) if extracted is not None else None
+        size = len(transcript.encode()) + len((extracted_json or "").encode())
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transcripts (content_hash, model_id, transcript, extracted, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (audio_hash, model_id, transcript, extracted_json, size, time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM transcripts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for audio_hash, model_id, size in conn.execute(
+            "SELECT content_hash, model_id, size FROM transcripts ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append((audio_hash, model_id))
+            total -= size
+        conn.executemany("DELETE FROM transcripts WHERE content_hash = ? AND model_id = ?", evicted)
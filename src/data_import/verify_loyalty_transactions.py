@@ -1,8 +1,9 @@
 from typing import Callable, Dict, List
 
 import pandas as pd
-from src.data_import.db import supabase, get_table, get_existing_orders
-from src.utils import format_receipt_id
+from src.clients import get_supabase
+from src.data_import.db import get_table, get_existing_orders, fetch_rows_in
+from src.utils import format_receipt_ids
 
 
 def _within_ten_percent(a: float | None, b: float | None) -> bool:
@@ -25,7 +26,7 @@ def verify_loyalty_transactions(logger: Callable[[str], None] = print) -> Dict[s
     tx_table = get_table("transactions", False)
 
     # Fetch transactions missing order_id
-    response = supabase.table(tx_table).select(
+    response = get_supabase().table(tx_table).select(
         "id, created_at, pos_receipt_id, order_id, bill_total, member_id, recorded_by"
     ).is_("order_id", None).execute()
 
@@ -38,13 +39,16 @@ def verify_loyalty_transactions(logger: Callable[[str], None] = print) -> Dict[s
     # Build receipt_ids
     receipt_ids: List[str] = []
     tx_by_receipt: Dict[str, List[Dict]] = {}
-    for tx in transactions:
-        rid = format_receipt_id(tx.get("pos_receipt_id", ""), tx.get("created_at", ""))
+    formatted_receipt_ids = format_receipt_ids(
+        pd.Series([tx.get("pos_receipt_id", "") for tx in transactions], dtype=object),
+        pd.Series([tx.get("created_at", "") for tx in transactions], dtype=object),
+    )
+    for tx, rid in zip(transactions, formatted_receipt_ids):
         receipt_ids.append(rid)
         tx_by_receipt.setdefault(rid, []).append(tx)
 
     # Fetch corresponding orders
-    orders_map = get_existing_orders(list(set(receipt_ids)), False)
+    orders_map = get_existing_orders(list(set(receipt_ids)), False, "order_id, total_amount, order_type")
 
     # Fetch member -> customer mapping, then customer -> name mapping
     member_ids = [tx.get("member_id") for tx in transactions if tx.get("member_id")]
@@ -53,15 +57,13 @@ def verify_loyalty_transactions(logger: Callable[[str], None] = print) -> Dict[s
 
     if member_ids:
         members_table = get_table("members", False)
-        mem_res = supabase.table(members_table).select("member_id, customer_id").in_("member_id", member_ids).execute()
-        for row in mem_res.data or []:
+        for row in fetch_rows_in(members_table, "member_id", member_ids, "member_id, customer_id"):
             member_id_to_customer_id[row.get("member_id")] = row.get("customer_id")
 
         customer_ids = [cid for cid in member_id_to_customer_id.values() if cid]
         if customer_ids:
             customers_table = get_table("customers", False)
-            cust_res = supabase.table(customers_table).select("customer_id, name").in_("customer_id", list(set(customer_ids))).execute()
-            for row in cust_res.data or []:
+            for row in fetch_rows_in(customers_table, "customer_id", customer_ids, "customer_id, name"):
                 customer_id_to_name[row.get("customer_id")] = row.get("name")
 
     def _customer_name_for_tx(tx: Dict) -> str:
@@ -118,7 +120,7 @@ def verify_loyalty_transactions(logger: Callable[[str], None] = print) -> Dict[s
             # Update the transaction with the matched order_id
             try:
                 # In supabase-py, call update(...) first, then chain eq/is_ filters, then execute()
-                query = supabase.table(tx_table).update({"order_id": order_id})
+                query = get_supabase().table(tx_table).update({"order_id": order_id})
                 if tx.get("id") is not None:
                     query = query.eq("id", tx["id"]).is_("order_id", None)
                 else:
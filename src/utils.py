@@ -1,35 +1,127 @@
+import csv
+import io
+import itertools
+import os
+import numpy as np
 import pandas as pd
 import logging
+from contextlib import contextmanager
 from typing import List
 import yaml
-import pandas as pd
+from pathlib import Path
+
 
+CONFIG_PATH = Path(__file__).resolve().parent.parent / "spreadsheets_config.yaml"
 
-with open('spreadsheets_config.yaml', 'r') as file:
+with open(CONFIG_PATH, 'r') as file:
     columns_config = yaml.safe_load(file)
 
 
-def get_spreadsheet_data(file_path: str):
-    # Function to read the file and dynamically skip rows
-    def dynamic_skip(file_reader, file_path):
-        skip = 0
-        while True:
-            # Read the file with the current number of skipped rows
-            df = file_reader(file_path, skiprows=skip)
-            
-            # Check if the DataFrame has the expected column names
-            if "Customer name" in df.columns or "Contact Number" in df.columns:
-                return df  # Return the valid DataFrame
-            
-            # Increment the number of rows to skip and try again
-            skip += 1
+HEADER_SCAN_ROWS = 30
+
 
-    if file_path.endswith(".csv"):
-        # Handle CSV files with dynamic skipping
-        return dynamic_skip(pd.read_csv, file_path)
+def find_header_row(rows: List[list], min_matches: int = 2):
+    """
+    Return the index of the first row that looks like the header of one of the
+    schemas in spreadsheets_config.yaml, or None if no such row is found.
+    """
+    schemas = [set(columns) for columns in columns_config.values()]
+    for index, row in enumerate(rows):
+        cells = {str(cell).strip() for cell in row if not pd.isna(cell)}
+        if any(len(cells & schema) >= min(min_matches, len(schema)) for schema in schemas):
+            return index
+    return None
+
+
+@contextmanager
+def open_binary_source(source):
+    """
+    Open a path, bytes or binary file-like object (e.g. a Streamlit upload) for reading.
+
+    Paths are opened and closed again; bytes are wrapped without being written
+    anywhere; file-like objects are rewound and left open for the caller.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            yield file
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
     else:
-        # Handle Excel files with dynamic skipping
-        return dynamic_skip(pd.read_excel, file_path)
+        source.seek(0)
+        yield source
+
+
+def source_name(source, default: str = "") -> str:
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, "name", None) or default
+
+
+def _is_csv(source, file) -> bool:
+    name = source_name(source)
+    if name:
+        return name.lower().endswith(".csv")
+    # No name to go by: .xlsx files are zip archives and .xls files OLE2 documents
+    signature = file.read(4)
+    file.seek(0)
+    return signature not in (b"PK\x03\x04", b"\xd0\xcf\x11\xe0")
+
+
+def _locate_csv_header(file, scan_rows: int, name: str) -> int:
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        preview = list(itertools.islice(csv.reader(text), scan_rows))
+    finally:
+        # Hand the binary file back untouched for the full parse
+        text.detach()
+    file.seek(0)
+
+    header_row = find_header_row(preview)
+    if header_row is None:
+        raise ValueError(f"Could not find a header row in the first {scan_rows} rows of {name}")
+    return header_row
+
+
+def get_spreadsheet_data(source, scan_rows: int = HEADER_SCAN_ROWS):
+    """
+    Read a CSV/Excel export, skipping any banner rows above the header.
+
+    `source` is a path, bytes or a binary file-like object such as a Streamlit upload,
+    which is parsed straight from memory. Only the first `scan_rows` rows are inspected
+    to locate the header, then the file is parsed once starting from that row.
+    """
+    name = source_name(source, "the uploaded file")
+    with open_binary_source(source) as file:
+        if _is_csv(source, file):
+            return pd.read_csv(file, skiprows=_locate_csv_header(file, scan_rows, name))
+
+        # Open the workbook once and reuse it for both the preview and the full parse
+        with pd.ExcelFile(file) as workbook:
+            preview = workbook.parse(header=None, nrows=scan_rows)
+            header_row = find_header_row(preview.values.tolist())
+            if header_row is None:
+                raise ValueError(f"Could not find a header row in the first {scan_rows} rows of {name}")
+            return workbook.parse(skiprows=header_row)
+
+
+def iter_spreadsheet_chunks(source, chunk_size: int, scan_rows: int = HEADER_SCAN_ROWS):
+    """
+    Yield the rows of a CSV/Excel export as DataFrames of at most `chunk_size` rows.
+
+    `source` is anything get_spreadsheet_data accepts. CSV files are streamed. Excel
+    files cannot be read incrementally by pandas, so the sheet is parsed once and
+    handed out in slices.
+    """
+    with open_binary_source(source) as file:
+        if _is_csv(source, file):
+            header_row = _locate_csv_header(file, scan_rows, source_name(source, "the uploaded file"))
+            with pd.read_csv(file, skiprows=header_row, chunksize=chunk_size) as reader:
+                yield from reader
+            return
+
+    data = get_spreadsheet_data(source, scan_rows)
+    for start in range(0, len(data), chunk_size):
+        yield data.iloc[start:start + chunk_size]
 
 
 # Function to standardize phone numbers
@@ -56,28 +148,130 @@ def standardize_phone_number(phone_number):
 
     return f"+{phone_number}"  # Add the '+' prefix
 
+
+# Longer values are standardized one by one, see standardize_phone_numbers
+MAX_PHONE_TEXT_LENGTH = 40
+
+
+def _standardize_phone_block(text: np.ndarray) -> np.ndarray:
+    # View the fixed-width unicode strings as a (rows, width) matrix of code points
+    codes = text.view(np.uint32).reshape(len(text), -1)
+    width = codes.shape[1]
+
+    # Digit mask matching str.isdigit: ASCII digits for the common case, and a
+    # per-code-point lookup for the rare rows with non-ASCII characters
+    is_digit = (codes >= 48) & (codes <= 57)
+    non_ascii = (codes > 127).any(axis=1)
+    if non_ascii.any():
+        unique_codes = np.unique(codes[non_ascii])
+        digit_codes = unique_codes[[chr(code).isdigit() for code in unique_codes]]
+        is_digit[non_ascii] = np.isin(codes[non_ascii], digit_codes)
+
+    # Remove spaces, dashes, and other non-numeric characters by packing digits to the front
+    digit_counts = is_digit.sum(axis=1)
+    rows = np.repeat(np.arange(len(text)), digit_counts)
+    positions = np.cumsum(is_digit, axis=1, dtype=np.int32)[is_digit] - 1
+    digits = np.zeros((len(text), width + 3), dtype=np.uint32)
+    digits.ravel()[rows * (width + 3) + positions] = codes[is_digit]
+
+    # Strip the leading zero or the 880 country code to get the local number
+    starts_with_zero = digits[:, 0] == ord("0")
+    starts_with_880 = (digits[:, 0] == ord("8")) & (digits[:, 1] == ord("8")) & (digits[:, 2] == ord("0"))
+    offsets = np.where(starts_with_zero, 1, np.where(starts_with_880, 3, 0))
+    local_lengths = digit_counts - offsets
+    local = digits[:, :width].copy()
+    for offset in (1, 3):
+        shifted = offsets == offset
+        local[shifted] = digits[shifted, offset:offset + width]
+
+    prefixed = np.empty((len(text), width + 4), dtype=np.uint32)
+    prefixed[:, :4] = [ord(char) for char in "+880"]
+    prefixed[:, 4:] = local
+    standardized = prefixed.view(f"<U{width + 4}").ravel().astype(object)
+
+    invalid = (local_lengths < 8) | (local_lengths > 15)
+    for phone_number in standardized[invalid]:
+        logging.warning(f"Invalid phone number length for: {phone_number[1:]}")
+    standardized[invalid] = None
+    return standardized
+
+
+def standardize_phone_numbers(phone_numbers: pd.Series, block_size: int = 100_000) -> pd.Series:
+    """
+    Column-wise version of standardize_phone_number.
+
+    Returns a Series aligned with `phone_numbers` holding "+880..." strings, or None
+    for missing values and numbers with an invalid length. The work is done on NumPy
+    code point matrices, `block_size` numbers at a time to bound memory use; values
+    longer than MAX_PHONE_TEXT_LENGTH characters are standardized one by one.
+    """
+    standardized = np.full(len(phone_numbers), None, dtype=object)
+    present = phone_numbers.notna().to_numpy()
+    values = phone_numbers[present]
+    if pd.api.types.is_numeric_dtype(values):
+        # Numbers parsed as floats/ints by pandas would otherwise pick up a trailing ".0"
+        values = values.round().astype("int64")
+
+    text = values.astype(str).to_numpy(dtype=object)
+    # The code point matrix of a block is as wide as its longest string, so cells far
+    # longer than a phone number (notes, pasted garbage) take the scalar path instead
+    is_long = np.fromiter(map(len, text), dtype=np.int64, count=len(text)) > MAX_PHONE_TEXT_LENGTH
+    short_text = text[~is_long]
+    results = [
+        _standardize_phone_block(short_text[start:start + block_size].astype(str))
+        for start in range(0, len(short_text), block_size)
+    ]
+    present_standardized = np.full(len(text), None, dtype=object)
+    if results:
+        present_standardized[~is_long] = np.concatenate(results)
+    present_standardized[is_long] = [standardize_phone_number(value) for value in text[is_long]]
+    standardized[present] = present_standardized
+    return pd.Series(standardized, index=phone_numbers.index, dtype=object)
+
+
+RATING_MAP = {
+    'poor': 1,
+    'fair': 2,
+    'good': 3,
+    'great': 4
+}
+
+
 def convert_rating(value):
     """
     Convert rating strings to integers.
     """
-    rating_map = {
-        'poor': 1,
-        'fair': 2,
-        'good': 3,
-        'great': 4
-    }
-
     if pd.isna(value):
         return 0  # Default to 0 for missing values
 
     cleaned_value = str(value).lower().strip()
-    return rating_map.get(cleaned_value, 1)
+    return RATING_MAP.get(cleaned_value, 1)
+
+
+def convert_ratings(values: pd.Series) -> pd.Series:
+    """
+    Column-wise version of convert_rating, returning small ints.
+    """
+    cleaned_values = values.astype(object).where(values.notna(), None).astype(str).str.lower().str.strip()
+    ratings = cleaned_values.map(RATING_MAP).fillna(1)
+    return ratings.where(values.notna(), 0).astype("int8")
+
+
+EMAIL_PLACEHOLDERS = ["-", "--", "---", ""]
+
 
 def is_valid_email(email):
     """
     Check if an email is valid (simple validation to exclude placeholders).
     """
-    return email not in ["-", "--", "---", None, ""] and not pd.isna(email)
+    return email not in [*EMAIL_PLACEHOLDERS, None] and not pd.isna(email)
+
+
+def valid_emails(emails: pd.Series) -> pd.Series:
+    """
+    Column-wise version of is_valid_email, returning a boolean mask.
+    """
+    return emails.notna() & ~emails.isin(EMAIL_PLACEHOLDERS)
 
 
 def validate_spreadsheet_columns(data: pd.DataFrame, data_source: str):
@@ -97,4 +291,36 @@ def format_receipt_id(pos_receipt_id: str, date_like) -> str:
     dt = pd.to_datetime(date_like, errors="coerce")
     if pd.isna(dt):
         return f"{pos_receipt_id}_INVALID_DATE"
-    return f"{pos_receipt_id}_{dt.strftime('%d_%m_%Y')}"
\ No newline at end of file
+    return f"{pos_receipt_id}_{dt.strftime('%d_%m_%Y')}"
+
+
+def parse_dates(dates: pd.Series) -> pd.Series:
+    """
+    Parse a column of date-like values, with NaT where a value cannot be parsed.
+
+    Each distinct value is parsed on its own, as pd.to_datetime parses a single value,
+    so a column mixing day-first and month-first dates reads every date the way
+    format_receipt_id does. Raises ValueError for columns mixing time zones, which
+    cannot share a datetime column.
+    """
+    codes, distinct_dates = pd.factorize(dates)
+    parsed = [pd.to_datetime(date_like, errors="coerce") for date_like in distinct_dates] + [pd.NaT]
+    # Missing values have code -1, which picks the trailing NaT
+    return pd.Series(pd.to_datetime(pd.Series(parsed, dtype=object)).to_numpy()[codes], index=dates.index)
+
+
+def format_receipt_ids(pos_receipt_ids: pd.Series, dates: pd.Series) -> pd.Series:
+    """
+    Column-wise version of format_receipt_id.
+
+    Returns a Series aligned with `pos_receipt_ids` holding "<pos_receipt_id>_dd_mm_YYYY",
+    or "<pos_receipt_id>_INVALID_DATE" where the matching date cannot be parsed. Each
+    distinct date is formatted once by format_receipt_id.
+    """
+    codes, distinct_dates = pd.factorize(pd.Series(dates.to_numpy()))
+    suffixes = np.array([format_receipt_id("", date_like)[1:] for date_like in distinct_dates] + ["INVALID_DATE"],
+                        dtype=object)
+
+    receipt_numbers = pos_receipt_ids.to_numpy(dtype=object).astype(str).astype(object)
+    return pd.Series(receipt_numbers + "_" + suffixes[codes], index=pos_receipt_ids.index)
+
@@ -0,0 +1,13 @@
+import pytest
+
+from src.data_import import db
+
+from fake_supabase import FakeSupabase
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    client = FakeSupabase()
+    monkeypatch.setattr(db, "get_supabase", lambda: client)
+    monkeypatch.setattr(db, "CUSTOMER_INDEX_PATH", None)
+    return client
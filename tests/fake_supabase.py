@@ -0,0 +1,137 @@
+import threading
+from collections import defaultdict
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.operation = "select"
+        self.columns = "*"
+        self.filters = []
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.row_range = None
+
+    def select(self, columns="*"):
+        self.operation, self.columns = "select", columns
+        return self
+
+    def insert(self, rows):
+        self.operation, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self.operation, self.payload = "upsert", rows
+        self.on_conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in set(values))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def order(self, column):
+        return self
+
+    def range(self, start, end):
+        self.row_range = (start, end)
+        return self
+
+    def execute(self):
+        return self.client.execute(self)
+
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        return self.client.execute_rpc(self)
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the Supabase client, enough for the db.py helpers.
+
+    Every request is recorded in `requests` as (table or function, operation). Rows
+    inserted into the customers tables get a `customer_id` numbered in insertion
+    order. `fail` may be set to a function of (table_name, operation, query)
+    returning an exception to raise for that request.
+    """
+
+    def __init__(self):
+        self.tables = defaultdict(list)
+        self.requests = []
+        self.rpc_calls = []
+        self.fail = None
+        self.lock = threading.Lock()
+
+    def table(self, table_name):
+        return FakeQuery(self, table_name)
+
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+    def execute(self, query):
+        with self.lock:
+            self.requests.append((query.table_name, query.operation))
+            error = self.fail and self.fail(query.table_name, query.operation, query)
+            if error:
+                raise error
+            rows = self.tables[query.table_name]
+
+            if query.operation == "select":
+                matches = [row for row in rows if all(matches_filter(row) for matches_filter in query.filters)]
+                if query.row_range:
+                    matches = matches[query.row_range[0]:query.row_range[1] + 1]
+                if query.columns != "*":
+                    names = [name.strip() for name in query.columns.split(",")]
+                    matches = [{name: row.get(name) for name in names} for row in matches]
+                return FakeResponse([dict(row) for row in matches])
+
+            inserted = []
+            for row in query.payload if isinstance(query.payload, list) else [query.payload]:
+                row = dict(row)
+                if query.on_conflict and any(existing.get(query.on_conflict) == row.get(query.on_conflict) for existing in rows):
+                    if query.ignore_duplicates:
+                        continue
+                    raise ValueError(f"duplicate key value violates unique constraint on {query.on_conflict}")
+                if query.table_name.startswith("customers"):
+                    row.setdefault("customer_id", f"customer-{len(rows) + 1}")
+                rows.append(row)
+                inserted.append(dict(row))
+            return FakeResponse(inserted)
+
+    def execute_rpc(self, rpc):
+        with self.lock:
+            self.requests.append((rpc.name, "rpc"))
+            self.rpc_calls.append((rpc.name, rpc.params))
+            if rpc.name != "fill_customer_fields":
+                return FakeResponse([])
+
+            # Fill only the empty fields, as the function in customers_db/migrations.sql does
+            customers = {row["customer_id"]: row for row in self.tables[rpc.params["target_table"]]}
+            updated = []
+            for patch in rpc.params["patches"]:
+                customer = customers.get(patch["customer_id"])
+                if customer is None:
+                    continue
+                for field, value in patch.items():
+                    if field == "is_VIP":
+                        customer[field] = customer.get(field) or value
+                    elif not customer.get(field):
+                        customer[field] = value
+                updated.append(dict(customer))
+            return FakeResponse(updated)
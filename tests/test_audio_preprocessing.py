@@ -0,0 +1,57 @@
+import numpy as np
+
+from src.data_import.audio_preprocessing import SAMPLE_RATE, TRIM_PADDING_SECONDS, speech_bounds
+
+
+def recording(noise_dbfs, speech_dbfs=None, speech_seconds=(4, 7), seconds=10):
+    """Gaussian line noise with a 300 Hz tone standing in for speech, as 16-bit samples."""
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * SAMPLE_RATE) / SAMPLE_RATE
+    samples = rng.normal(0, 32768 * 10 ** (noise_dbfs / 20), len(t))
+    if speech_dbfs is not None:
+        start, end = (int(s * SAMPLE_RATE) for s in speech_seconds)
+        amplitude = 32768 * 10 ** (speech_dbfs / 20) * np.sqrt(2)
+        samples[start:end] += amplitude * np.sin(2 * np.pi * 300 * t[start:end])
+    return np.clip(samples, -32768, 32767).astype(np.int16)
+
+
+def test_finds_normal_speech_with_padding():
+    start, end = speech_bounds(recording(noise_dbfs=-60, speech_dbfs=-20))
+
+    padding = TRIM_PADDING_SECONDS * SAMPLE_RATE
+    assert abs(start - (4 * SAMPLE_RATE - padding)) < 0.05 * SAMPLE_RATE
+    assert abs(end - (7 * SAMPLE_RATE + padding)) < 0.05 * SAMPLE_RATE
+
+
+def test_quiet_speech_is_not_silence():
+    # Well below a fixed -40 dBFS threshold, but far above the line noise
+    assert speech_bounds(recording(noise_dbfs=-80, speech_dbfs=-52)) is not None
+
+
+def test_line_noise_alone_is_silence():
+    assert speech_bounds(recording(noise_dbfs=-45)) is None
+    assert speech_bounds(np.zeros(10 * SAMPLE_RATE, dtype=np.int16)) is None
+
+
+def test_short_blip_is_silence():
+    assert speech_bounds(recording(noise_dbfs=-70, speech_dbfs=-20, speech_seconds=(4, 4.5))) is None
+
+
+def test_call_that_is_all_speech_is_kept():
+    bounds = speech_bounds(recording(noise_dbfs=-60, speech_dbfs=-20, speech_seconds=(0, 10)))
+
+    assert bounds == (0, 10 * SAMPLE_RATE)
+
+
+def test_call_with_little_silence_is_kept():
+    start, end = speech_bounds(recording(noise_dbfs=-60, speech_dbfs=-20, speech_seconds=(0.2, 9.8)))
+
+    assert end - start >= 9.6 * SAMPLE_RATE
+
+
+def test_speech_10_db_above_noise_is_kept():
+    # Loud and quiet lines alike
+    assert speech_bounds(recording(noise_dbfs=-30, speech_dbfs=-20, speech_seconds=(1, 9))) is not None
+    start, end = speech_bounds(recording(noise_dbfs=-60, speech_dbfs=-50))
+    assert abs(start - (4 - TRIM_PADDING_SECONDS) * SAMPLE_RATE) < 0.05 * SAMPLE_RATE
+    assert abs(end - (7 + TRIM_PADDING_SECONDS) * SAMPLE_RATE) < 0.05 * SAMPLE_RATE
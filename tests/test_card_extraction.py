@@ -0,0 +1,136 @@
+import json
+import os
+
+import cv2
+import httpx
+import numpy as np
+import openai
+import pytest
+
+from src.data_import import openai_business_card_parsing as parsing
+from src.data_import.card_preprocessing import preprocess_card_image
+from src.data_import.openai_business_card_parsing import AdaptiveLimiter, extract_with_backoff, preprocess_card_images
+
+CARD = {"Name": "Asha", "Email": "asha@example.com", "Phone": "01712345678", "Company Name": "", "Address": ""}
+
+
+def completion(content):
+    return httpx.Response(200, json={
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": json.dumps(content)}}],
+    })
+
+
+def error(status, headers=None):
+    return httpx.Response(status, headers=headers, json={"error": {"message": "slow down", "type": "requests"}})
+
+
+class FakeOpenAI:
+    """An OpenAI client whose API answers with `responses` in turn, the last one repeating."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self.client = openai.OpenAI(
+            api_key="test", max_retries=0,
+            http_client=httpx.Client(transport=httpx.MockTransport(self.respond)),
+        )
+
+    def respond(self, request):
+        self.requests += 1
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(parsing.time, "sleep", sleeps.append)
+    monkeypatch.setattr(parsing, "CARD_RETRY_BASE_DELAY", 10.0)
+    return sleeps
+
+
+def test_rate_limits_wait_as_long_as_the_api_asks(sleeps):
+    fake = FakeOpenAI(error(429, {"retry-after-ms": "20"}), error(429, {"retry-after": "1.5"}), completion(CARD))
+    limiter = AdaptiveLimiter(8)
+
+    assert extract_with_backoff(b"card", limiter, fake.client) == CARD
+    assert fake.requests == 3
+    assert sleeps == [0.02, 1.5]
+    assert limiter.limit == 2 and limiter.active == 0
+
+
+def test_without_retry_after_backs_off_exponentially(sleeps):
+    fake = FakeOpenAI(error(429), error(503, {"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"}), completion(CARD))
+    limiter = AdaptiveLimiter(8)
+
+    assert extract_with_backoff(b"card", limiter, fake.client) == CARD
+    assert 10 <= sleeps[0] <= 20 and 20 <= sleeps[1] <= 40
+    # Only rate limits shrink the limit
+    assert limiter.limit == 4
+
+
+def test_overlong_retry_after_is_ignored(sleeps):
+    fake = FakeOpenAI(error(429, {"retry-after": "3600"}), completion(CARD))
+
+    assert extract_with_backoff(b"card", AdaptiveLimiter(8), fake.client) == CARD
+    assert 10 <= sleeps[0] <= 20
+
+
+def test_gives_up_after_max_retries(sleeps):
+    fake = FakeOpenAI(error(429, {"retry-after": "0"}))
+    limiter = AdaptiveLimiter(8)
+
+    with pytest.raises(openai.RateLimitError):
+        extract_with_backoff(b"card", limiter, fake.client, max_retries=3)
+    assert fake.requests == 4
+    assert sleeps == [0, 0, 0]
+    assert limiter.limit == 1 and limiter.active == 0
+
+
+def test_other_errors_are_not_retried(sleeps):
+    fake = FakeOpenAI(error(400), completion(CARD))
+
+    with pytest.raises(openai.BadRequestError):
+        extract_with_backoff(b"card", AdaptiveLimiter(8), fake.client)
+    assert fake.requests == 1 and sleeps == []
+
+
+def test_limit_recovers_after_successes():
+    limiter = AdaptiveLimiter(8, recover_after=2)
+    limiter.throttled()
+    for _ in range(4):
+        limiter.succeeded()
+
+    assert limiter.limit == 6
+
+
+def crash_on(image):
+    """preprocess_card_image, except that the worker process dies on b"crash" and raises on b"raise"."""
+    if image == b"crash":
+        os._exit(1)
+    if image == b"raise":
+        raise MemoryError("out of memory")
+    return preprocess_card_image(image)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failed_preprocessing_sends_images_unprocessed(monkeypatch, workers):
+    noise = np.random.default_rng(0).integers(0, 255, (600, 1000, 3), dtype=np.uint8)
+    scan = cv2.imencode(".png", noise)[1].tobytes()
+    images = [scan, b"raise", scan] + ([b"crash", scan] if workers > 1 else [])
+    monkeypatch.setattr(parsing, "preprocess_card_image", crash_on)
+    logs = []
+
+    prepared = preprocess_card_images(images, workers=workers, logger=logs.append)
+
+    assert [card["original_bytes"] for card in prepared] == [len(image) for image in images]
+    assert prepared[1]["image"] == b"raise" and not prepared[1]["cropped"]
+    if workers == 1:
+        assert prepared[0]["processed_bytes"] < len(scan)
+    else:
+        # The dead worker takes down the images its pool still had, they are sent as they are
+        assert prepared[3]["image"] == b"crash"
+        assert all(card["image"] in (image, preprocess_card_image(image)["image"])
+                   for card, image in zip(prepared, images))
+    assert logs and all(message.startswith("Sending a card image unprocessed") for message in logs)
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.data_import.card_preprocessing import MAX_SHORT_SIDE, find_card_corners, image_mime_type, preprocess_card_image
+
+WIDTH, HEIGHT = 2000, 1500
+
+
+def card(width=1900, height=1100, logo=False):
+    image = np.full((height, width, 3), 235, np.uint8)
+    if logo:
+        image[100:500, 100:700] = (40, 60, 160)
+    for y in range(600 if logo else 150, height - 50, 110):
+        cv2.putText(image, "ACME Ltd  +8801711000000", (80, y), cv2.FONT_HERSHEY_SIMPLEX, 1.8, (20, 20, 20), 3)
+    return image
+
+
+def table(seed=0):
+    """A noisy dark background, like a desk behind the card."""
+    rng = np.random.default_rng(seed)
+    return np.full((HEIGHT, WIDTH, 3), 60, np.uint8) + rng.integers(0, 30, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+
+def place(image, card_image, center, angle=0):
+    height, width = card_image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    matrix[:, 2] += [center[0] - width / 2, center[1] - height / 2]
+    size = (image.shape[1], image.shape[0])
+    mask = cv2.warpAffine(np.full((height, width), 255, np.uint8), matrix, size) > 0
+    image[mask] = cv2.warpAffine(card_image, matrix, size)[mask]
+    return image
+
+
+def photo(coverage, angle=0):
+    """A card covering `coverage` of a photo of a table."""
+    width = int((coverage * WIDTH * HEIGHT * 1.73) ** 0.5)
+    return place(table(), cv2.resize(card(), (width, int(width / 1.73))), (WIDTH / 2, HEIGHT / 2), angle)
+
+
+def encode(image):
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+@pytest.mark.parametrize("coverage", [0.15, 0.19, 0.3, 0.44, 0.6])
+@pytest.mark.parametrize("angle", [0, 8, -15])
+def test_crops_card_photos(coverage, angle):
+    result = preprocess_card_image(encode(photo(coverage, angle)))
+
+    assert result["cropped"]
+    cropped = cv2.imdecode(np.frombuffer(result["image"], np.uint8), cv2.IMREAD_COLOR)
+    assert min(cropped.shape[:2]) <= MAX_SHORT_SIDE
+    assert 1.5 < cropped.shape[1] / cropped.shape[0] < 2.0
+
+
+@pytest.mark.parametrize("scan", [card(2000, 1200), card(2000, 1200, logo=True)])
+def test_keeps_flat_scans_whole(scan):
+    result = preprocess_card_image(encode(scan))
+
+    assert not result["cropped"]
+    assert result["processed_bytes"] < result["original_bytes"]
+
+
+def test_skips_larger_outlines_that_are_not_the_card():
+    # A square notebook next to the card is the largest outline, but not card-shaped
+    image = table(seed=1)
+    image[200:1300, 50:1150] = (200, 200, 200)
+    image = place(image, cv2.resize(card(), (800, 470)), (1580, 750))
+
+    corners = find_card_corners(image)
+
+    assert corners is not None
+    assert corners[:, 0].min() > 1150
+
+
+def test_undecodable_images_are_sent_unchanged():
+    result = preprocess_card_image(b"not an image")
+
+    assert result["image"] == b"not an image"
+    assert not result["cropped"]
+
+
+def test_mime_type_from_magic_bytes():
+    png = cv2.imencode(".png", np.zeros((10, 10, 3), np.uint8))[1].tobytes()
+
+    assert image_mime_type(png) == "image/png"
+    assert image_mime_type(b"RIFF\0\0\0\0WEBPVP8 ") == "image/webp"
+    assert image_mime_type(b"unknown") == "image/jpeg"
@@ -0,0 +1,45 @@
+import json
+
+import data_import_cli
+
+POS_EXPORT = """\
+Sales Details by receipt,,,,,,,,,
+Receipt no,Sale date,Ordertype name,Item name,Item quantity,Item amount,Customer name,Customer mobile,Customer email,Customer address
+R1,01/03/2024,Eat in,Margherita,1,900,Asha,01712345678,,
+R1,01/03/2024,Eat in,Coke,2,200,Asha,01712345678,,
+R2,02/03/2024,Take away,Pasta,1,750,Rafi,01812345678,rafi@example.com,
+"""
+
+
+def run_cli(argv, capsys):
+    exit_code = data_import_cli.main(argv)
+    captured = capsys.readouterr()
+    return exit_code, json.loads(captured.out), captured.err
+
+
+def test_pos_import_succeeds(fake_supabase, tmp_path, capsys):
+    export = tmp_path / "export.csv"
+    export.write_text(POS_EXPORT)
+
+    exit_code, summary, _ = run_cli(["pos", str(export)], capsys)
+
+    assert exit_code == 0
+    assert summary["ok"] and summary["runs"][0]["failures"] == 0
+    assert len(fake_supabase.tables["orders_testing"]) == 2
+
+
+def test_failed_batches_fail_the_run(fake_supabase, tmp_path, capsys):
+    export = tmp_path / "export.csv"
+    export.write_text(POS_EXPORT)
+    fake_supabase.fail = lambda table_name, operation, query: (
+        ValueError("rejected") if table_name == "orders_testing" and operation != "select" else None
+    )
+
+    exit_code, summary, stderr = run_cli(["pos", str(export)], capsys)
+
+    # stdout holds only the JSON summary, the errors db.py prints go to stderr
+    assert exit_code == 1
+    assert not summary["ok"] and summary["failed"] == 1
+    assert summary["runs"][0]["error"] is None
+    assert summary["runs"][0]["result"]["orders"]["rows_failed"] == 2
+    assert "Error writing orders_testing" in stderr
@@ -0,0 +1,32 @@
+import io
+
+from src.data_import import new_customer_data
+from src.data_import.new_customer_data import process_customer_data
+
+COLUMNS = ["Contact Number", "First Name", "Last Name", "Email", "Address", "Company Name", "VIP Status",
+           "Receipt No.", "Remarks", "Date", "Food Review", "Service", "Cleanliness", "Atmosphere", "Value",
+           "Where did they hear from us?", "Overall Experience"]
+
+
+def customer_sheet(rows):
+    lines = [",".join(COLUMNS)]
+    for i in range(rows):
+        lines.append(f"0171{i:07d},First{i},Last{i},c{i}@example.com,House {i},,No,R{i},Nice,2024-03-05,"
+                     "Good,Great,Good,Fair,Good,Instagram,Great")
+    return io.BytesIO("\n".join(lines).encode())
+
+
+def test_logs_lookup_requests_against_per_step_lookups(fake_supabase, monkeypatch):
+    monkeypatch.setattr(new_customer_data, "get_supabase", lambda: fake_supabase)
+    fake_supabase.tables["customers_testing"].extend(
+        {"customer_id": f"c{i}", "phone_number": f"+880171{i:07d}"} for i in range(0, 250, 2)
+    )
+    logs = []
+
+    process_customer_data(customer_sheet(250), logger=logs.append)
+
+    snapshot = next(message for message in logs if message.startswith("Customer snapshot"))
+    assert snapshot == ("Customer snapshot: 125 customers found with 3 requests, shared by 4 steps; "
+                        "looking them up in each step would take 12 requests (4 x 3)")
+    customer_lookups = [request for request in fake_supabase.requests if request == ("customers_testing", "select")]
+    assert len(customer_lookups) == 3
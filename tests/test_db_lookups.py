@@ -0,0 +1,118 @@
+import pytest
+
+from src.data_import import db
+from src.data_import.customer_index import CustomerIndex
+
+
+def phone(i):
+    return f"+88017{i:08d}"
+
+
+def add_customers(client, count):
+    client.tables["customers_testing"].extend(
+        {"customer_id": f"c{i}", "phone_number": phone(i), "name": f"n{i}", "modified_at": "2024-01-01T00:00:00"}
+        for i in range(count)
+    )
+
+
+def test_get_existing_customers_counts_requests(fake_supabase):
+    add_customers(fake_supabase, 150)
+    stats = {}
+    customers = db.get_existing_customers([phone(i) for i in range(250)], True, "customer_id", stats=stats)
+
+    assert len(customers) == 150
+    assert stats == {"requests": 3}
+    assert stats["requests"] == len(fake_supabase.requests)
+
+
+def test_get_existing_customers_counts_index_hits(fake_supabase, monkeypatch, tmp_path):
+    monkeypatch.setattr(db, "CUSTOMER_INDEX_PATH", str(tmp_path / "index" / "customers.sqlite"))
+    index = CustomerIndex(db.CUSTOMER_INDEX_PATH)
+    monkeypatch.setattr(db, "get_customer_index", lambda: index)
+    add_customers(fake_supabase, 150)
+    phones = [phone(i) for i in range(250)]
+
+    first, second = {}, {}
+    db.get_existing_customers(phones, True, "customer_id", stats=first)
+    customers = db.get_existing_customers(phones, True, "customer_id", stats=second)
+
+    assert len(customers) == 150
+    # One sync page, then the 100 unknown phone numbers in one chunk
+    assert first == {"requests": 2, "from_index": 150}
+    assert second == {"requests": 2, "from_index": 150}
+    assert len(fake_supabase.requests) == 4
+
+
+def test_fetch_rows_in_chunks_and_deduplicates_keys(fake_supabase):
+    add_customers(fake_supabase, 250)
+    keys = [phone(i) for i in range(250)] * 2 + [None]
+    rows = db.fetch_rows_in("customers_testing", "phone_number", keys, chunk_size=100)
+
+    assert fake_supabase.requests == [("customers_testing", "select")] * 3
+    assert sorted(row["phone_number"] for row in rows) == sorted(phone(i) for i in range(250))
+
+
+def test_fetch_rows_in_projects_columns_and_adds_the_key(fake_supabase):
+    add_customers(fake_supabase, 3)
+    rows = db.fetch_rows_in("customers_testing", "phone_number", [phone(0), phone(2)], "customer_id")
+
+    assert sorted(rows, key=lambda row: row["customer_id"]) == [
+        {"phone_number": phone(0), "customer_id": "c0"},
+        {"phone_number": phone(2), "customer_id": "c2"},
+    ]
+
+
+def test_fetch_rows_in_without_keys_makes_no_request(fake_supabase):
+    assert db.fetch_rows_in("customers_testing", "phone_number", [None]) == []
+    assert fake_supabase.requests == []
+
+
+def test_fetch_rows_in_failed_chunk(fake_supabase):
+    add_customers(fake_supabase, 250)
+    requests = []
+
+    def fail_second_chunk(table_name, operation, query):
+        requests.append(query)
+        return ConnectionError("reset") if len(requests) == 2 else None
+
+    fake_supabase.fail = fail_second_chunk
+    with pytest.raises(ConnectionError):
+        db.fetch_rows_in("customers_testing", "phone_number", [phone(i) for i in range(250)],
+                         chunk_size=100, max_workers=1)
+
+    requests.clear()
+    rows = db.fetch_rows_in("customers_testing", "phone_number", [phone(i) for i in range(250)],
+                            chunk_size=100, max_workers=1, skip_failed_chunks=True)
+    assert sorted(row["phone_number"] for row in rows) == [phone(i) for i in range(100)] + [phone(i) for i in range(200, 250)]
+
+
+def test_customer_index_drops_deleted_customers(fake_supabase, tmp_path):
+    add_customers(fake_supabase, 5)
+    index = CustomerIndex(str(tmp_path / "customers.sqlite"), reconcile_seconds=0)
+    index.sync(fake_supabase, "customers_testing")
+
+    # c1 deleted; c3 merged away into a new row keeping its phone number, modified before the last sync
+    table = fake_supabase.tables["customers_testing"]
+    table[:] = [row for row in table if row["customer_id"] not in ("c1", "c3")]
+    table.append({"customer_id": "c3-merged", "phone_number": phone(3), "modified_at": "2023-12-01T00:00:00"})
+    stats = {}
+    index.sync(fake_supabase, "customers_testing", stats=stats)
+
+    found, missing = index.lookup("customers_testing", [phone(i) for i in range(5)])
+    assert sorted(found) == [phone(0), phone(2), phone(4)]
+    assert missing == [phone(1), phone(3)]
+    # One page of ids, one page of modified rows
+    assert stats == {"requests": 2}
+
+
+def test_customer_index_reconciles_at_most_every_interval(fake_supabase, tmp_path):
+    add_customers(fake_supabase, 5)
+    index = CustomerIndex(str(tmp_path / "customers.sqlite"))
+    index.sync(fake_supabase, "customers_testing")
+    fake_supabase.tables["customers_testing"].pop(0)
+
+    stats = {}
+    index.sync(fake_supabase, "customers_testing", stats=stats)
+
+    assert stats == {"requests": 1}
+    assert phone(0) in index.lookup("customers_testing", [phone(0)])[0]
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import pytest
+
+from src.data_import import db, process_ivr_audio as ivr
+from src.data_import.transcribers import Transcriber
+from src.utils import standardize_phone_number
+
+from fake_supabase import FakeSupabase
+
+# Latency of the stubbed speech-to-text and fact extraction calls
+STT_SECONDS = 0.06
+LLM_SECONDS = 0.04
+RECORDINGS = 16
+
+
+class InFlight:
+    """
+    Counts the calls running at once. Until `expected` calls overlap, each call waits
+    (up to a second) for the others, so a loaded machine can't hide the overlap.
+    """
+
+    def __init__(self, expected=1):
+        self.expected = expected
+        self.active = 0
+        self.max_active = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.max_active >= self.expected, timeout=1)
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.active -= 1
+
+
+class StubTranscriber(Transcriber):
+    model_id = "stub"
+    closed = False
+    in_flight = InFlight()
+
+    def close(self):
+        self.closed = True
+
+    def transcribe(self, audio, file_name):
+        with self.in_flight:
+            time.sleep(STT_SECONDS)
+        return f"transcript of {file_name} ({len(audio)} bytes)"
+
+
+def stub_extract_facts(transcript):
+    time.sleep(LLM_SECONDS)
+    return {"name": f"Caller of {transcript.split()[2]}", "sentiment": "positive", "category": "Order", "interest": "pizza"}
+
+
+class Upload:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+def recordings(count):
+    # Every fifth recording is too short to transcribe
+    return [
+        Upload(f"rec_2024030{i % 9 + 1}_017{i % 6:08d}.mp3", b"short" if i % 5 == 0 else b"x" * (40 + i))
+        for i in range(count)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def stub_apis(monkeypatch):
+    monkeypatch.setattr(ivr, "get_transcriber", lambda: StubTranscriber())
+    monkeypatch.setattr(ivr, "extract_facts", stub_extract_facts)
+    monkeypatch.setattr(ivr, "get_transcript_cache", lambda: None)
+    monkeypatch.setattr(ivr, "get_audio_duration_seconds", lambda audio: 5.0 if audio == b"short" else 60.0)
+    monkeypatch.setattr(ivr, "preprocess_audio", lambda audio: {
+        "audio": audio, "original_bytes": len(audio), "processed_bytes": len(audio), "rejected": False,
+    })
+    monkeypatch.setattr(db, "CUSTOMER_INDEX_PATH", None)
+
+
+def run_import(monkeypatch, max_workers):
+    client = FakeSupabase()
+    monkeypatch.setattr(db, "get_supabase", lambda: client)
+    in_flight = InFlight(expected=max_workers)
+    monkeypatch.setattr(StubTranscriber, "in_flight", in_flight)
+    logs = []
+    ivr.process_audio_files(recordings(RECORDINGS), test_mode=True, logger=logs.append, max_workers=max_workers)
+    return client, logs, in_flight.max_active
+
+
+def test_concurrent_import_matches_serial_import(monkeypatch):
+    serial, serial_logs, _ = run_import(monkeypatch, max_workers=1)
+    concurrent, concurrent_logs, _ = run_import(monkeypatch, max_workers=8)
+
+    assert concurrent_logs == serial_logs
+    assert dict(concurrent.tables) == dict(serial.tables)
+    assert concurrent.rpc_calls == serial.rpc_calls
+    assert len(serial.tables["ivr_transcripts_testing"]) == RECORDINGS
+
+
+def test_workers_transcribe_at_once(monkeypatch):
+    _, _, serial_max = run_import(monkeypatch, max_workers=1)
+    _, _, concurrent_max = run_import(monkeypatch, max_workers=8)
+
+    # 12 of the recordings are long enough to transcribe, so all 8 workers are busy at once
+    assert serial_max == 1
+    assert concurrent_max == 8
+
+
+def test_interrupted_import_stores_finished_recordings(monkeypatch):
+    client = FakeSupabase()
+    monkeypatch.setattr(db, "get_supabase", lambda: client)
+    processed = []
+
+    def logger(message):
+        if message.startswith("✅"):
+            processed.append(message)
+            if len(processed) == 3:
+                raise KeyboardInterrupt
+
+    transcriber = StubTranscriber()
+    monkeypatch.setattr(ivr, "get_transcriber", lambda: transcriber)
+
+    with pytest.raises(KeyboardInterrupt):
+        ivr.process_audio_files(recordings(RECORDINGS), test_mode=True, logger=logger, max_workers=2)
+
+    # The rows buffered for the finished recordings and their customer updates are kept
+    assert len(client.tables["ivr_transcripts_testing"]) >= 3
+    assert [name for name, _ in client.rpc_calls] == ["fill_customer_fields"]
+    assert transcriber.closed
+
+
+def test_last_call_fills_customer_details(monkeypatch):
+    client, _, _ = run_import(monkeypatch, max_workers=8)
+
+    # Each caller phoned several times; the last long call's facts are kept, as with one UPDATE per call
+    expected = {}
+    for upload in recordings(RECORDINGS):
+        if upload.data != b"short":
+            phone = standardize_phone_number(ivr.extract_date_and_phone(upload.name)[1])
+            transcript = f"transcript of {upload.name} ({len(upload.data)} bytes)"
+            expected[phone] = stub_extract_facts(transcript)["name"]
+    names = {row["phone_number"]: row["name"] for row in client.tables["customers_testing"]}
+    assert {phone: names[phone] for phone in expected} == expected
@@ -0,0 +1,79 @@
+import logging
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import utils
+from src.utils import standardize_phone_number, standardize_phone_numbers
+
+
+def scalar(values):
+    return [standardize_phone_number(value) for value in values]
+
+
+@pytest.mark.parametrize("values", [
+    ["01712345678", "+880 1712-345678", "8801712345678", "1712345678", "(017) 1234 5678"],
+    ["0171234567", "017123", "", "abc", "880", "0", "+88 01712 345678", "01712345678901234567"],
+    ["০১৭১২৩৪৫৬৭৮", "017১২৩৪৫৬৭৮", "0171234567²", "٠١٧١٢٣٤٥٦٧٨"],
+    [None, np.nan, "01712345678", None],
+])
+def test_matches_scalar_version(values):
+    assert standardize_phone_numbers(pd.Series(values, dtype=object)).tolist() == scalar(values)
+
+
+def test_matches_scalar_version_on_random_strings():
+    rng = random.Random(0)
+    alphabet = "0123456789" * 4 + " -+()./abcxyz" + "০১২৩৪৫৬৭৮৯" + "²³"
+    values = [
+        None if rng.random() < 0.02 else
+        rng.choice(["", "0", "880", "+880"]) + "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 22)))
+        for _ in range(30_000)
+    ]
+    series = pd.Series(values, dtype=object)
+
+    # Small blocks also exercise the block boundaries
+    assert standardize_phone_numbers(series, block_size=4_096).tolist() == scalar(values)
+
+
+def test_numeric_columns_are_read_as_whole_numbers():
+    numbers = pd.Series([1712345678.0, 8801712345678, np.nan, 123])
+
+    assert standardize_phone_numbers(numbers).tolist() == [
+        "+8801712345678", "+8801712345678", None, None,
+    ]
+
+
+def test_keeps_index_and_logs_like_scalar_version(caplog):
+    values = pd.Series(["0171", "01712345678"], index=[10, 20], dtype=object)
+    with caplog.at_level(logging.WARNING):
+        standardize_phone_number("0171")
+    expected_messages = caplog.messages
+    caplog.clear()
+
+    with caplog.at_level(logging.WARNING):
+        result = standardize_phone_numbers(values)
+
+    assert result.index.tolist() == [10, 20]
+    assert caplog.messages == expected_messages
+
+
+def test_long_cells_match_scalar_version():
+    values = ["01712345678", "note: " + "call after 6pm, " * 125, "0171-234-5678" + " " * 60, "x" * 2_000, None]
+
+    assert standardize_phone_numbers(pd.Series(values, dtype=object)).tolist() == scalar(values)
+
+
+def test_long_cell_does_not_widen_the_blocks(monkeypatch):
+    values = pd.Series(["01712345678"] * 300_000 + ["x" * 2_000], dtype=object)
+    widths = []
+    standardize_block = utils._standardize_phone_block
+    monkeypatch.setattr(utils, "_standardize_phone_block",
+                        lambda text: widths.append(text.dtype.itemsize // 4) or standardize_block(text))
+
+    result = standardize_phone_numbers(values)
+
+    # One 2000 character cell would otherwise make every block 2000 code points wide
+    assert max(widths) <= utils.MAX_PHONE_TEXT_LENGTH
+    assert result.iloc[0] == "+8801712345678" and result.iloc[-1] is None
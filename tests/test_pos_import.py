@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+from src.data_import.servquick_pos_data import process_pos_data
+
+from fake_supabase import FakeSupabase
+
+HEADER = ("Receipt no,Sale date,Ordertype name,Item name,Item quantity,Item amount,Tax amount,"
+          "Customer name,Customer mobile,Customer email,Customer address\n")
+
+
+def pos_export(receipts=300, customers=20, date_format="2024-03-{day:02d} 12:00"):
+    """An export whose customers come back every few receipts, with their details only on some."""
+    lines = ["Sales Details by receipt\n", HEADER]
+    for receipt in range(receipts):
+        customer, visit = receipt % customers, receipt // customers
+        name = f"Customer {customer}" if visit % 2 else ""
+        email = f"customer{customer}@example.com" if visit % 3 == 2 else ""
+        address = f"House {customer}" if visit % 5 == 4 else ""
+        for item in range(receipt % 3 + 1):
+            lines.append(f"R{receipt},{date_format.format(day=receipt % 28 + 1)},Eat in,Item {item},1,\"1,{item}00\",5,"
+                         f"{name},0171{customer:07d},{email},{address}\n")
+    return "".join(lines).encode()
+
+
+def import_export(monkeypatch, data, chunk_size):
+    client = FakeSupabase()
+    monkeypatch.setattr("src.data_import.db.get_supabase", lambda: client)
+    monkeypatch.setattr("src.data_import.db.CUSTOMER_INDEX_PATH", None)
+    result = process_pos_data(io.BytesIO(data), logger=lambda message: None, chunk_size=chunk_size)
+
+    customers = {row["customer_id"]: row for row in client.tables["customers_testing"]}
+    customer_rows = sorted(
+        (row["phone_number"], row["name"], row["email"], row["address"]) for row in customers.values()
+    )
+    orders = sorted(
+        (row["receipt_id"], row["total_amount"], row["order_items_text"], customers[row["customer_id"]]["phone_number"])
+        for row in client.tables["orders_testing"]
+    )
+    return result, customer_rows, orders
+
+
+@pytest.mark.parametrize("chunk_size", [7, 50, 1])
+def test_chunked_import_matches_whole_file_import(monkeypatch, chunk_size):
+    data = pos_export()
+    expected_result, expected_customers, expected_orders = import_export(monkeypatch, data, None)
+
+    result, customers, orders = import_export(monkeypatch, data, chunk_size)
+
+    assert customers == expected_customers
+    assert orders == expected_orders
+    assert result["receipts"] == expected_result["receipts"] == 300
+    # Every customer has details on some receipt, which the import must keep
+    assert all(email and address and name for _, name, email, address in customers)
+
+
+@pytest.mark.filterwarnings("ignore:Parsing dates in:UserWarning")
+def test_day_first_dates_do_not_depend_on_chunking(monkeypatch):
+    # Read value by value like format_receipt_id: 13/03 is March 13, 01/03 is January 3
+    data = pos_export(date_format="{day:02d}/03/2024")
+    _, _, expected_orders = import_export(monkeypatch, data, None)
+
+    _, _, orders = import_export(monkeypatch, data, 7)
+
+    assert orders == expected_orders
+    assert len(orders) == 300
+    assert {"R0_03_01_2024", "R12_13_03_2024"} <= {receipt_id for receipt_id, *_ in orders}
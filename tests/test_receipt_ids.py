@@ -0,0 +1,44 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import format_receipt_id, format_receipt_ids, parse_dates
+
+
+@pytest.fixture(autouse=True)
+def ignore_dayfirst_warnings():
+    # pandas warns about every value it reads day first, in both versions alike
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        yield
+
+
+def scalar(receipt_numbers, dates):
+    return [format_receipt_id(receipt_no, date) for receipt_no, date in zip(receipt_numbers, dates)]
+
+
+@pytest.mark.parametrize("dates", [
+    ["13/03/2024", "05/03/2024"],
+    ["05/03/2024", "13/03/2024", "03/05/2024", "31/12/2024"],
+    ["2024-03-05", "05/03/2024 14:30", "March 5, 2024", "13/03/2024"],
+    [None, np.nan, "garbage", "", "05/03/2024"],
+    [pd.Timestamp("2024-03-05"), "2024-03-06", pd.Timestamp("2024-03-07 10:00")],
+    ["2024-03-05T23:00:00+06:00", "2024-03-05T10:00:00+00:00"],
+])
+def test_matches_scalar_version(dates):
+    receipt_numbers = [f"R{index}" for index in range(len(dates))]
+
+    result = format_receipt_ids(pd.Series(receipt_numbers), pd.Series(dates, dtype=object))
+
+    assert result.tolist() == scalar(receipt_numbers, dates)
+
+
+def test_parses_each_date_like_a_single_value():
+    dates = pd.Series(["13/03/2024", "05/03/2024", "13/03/2024"], index=[7, 8, 9])
+
+    parsed = parse_dates(dates)
+
+    assert parsed.index.tolist() == [7, 8, 9]
+    assert parsed.tolist() == [pd.to_datetime(date) for date in dates]
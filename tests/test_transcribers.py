@@ -0,0 +1,83 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.data_import import transcribers
+from src.data_import.transcribers import WhisperTranscriber, merge_overlapping_texts, split_overlapping_chunks
+
+
+class StubPool:
+    created = []
+
+    def __init__(self, max_workers, mp_context, initializer, initargs):
+        time.sleep(0.01)  # widen the window for a second thread to start another pool
+        self.mp_context = mp_context
+        self.shut_down = False
+        StubPool.created.append(self)
+
+    def shutdown(self, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def stub_pool(monkeypatch):
+    StubPool.created = []
+    monkeypatch.setattr(transcribers, "ProcessPoolExecutor", StubPool)
+    return StubPool.created
+
+
+def test_pool_is_started_once_across_threads(stub_pool):
+    transcriber = WhisperTranscriber(workers=2)
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(transcriber.pool)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(stub_pool) == 1
+    assert all(pool is stub_pool[0] for pool in pools)
+    assert stub_pool[0].mp_context.get_start_method() == "spawn"
+
+
+def test_close_stops_the_pool_until_next_use(stub_pool):
+    transcriber = WhisperTranscriber(workers=2)
+    first = transcriber.pool
+
+    transcriber.close()
+    transcriber.close()
+
+    assert first.shut_down
+    assert transcriber.pool is not first
+    assert len(stub_pool) == 2
+
+
+def test_model_id_includes_the_language():
+    assert WhisperTranscriber("small", "bn").model_id == "whisper-small-bn"
+    assert WhisperTranscriber("small", "en").model_id != WhisperTranscriber("small", "bn").model_id
+
+
+@pytest.mark.parametrize("length", [1, 29, 30, 31, 58, 100])
+def test_chunks_overlap_and_cover_the_recording(length):
+    samples = np.arange(length)
+
+    chunks = split_overlapping_chunks(samples, chunk_length=30, overlap=2)
+
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert chunks[0][0] == 0 and chunks[-1][-1] == length - 1
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert list(previous[-2:]) == list(chunk[:2])
+
+
+def test_merge_drops_words_repeated_from_the_previous_chunk():
+    texts = ["amar nam rahim ami", "rahim ami pizza chai", "pizza chai delivery te"]
+
+    assert merge_overlapping_texts(texts) == "amar nam rahim ami pizza chai delivery te"
+
+
+def test_merge_keeps_chunks_that_do_not_overlap():
+    assert merge_overlapping_texts(["hello there", "", "general kenobi"]) == "hello there general kenobi"
+    # Overlaps longer than max_overlap_words are not looked for
+    assert merge_overlapping_texts(["a b c", "a b c d"], max_overlap_words=2) == "a b c a b c d"
@@ -0,0 +1,59 @@
+import httpx
+import pytest
+
+from src.data_import import db
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(db, "WRITE_RETRY_BASE_DELAY", 0)
+
+
+def fail_first_attempts(error, count=1):
+    attempts = []
+
+    def fail(table_name, operation, query):
+        attempts.append(operation)
+        return error if len(attempts) <= count else None
+    return fail
+
+
+def test_writes_size_capped_batches(fake_supabase):
+    rows = [{"content": "x" * 100, "n": i} for i in range(25)]
+    results = db.write_batches("memory_testing", rows, max_rows=10, max_bytes=1_000)
+
+    assert [result["rows"] for result in results] == [8, 8, 8, 1]
+    assert fake_supabase.tables["memory_testing"] == rows
+    assert db.summarize_write_results(results)["rows_written"] == 25
+
+
+def test_insert_is_retried_when_it_was_not_applied(fake_supabase):
+    fake_supabase.fail = fail_first_attempts(httpx.ConnectError("refused"))
+    results = db.write_batches("memory_testing", [{"n": 1}])
+
+    assert results[0]["ok"] and results[0]["attempts"] == 2
+    assert len(fake_supabase.tables["memory_testing"]) == 1
+
+
+def test_insert_is_not_retried_after_a_read_timeout(fake_supabase):
+    # The first attempt may have been committed, a retry could duplicate the rows
+    fake_supabase.fail = fail_first_attempts(httpx.ReadTimeout("timed out"))
+    results = db.write_batches("memory_testing", [{"n": 1}])
+
+    assert not results[0]["ok"] and results[0]["attempts"] == 1
+
+
+def test_upsert_is_retried_after_a_read_timeout(fake_supabase):
+    fake_supabase.fail = fail_first_attempts(httpx.ReadTimeout("timed out"))
+    results = db.write_batches("customers_testing", [{"phone_number": "+8801700000001"}], on_conflict="phone_number")
+
+    assert results[0]["ok"] and results[0]["attempts"] == 2
+
+
+def test_create_customers_reuses_existing_phone_numbers(fake_supabase):
+    fake_supabase.tables["customers_testing"].append({"customer_id": "existing", "phone_number": "+8801700000001"})
+    customers = db.create_customers(["+8801700000001", "+8801700000002", "+8801700000002"], use_test_tables=True)
+
+    assert customers["+8801700000001"]["customer_id"] == "existing"
+    assert customers["+8801700000002"]["customer_id"] == "customer-2"
+    assert len(fake_supabase.tables["customers_testing"]) == 2